@@ -0,0 +1,122 @@
+import numpy as np
+
+###################################################
+#### SAMPLE GRID FIELDS AT ARBITRARY POINT SETS ###
+###################################################
+# heads, K (or any (nrow,ncol) field) are sampled at points (x,y) in the model coordinates used
+# by the examples (x to the right from xul, y up from the bottom, rows counted down from yul).
+# the cell edges and centres are computed once (init_sampler), the points are located once
+# (locate_points) and every field is then sampled with a single fancy indexing call (sample_field):
+#   'nearest'  : value of the cell containing the point (same cell as SpatialReference.get_rc)
+#   'bilinear' : bilinear interpolation between the 4 surrounding cell centres (constant beyond
+#                the outermost cell centres)
+
+
+###############################################
+#### CELL EDGES AND CENTRES OF A MODEL GRID ###
+###############################################
+def init_sampler(delr, delc, xul, yul):
+    ## INPUT
+    # delr : (ncol,) column widths
+    # delc : (nrow,) row widths
+    # xul  : x coordinate of the upper left corner of the grid
+    # yul  : y coordinate of the upper left corner of the grid
+    ## OUTPUT
+    # gs : dict with the cell edges and centres measured from the upper left corner
+    delr = np.asarray(delr, dtype = float).reshape(-1,)
+    delc = np.asarray(delc, dtype = float).reshape(-1,)
+    xedge = np.concatenate([[0.0],np.cumsum(delr)]) # distance from xul (to the right)
+    yedge = np.concatenate([[0.0],np.cumsum(delc)]) # distance from yul (down)
+    gs = {'nrow'    : len(delc),
+          'ncol'    : len(delr),
+          'xul'     : xul,
+          'yul'     : yul,
+          'xedge'   : xedge,
+          'yedge'   : yedge,
+          'xcenter' : 0.5*(xedge[:-1]+xedge[1:]),
+          'ycenter' : 0.5*(yedge[:-1]+yedge[1:]),
+          # constant cell size (None for variable spacing): cells found by division, not by search
+          'dx'      : delr[0] if np.all(delr == delr[0]) else None,
+          'dy'      : delc[0] if np.all(delc == delc[0]) else None}
+    return gs
+
+
+def sampler_from_modflow(mf, xul, yul):
+    return init_sampler(mf.dis.delr.array,mf.dis.delc.array,xul,yul)
+
+
+##########################
+#### LOCATE THE POINTS ###
+##########################
+def _cell_index(edge, d, step = None):
+    # cell holding distance d (points on or beyond the grid edge go to the outermost cell)
+    if step is None:
+        i = np.searchsorted(edge,d,side = 'right')-1
+    else:
+        i = np.floor(d/step).astype(int)
+    return np.clip(i,0,len(edge)-2)
+
+
+def _center_weights(center, d, step = None):
+    # left centre index and weight of the right centre for linear interpolation between centres
+    if len(center) == 1:
+        return np.zeros(d.shape, dtype = int), np.zeros(d.shape)
+    if step is None:
+        i0 = np.searchsorted(center,d,side = 'right')-1
+    else:
+        i0 = np.floor(d/step-0.5).astype(int)
+    i0 = np.clip(i0,0,len(center)-2)
+    t = np.clip((d-center[i0])/(center[i0+1]-center[i0]),0.0,1.0)
+    return i0, t
+
+
+def locate_points(gs, x, y, method = 'nearest'):
+    ## INPUT
+    # gs     : grid data from init_sampler
+    # x, y   : point coordinates (any shape)
+    # method : 'nearest' or 'bilinear'
+    ## OUTPUT
+    # loc : dict with the flat cell indices ('idx', (npts,) or (npts,4)), the interpolation
+    #       weights ('wts', None for nearest), the cell row and column ('r','c') of each point
+    #       and the shape of the point set
+    x = np.asarray(x, dtype = float)
+    y = np.asarray(y, dtype = float)
+    dx = x.ravel()-gs['xul']
+    dy = gs['yul']-y.ravel()
+    r = _cell_index(gs['yedge'],dy,gs['dy'])
+    c = _cell_index(gs['xedge'],dx,gs['dx'])
+    loc = {'method' : method,
+           'shape'  : x.shape,
+           'r'      : r,
+           'c'      : c}
+    if method == 'nearest':
+        loc['idx'] = r*gs['ncol']+c
+        loc['wts'] = None
+    elif method == 'bilinear':
+        i0,ty = _center_weights(gs['ycenter'],dy,gs['dy'])
+        j0,tx = _center_weights(gs['xcenter'],dx,gs['dx'])
+        i1 = np.minimum(i0+1,gs['nrow']-1)
+        j1 = np.minimum(j0+1,gs['ncol']-1)
+        loc['idx'] = np.column_stack([i0*gs['ncol']+j0,i0*gs['ncol']+j1,i1*gs['ncol']+j0,i1*gs['ncol']+j1])
+        loc['wts'] = np.column_stack([(1-ty)*(1-tx),(1-ty)*tx,ty*(1-tx),ty*tx])
+    else:
+        raise Exception('method must be nearest or bilinear.')
+    return loc
+
+
+#######################
+#### SAMPLE A FIELD ###
+#######################
+def sample_field(loc, field):
+    ## INPUT
+    # loc   : located points from locate_points
+    # field : (nrow,ncol) field or (...,nrow,ncol) stack of fields (layers, time steps, ensemble)
+    ## OUTPUT
+    # values : field values at the points, shape (...,) + shape of the point set
+    field = np.asarray(field)
+    flat = field.reshape(field.shape[:-2]+(-1,))
+    if loc['wts'] is None:
+        values = flat[...,loc['idx']]
+    else:
+        values = np.einsum('...pk,pk->...p',flat[...,loc['idx']],loc['wts'])
+    return values.reshape(field.shape[:-2]+loc['shape'])
@@ -0,0 +1,187 @@
+import os
+import sys
+import numpy as np
+import scipy.linalg
+from scipy.spatial.distance import cdist
+from variogram import variogram_models
+from run_manager import start_pool, pool_run, stop_pool
+
+##########################################
+#### ITERATIVE ENSEMBLE SMOOTHER (IES) ###
+##########################################
+# ensemble alternative to the PEST / lm_inversion.py runs, on the same observations and weights
+# (pest\example.pst, read with pst_io.read_pst and lm_inversion.lm_problem).
+# parameters:
+#   'pilot_points' : pilot point values (kriged to the grid by the forward model, as PEST)
+#   'cells'        : K of every model cell (no kriging, no pilot points)
+# prior ensemble (N members):
+#   'kriging' : pilot point values drawn from the covariance of the pilot point variogram
+#               (C(h) = sill - gamma(h)), around PARVAL1 - kriging these draws gives fields with the
+#               variogram used by the kriging step ('pilot_points' only)
+#   'grf'     : gaussian random fields generated like the truth K (K_field\gaussian_random_fields.py,
+#               rescaled to [0,1], ((k+1)**4)-1), sampled at the pilot point cells for 'pilot_points'
+# every iteration runs the N members once in the pool of warm workers (run_manager.py) and moves
+# every member with the levenberg-marquardt form of the ensemble smoother (Chen and Oliver, 2013):
+#       dP = ensemble anomalies of the parameters       (N,npar) / sqrt(N-1)
+#       dD = weighted ensemble anomalies of the outputs (N,nobs) / sqrt(N-1) = (U S V^T)^T  (truncated svd)
+#       P  = P - ((dP^T V S (S^2+(lambda+1)I)^-1 U^T) (W (D - D_obs))^T)^T
+# the svd is of an nobs x N matrix and the update of the parameters is a product with an N x N
+# matrix, so the cost per iteration is N model runs plus O(npar N^2), whatever the number of parameters.
+
+parameters = 'pilot_points' # 'pilot_points' or 'cells'
+prior = 'kriging' # 'kriging' or 'grf'
+n_members = 50 # ensemble size N
+noptmax = 5 # number of iterations
+engine = 'mf2005' # forward model of the workers, 'mf2005' or 'python' (see forward_model.py)
+n_workers = None # number of parallel workers (number of cpus if None)
+seed = None # seed of the prior ensemble (None = random)
+
+
+########################
+#### PRIOR ENSEMBLES ###
+########################
+def prior_pp_kriging(pp, mean, n_members, seed = None):
+    ## INPUT
+    # pp        : pilot point data (x, y, variogram_model, variogram_parameters)
+    # mean      : (n_pp,) or scalar mean of the pilot point values (PARVAL1)
+    # n_members : ensemble size
+    ## OUTPUT
+    # P : (n_members,n_pp) pilot point values with the covariance of the variogram
+    xy = np.column_stack([np.asarray(pp['x']).ravel(),np.asarray(pp['y']).ravel()])
+    vp = pp['variogram_parameters']
+    pars = [vp['sill']-vp['nugget'],vp['range'],vp['nugget']]
+    h = cdist(xy,xy)
+    C = np.where(h > 0,vp['sill']-variogram_models[pp['variogram_model']](pars,h),vp['sill'])
+    L = scipy.linalg.cholesky(C+1e-10*vp['sill']*np.eye(len(xy)),lower = True)
+    z = np.random.default_rng(seed).standard_normal((n_members,len(xy)))
+    return mean+z.dot(L.T)
+
+
+def prior_grf(n_members, shape, fname, seed = None, n_workers = None, power = 4):
+    ## INPUT
+    # n_members : ensemble size
+    # shape     : (nrow,ncol) model grid
+    # fname     : .npy file for the ensemble (memory mapped)
+    # power     : transform of the truth K, ((k+1)**power)-1 of the field rescaled to [0,1]
+    ## OUTPUT
+    # K : (n_members,nrow,ncol) memory mapped K fields
+    sys.path.append(os.path.dirname(os.path.abspath(__file__))+os.sep+'modflow'+os.sep+'K_field')
+    from gaussian_random_fields import gaussian_random_field_ensemble
+    fields,entropy = gaussian_random_field_ensemble(n_members,fname,shape = shape,dtype = np.float64,
+                                                    seed = seed,n_workers = n_workers)
+    K = np.lib.format.open_memmap(fname, mode = 'r+')
+    for i in np.arange(n_members):
+        k = (K[i]-np.amin(K[i]))/(np.amax(K[i])-np.amin(K[i]))
+        K[i] = ((k+1)**power)-1
+    K.flush()
+    return K
+
+
+####################
+#### IES UPGRADE ###
+####################
+def ies_upgrade(P, D, Dobs, weight, lam, eigthresh = 1e-6):
+    ## INPUT
+    # P      : (N,npar) parameter ensemble (estimated parameters, log10 for log transformed)
+    # D      : (N,nobs) simulated observations of each member
+    # Dobs   : (N,nobs) observations (perturbed by the observation noise, or the same for all members)
+    # weight : (nobs,) observation weights (1/standard deviation)
+    # lam    : marquardt lambda
+    # eigthresh : singular values below eigthresh*largest are dropped
+    ## OUTPUT
+    # P_new : (N,npar) upgraded ensemble
+    N = len(P)
+    dP = (P-np.mean(P,axis = 0))/np.sqrt(N-1)
+    dD = weight*(D-np.mean(D,axis = 0))/np.sqrt(N-1)
+    R = weight*(D-Dobs)
+    U,s,Vt = np.linalg.svd(dD.T,full_matrices = False) # (nobs,k) (k,) (k,N), k <= N
+    keep = s > eigthresh*s[0]
+    U,s,Vt = U[:,keep],s[keep],Vt[keep,:]
+    # (N,N) mixing matrix, then one (N,npar) product
+    X = Vt.T.dot((s/(s**2+lam+1.0))[:,np.newaxis]*U.T.dot(R.T))
+    return P-X.T.dot(dP)
+
+
+#######################
+#### IES ITERATIONS ###
+#######################
+def ies_run(P0, run_batch, obsval, weight, islog = False, lbnd = -np.inf, ubnd = np.inf, noptmax = 5,
+            lam = None, obs_noise = False, seed = None, verbose = True):
+    ## INPUT
+    # P0        : (N,npar) prior ensemble (native parameters)
+    # run_batch : function (N,npar) native parameter sets -> (N,nobs) simulated observations
+    # obsval, weight : (nobs,) observations and weights
+    # islog     : parameters estimated as log10 (scalar or (npar,))
+    # lbnd, ubnd : parameter bounds (native)
+    # lam       : initial marquardt lambda (10**floor(log10(mean phi/(2 nobs))) if None)
+    # obs_noise : if True every member matches its own observations, perturbed with sd 1/weight
+    ## OUTPUT
+    # res : dict with the posterior ensemble 'P', its outputs 'D', the objective function of every
+    #       member 'phi' and the mean phi and lambda of every iteration
+    islog = np.broadcast_to(islog,(P0.shape[1],))
+    to_est = lambda P: np.where(islog,np.log10(np.maximum(P,1e-30)),P)
+    to_nat = lambda B: np.clip(np.where(islog,10.0**np.where(islog,B,0.0),B),lbnd,ubnd)
+    P = to_nat(to_est(np.asarray(P0, dtype = float)))
+    D = run_batch(P)
+    Dobs = np.repeat(obsval[np.newaxis,:],len(P),axis = 0)
+    if obs_noise:
+        Dobs = Dobs+np.random.default_rng(seed).standard_normal(Dobs.shape)/np.where(weight > 0,weight,np.inf)
+    phi = np.sum((weight*(D-Dobs))**2,axis = 1)
+    if lam is None:
+        lam = 10.0**np.floor(np.log10(max(np.mean(phi)/(2.0*len(obsval)),1e-10)))
+    phi_history,lambda_history = [np.mean(phi)],[lam]
+    for it in np.arange(noptmax):
+        P_new = to_nat(ies_upgrade(to_est(P),D,Dobs,weight,lam))
+        D_new = run_batch(P_new) # N model runs per iteration
+        phi_new = np.sum((weight*(D_new-Dobs))**2,axis = 1)
+        if verbose:
+            print('iteration '+str(it+1)+': mean phi '+'{:.6g}'.format(np.mean(phi))+' -> '+
+                  '{:.6g}'.format(np.mean(phi_new))+' (lambda '+'{:.4g}'.format(lam)+')')
+        if np.mean(phi_new) < np.mean(phi):
+            P,D,phi = P_new,D_new,phi_new
+            lam = lam/2.0
+        else:
+            lam = lam*10.0 # rejected, smaller step next iteration
+        phi_history.append(np.mean(phi))
+        lambda_history.append(lam)
+    res = {'P'             : P,
+           'D'             : D,
+           'phi'           : phi,
+           'phi_history'   : np.array(phi_history),
+           'lambda_history': np.array(lambda_history)}
+    return res
+
+
+if __name__ == '__main__': # required by the process pools on Windows
+    model_dir = os.path.dirname(os.path.abspath(__file__))
+    pest_dir = os.path.dirname(model_dir)+os.sep+'pest'
+    results_dir = os.path.dirname(model_dir)+os.sep+'Model_results' # outside Model, not copied to the workers
+    sys.path.append(pest_dir)
+    from pst_io import read_pst
+    from lm_inversion import lm_problem
+    from forward_model import init_forward_model
+    prob = lm_problem(read_pst(pest_dir+os.sep+'example.pst'))
+    fm = init_forward_model(model_dir, engine = engine)
+    pp = fm['pp']
+
+    if prior == 'kriging':
+        if parameters != 'pilot_points':
+            raise Exception('kriging prior requires parameters = pilot_points.')
+        P0 = prior_pp_kriging(pp,prob['parval1'],n_members,seed)
+    else:
+        K = prior_grf(n_members,fm['grid_shape'],results_dir+os.sep+'ies_prior_K.npy',seed,n_workers)
+        if parameters == 'pilot_points':
+            P0 = K[:,fm['obs_rows'],fm['obs_cols']] # K of the pilot point cells
+        else:
+            P0 = np.asarray(K).reshape(n_members,-1)
+    if parameters == 'pilot_points':
+        islog,lbnd,ubnd = prob['islog'],prob['lbnd'],prob['ubnd']
+    else:
+        islog,lbnd,ubnd = prob['islog'][0],prob['lbnd'][0],prob['ubnd'][0] # bounds of the hk group for every cell
+
+    rm = start_pool(model_dir,n_workers,engine)
+    res = ies_run(P0,lambda par_sets: pool_run(rm,par_sets,parameters),prob['obsval'],prob['weight'],
+                  islog,lbnd,ubnd,noptmax,seed = seed)
+    stop_pool(rm)
+    np.savez(results_dir+os.sep+'ies_results.npz',P = res['P'],D = res['D'],phi = res['phi'],
+             phi_history = res['phi_history'],lambda_history = res['lambda_history'])
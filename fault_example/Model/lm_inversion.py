@@ -0,0 +1,301 @@
+import os
+import sys
+import numpy as np
+from run_manager import start_pool, pool_run, stop_pool, fd_increments, fd_par_sets, fd_jacobian
+
+###################################################
+#### IN-PROCESS LEVENBERG-MARQUARDT (PEST .PST) ###
+###################################################
+# runs the inversion set up in pest\example.pst (pest\pest_input.py) without the PEST executable:
+# parameters, bounds, transforms, observations, weights, prior information and the control
+# settings are read from the control file (pst_io.read_pst), the model is called as a function
+# (forward runs in a persistent pool of warm workers, run_manager.py), no template, instruction
+# or model command line files are used.
+# each iteration:
+#   jacobian  : finite differences with the increments of the parameter groups (all runs in one
+#               batch), or adjoint sensitivities (method = 'adjoint', in-process flow solver)
+#   upgrade   : marquardt lambdas lam*RLAMFAC^k (NUMLAM of them, around the current lambda) from one
+#               eigen decomposition of the scaled normal matrix, all lambdas run in one batch, the best
+#               parameter set is kept (PEST tests the lambdas one after the other, PHIRATSUF/PHIREDLAM
+#               are not needed when they are run together). If no lambda improves the objective
+#               function, the parameters do not move and the next iteration reuses the jacobian and
+#               eigen decomposition, running only NUMLAM larger lambdas
+#   limits    : RELPARMAX (relative limited, FACORIG) and FACPARMAX (factor limited) by scaling the
+#               whole upgrade vector, then the parameter bounds
+# parameters with PARTRANS 'log' are estimated as log10 (prior information uses log(PARNME)),
+# 'fixed' parameters are not adjusted. In regularisation mode the prior information weights are
+# multiplied by the fixed weight factor WFINIT (no weight factor adjustment).
+# the optimised parameters are written as a PEST .par file (read by example_MF_pest_results.py).
+
+method = 'parallel' # jacobian: 'parallel' (finite differences, run_manager.py) or 'adjoint' (engine = 'python' only)
+engine = 'mf2005' # forward model of the workers, 'mf2005' or 'python' (see forward_model.py)
+n_workers = None # number of parallel workers (number of cpus if None)
+
+
+##############################################
+#### INVERSE PROBLEM FROM THE CONTROL FILE ###
+##############################################
+def lm_problem(pst):
+    ## INPUT
+    # pst : parsed control file (pst_io.read_pst)
+    ## OUTPUT
+    # prob : dict with parameter, observation and prior information arrays and the control settings
+    par = pst['parameter data']
+    if len(pst.get('tied parameters',[])) > 0:
+        raise Exception('tied parameters are not supported.')
+    for group in pst.get('observation groups',[]):
+        if len(group) > 1:
+            raise Exception('observation group '+group[0]+' has a COVFILE, not supported.')
+    obs = pst['observation data']
+    ctl = pst['control data']
+    islog = par['partrans'] == 'log'
+    prob = {'parnme'   : par['parnme'],
+            'parval1'  : par['parval1'].copy(),
+            'scale'    : par['scale'],
+            'offset'   : par['offset'],
+            'lbnd'     : par['parlbnd'],
+            'ubnd'     : par['parubnd'],
+            'islog'    : islog,
+            'adj'      : par['partrans'] != 'fixed',
+            'factor'   : par['parchglim'] == 'factor',
+            'obsval'   : obs['obsval'],
+            'weight'   : obs['weight'],
+            'rlambda1' : float(ctl[3][0]),
+            'rlamfac'  : abs(float(ctl[3][1])),
+            'numlam'   : int(ctl[3][4]),
+            'relparmax': float(ctl[4][0]),
+            'facparmax': float(ctl[4][1]),
+            'facorig'  : float(ctl[4][2]),
+            'phiredswh': float(ctl[5][0]),
+            'noptmax'  : int(ctl[6][0]),
+            'phiredstp': float(ctl[6][1]),
+            'nphistp'  : int(ctl[6][2]),
+            'nphinored': int(ctl[6][3]),
+            'relparstp': float(ctl[6][4]),
+            'nrelpar'  : int(ctl[6][5])}
+    if np.any(islog & (prob['parval1'] <= 0)):
+        raise Exception('log transformed parameters must be greater than zero.')
+
+    # derivative increments of the group of each parameter
+    groups = {tok[0]: tok for tok in pst['parameter groups']}
+    pargp = [groups[name] for name in par['pargp'].tolist()]
+    prob['inctyp'] = np.array([tok[1] for tok in pargp])
+    prob['derinc'] = np.array([float(tok[2]) for tok in pargp])
+    prob['derinclb'] = np.array([float(tok[3]) for tok in pargp])
+    # all perturbed runs are in one batch, so every adjustable parameter needs the same FORCEN
+    forcen = np.unique([tok[4] for tok,adj in zip(pargp,prob['adj']) if adj])
+    if len(forcen) > 1:
+        raise Exception('parameter groups with different FORCEN ('+', '.join(forcen)+') are not supported.')
+    prob['forcen'] = forcen[0] if len(forcen) > 0 else 'always_2'
+
+    # prior information as linear equations A b = pival in the estimated (log10) parameters
+    prior = pst.get('prior information',np.zeros(0))
+    prob['A'] = prior_matrix(prior,par['parnme'],islog)
+    prob['pival'] = prior['pival'] if len(prior) > 0 else np.zeros(0)
+    wprior = prior['weight'] if len(prior) > 0 else np.zeros(0)
+    if ctl[0][1] == 'regularisation' and 'regularisation' in pst and len(prior) > 0:
+        regul = np.char.startswith(prior['obgnme'],'regul')
+        wprior = np.where(regul,wprior*float(pst['regularisation'][1][0]),wprior) # WFINIT
+    prob['pweight'] = wprior
+    return prob
+
+
+def prior_matrix(prior, parnme, islog):
+    # (nprior,npar) coefficients of the prior information equations 'PIFAC * PARNME + ...'
+    col = dict(zip(parnme.tolist(),range(len(parnme))))
+    A = np.zeros((len(prior),len(parnme)))
+    for i,eqn in enumerate(prior['equation'].tolist() if len(prior) > 0 else []):
+        tok = eqn.replace('*',' * ').split()
+        sign = 1.0
+        k = 0
+        while k < len(tok):
+            if tok[k] in ('+','-'):
+                sign = 1.0 if tok[k] == '+' else -1.0
+                k = k+1
+            fac,name = float(tok[k]),tok[k+2]
+            k = k+3
+            uselog = name.lower().startswith('log(')
+            if uselog:
+                name = name[4:-1]
+            j = col[name]
+            if uselog != islog[j]:
+                raise Exception('prior information on '+name+' must use log() if and only if it is log transformed.')
+            A[i,j] = A[i,j]+sign*fac
+            sign = 1.0
+    return A
+
+
+#################################
+#### TRANSFORMS AND OBJECTIVE ###
+#################################
+def to_estimated(prob, p):
+    return np.where(prob['islog'],np.log10(np.where(prob['islog'],p,1.0)),p)
+
+
+def to_native(prob, b):
+    return np.where(prob['islog'],10.0**np.where(prob['islog'],b,0.0),b)
+
+
+def residuals(prob, p, sim):
+    # weighted residuals of the observations and of the prior information (rows of the objective function)
+    r = prob['weight']*(prob['obsval']-sim)
+    if len(prob['A']) > 0:
+        r = np.concatenate([r,prob['pweight']*(prob['pival']-prob['A'].dot(to_estimated(prob,p)))])
+    return r
+
+
+def objective(prob, p, sim):
+    r = residuals(prob,p,sim)
+    return np.sum(r**2)
+
+
+############################
+#### UPGRADE WITH LIMITS ###
+############################
+def limit_upgrade(prob, p, b, db):
+    ## INPUT
+    # p, b : current native and estimated parameters
+    # db   : (nlam,npar) upgrade vectors in estimated parameters
+    ## OUTPUT
+    # p_new : (nlam,npar) native parameters, upgrade scaled down to RELPARMAX / FACPARMAX, then bounded
+    with np.errstate(divide = 'ignore',invalid = 'ignore'):
+        dp = to_native(prob,b+db)-p
+        # relative limited: |dp| <= RELPARMAX*max(|p|,FACORIG*|p0|)
+        lim = prob['relparmax']*np.maximum(np.abs(p),prob['facorig']*np.abs(prob['parval1']))
+        a_rel = np.where(prob['islog'],
+                         np.where(db > 0,np.log10(1+lim/np.abs(p))/db,np.where(lim < np.abs(p),np.log10(1-lim/np.abs(p))/db,np.inf)),
+                         lim/np.abs(dp))
+        # factor limited: 1/FACPARMAX <= p_new/p <= FACPARMAX
+        fac = prob['facparmax']
+        a_fac = np.where(prob['islog'],np.log10(fac)/np.abs(db),
+                         np.where(dp/p > 0,(fac-1)*np.abs(p)/np.abs(dp),(1-1/fac)*np.abs(p)/np.abs(dp)))
+    alpha = np.where(prob['factor'],a_fac,a_rel)
+    alpha = np.where(np.isfinite(alpha) & (db != 0),alpha,np.inf)
+    alpha = np.minimum(1.0,np.amin(alpha,axis = 1))[:,np.newaxis]
+    p_new = to_native(prob,b+alpha*db)
+    return np.clip(p_new,prob['lbnd'],prob['ubnd'])
+
+
+#################
+#### JACOBIAN ###
+#################
+def fd_lm_jacobian(prob, p, run_batch, forcen):
+    # finite differences of the adjustable parameters, all perturbed runs in one batch
+    adj = np.where(prob['adj'])[0]
+    inc = fd_increments(p[adj],prob['derinc'][adj],prob['derinclb'][adj],prob['inctyp'][adj])
+    sets = fd_par_sets(p[adj],inc,forcen)
+    par_sets = np.repeat(p[np.newaxis,:],len(sets),axis = 0)
+    par_sets[:,adj] = sets
+    Jadj,sim = fd_jacobian(run_batch(par_sets),inc,forcen)
+    J = np.zeros((len(sim),len(p)))
+    J[:,adj] = Jadj
+    return J
+
+
+######################
+#### LM ITERATIONS ###
+######################
+def lm_invert(prob, run_batch, jacobian = None, verbose = True):
+    ## INPUT
+    # prob      : inverse problem from lm_problem
+    # run_batch : function (nrun,npar) parameter sets -> (nrun,nobs) simulated observations
+    # jacobian  : function (npar,) parameters -> (nobs,npar) jacobian (finite differences with
+    #             run_batch if None)
+    ## OUTPUT
+    # res : dict with the optimised parameters 'p', their simulated observations 'sim', the objective
+    #       function 'phi', and the history of each iteration ('phi_history', 'lambda_history')
+    adj = prob['adj']
+    p = prob['parval1'].copy()
+    sim = run_batch(p[np.newaxis,:])[0]
+    phi = objective(prob,p,sim)
+    lam = prob['rlambda1']
+    forcen = 'always_2' if prob['forcen'] == 'switch' else prob['forcen']
+    ks = np.arange(prob['numlam'])-(prob['numlam']-1)//2 # lambdas around the current one
+    phi_history,lambda_history = [phi],[]
+    nphistp = nphinored = nrelpar = 0
+    reuse = False # True when p did not move: same jacobian and eigen decomposition
+    for it in np.arange(prob['noptmax']):
+        if not reuse:
+            b = to_estimated(prob,p)
+            J = jacobian(p) if jacobian is not None else fd_lm_jacobian(prob,p,run_batch,forcen)
+            # jacobian of the weighted residual rows in estimated parameters (d p/d log10 p = p ln10)
+            Z = J*np.where(prob['islog'],p*np.log(10),1.0)
+            Z = prob['weight'][:,np.newaxis]*Z
+            if len(prob['A']) > 0:
+                Z = np.vstack([Z,prob['pweight'][:,np.newaxis]*prob['A']])
+            Z = Z[:,adj]
+            r = residuals(prob,p,sim)
+
+            # scaled normal matrix, one eigen decomposition for every lambda
+            N = Z.T.dot(Z)
+            s = 1.0/np.sqrt(np.where(np.diag(N) > 0,np.diag(N),1.0))
+            e,V = np.linalg.eigh(s[:,np.newaxis]*N*s[np.newaxis,:])
+            g = V.T.dot(s*Z.T.dot(r))
+            lams = lam*prob['rlamfac']**ks
+        else:
+            lams = lam*prob['rlamfac']**np.arange(prob['numlam']) # only lambdas larger than those tested
+        db = np.zeros((len(lams),len(p)))
+        db[:,adj] = s*(V.dot((g[:,np.newaxis]/(np.maximum(e,0)[:,np.newaxis]+lams[np.newaxis,:])))).T
+        trials = limit_upgrade(prob,p,b,db)
+
+        sims = run_batch(trials)
+        phis = np.array([objective(prob,trials[k],sims[k]) for k in np.arange(len(lams))])
+        best = np.argmin(phis)
+        if verbose:
+            print('iteration '+str(it+1)+': phi '+'{:.6g}'.format(phi)+' -> '+'{:.6g}'.format(phis[best])+
+                  ' (lambda '+'{:.4g}'.format(lams[best])+')')
+        if phis[best] < phi:
+            relchg = np.amax(np.abs(trials[best]-p)[adj]/np.maximum(np.abs(p[adj]),1e-30))
+            phired = (phi-phis[best])/phi
+            p,sim,phi,lam = trials[best],sims[best],phis[best],lams[best]
+            nphinored = 0
+            reuse = False
+        else:
+            relchg,phired = 0.0,0.0
+            lam = lams[-1]*prob['rlamfac'] # no improvement: larger lambdas next time
+            nphinored = nphinored+1
+            reuse = True
+        phi_history.append(phi)
+        lambda_history.append(lam)
+        if forcen == 'always_2' and prob['forcen'] == 'switch' and phired < prob['phiredswh']:
+            forcen = 'always_3' # central differences once the objective function decreases slowly
+            reuse = reuse and jacobian is not None # finite difference jacobian recomputed with central differences
+
+        # termination criteria (as PEST)
+        nphistp = nphistp+1 if phired <= prob['phiredstp'] else 0
+        nrelpar = nrelpar+1 if relchg <= prob['relparstp'] else 0
+        if phi == 0 or nphistp >= prob['nphistp'] or nphinored >= prob['nphinored'] or nrelpar >= prob['nrelpar']:
+            break
+    res = {'p'             : p,
+           'sim'           : sim,
+           'phi'           : phi,
+           'phi_history'   : np.array(phi_history),
+           'lambda_history': np.array(lambda_history)}
+    return res
+
+
+def write_par(fname, prob, p):
+    # PEST parameter value file: PRECIS DPOINT, then PARNME PARVAL SCALE OFFSET
+    rows = zip(prob['parnme'].tolist(),p.tolist(),prob['scale'].tolist(),prob['offset'].tolist())
+    file = open(fname,'w')
+    file.write('single point\n')
+    file.write(''.join([' %-12s %22.15E %12.4E %12.4E\n' % row for row in rows]))
+    file.close()
+
+
+if __name__ == '__main__': # required by the process pool of run_manager.py on Windows
+    model_dir = os.path.dirname(os.path.abspath(__file__))
+    pest_dir = os.path.dirname(model_dir)+os.sep+'pest'
+    sys.path.append(pest_dir)
+    from pst_io import read_pst
+    prob = lm_problem(read_pst(pest_dir+os.sep+'example.pst'))
+
+    jacobian = None
+    if method == 'adjoint':
+        from forward_model import init_forward_model, jacobian_run
+        fm = init_forward_model(model_dir, engine = 'python')
+        jacobian = lambda p: jacobian_run(fm,p)
+    rm = start_pool(model_dir,n_workers,engine)
+    res = lm_invert(prob,lambda par_sets: pool_run(rm,par_sets),jacobian)
+    stop_pool(rm)
+    write_par(pest_dir+os.sep+'example.par',prob,res['p'])
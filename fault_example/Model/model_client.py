@@ -0,0 +1,51 @@
+import os
+import sys
+import socket
+
+####################################
+#### CLIENT FOR THE MODEL SERVER ###
+####################################
+# model command for PEST when model_server.py is running (see modflow\run_model_client.bat):
+# sends one request to the server and waits until the forward run has written the .hdsraw file.
+# kept free of numpy/flopy imports so starting it costs next to nothing
+
+SOCKET_NAME = 'model_server.sock' # unix socket, created next to this script
+PORT = 50007                      # local TCP port used where unix sockets are not available (Windows)
+
+
+#######################
+#### SERVER ADDRESS ###
+#######################
+def server_address(model_dir):
+    if hasattr(socket,'AF_UNIX'):
+        return socket.AF_UNIX, model_dir+os.sep+SOCKET_NAME
+    return socket.AF_INET, ('127.0.0.1',PORT)
+
+
+################################################
+#### SEND REQUEST ('run' or 'stop') AND WAIT ###
+################################################
+def send_request(model_dir, request = 'run'):
+    family,address = server_address(model_dir)
+    sock = socket.socket(family,socket.SOCK_STREAM)
+    sock.connect(address)
+    sock.sendall((request+'\n').encode())
+    reply = b''
+    while not reply.endswith(b'\n'):
+        chunk = sock.recv(4096)
+        if not chunk:
+            break
+        reply = reply+chunk
+    sock.close()
+    return reply.decode().strip()
+
+
+if __name__ == '__main__':
+    model_dir = os.path.dirname(os.path.abspath(__file__))
+    request = 'run'
+    if len(sys.argv) > 1:
+        request = sys.argv[1]
+    reply = send_request(model_dir,request)
+    if reply != 'ok':
+        print(reply)
+        sys.exit(1)
@@ -1,33 +1,20 @@
-# write hyd file to hds raw file type
+# write final heads at the observation cells to hds raw file type
 import numpy as np
-import flopy
 import os
+import sys
+
+# model being used with PEST
 fmain = r'C:\PEST_examples\fault_example'
-# load model being used with PEST
 mf_path      = fmain +os.sep+'Model'+os.sep+'modflow'
 mf_modelname = 'example'
-mf           = flopy.modflow.Modflow.load(mf_path+os.sep+mf_modelname+ '.nam')# import modflow object
-
-# read hydmod output and convert to text file
-hydlbl_len=20# length of hydmod labels
-#print(hydlbl_len)
-obsout = flopy.utils.observationfile.HydmodObs(mf_modelname+'.hyd.bin', verbose=True, hydlbl_len=hydlbl_len)
-obsnames = obsout.get_obsnames()
-heads_raw = []
-data = obsout.get_data()
-# create new file
-file = open(mf_modelname+'.hdsraw', 'w')
-# write header
-header = 'HEADS OUTPUT FOR USE WITH PEST \n'
-file.writelines(header)
+sys.path.append(os.path.dirname(mf_path)) # ...\Model
+from head_observations import read_final_heads, write_hdsraw
+from pilot_point_data import load_pp_data
 
-for i,obs in enumerate(obsnames,0):
-    #print(obs)
+# observation cells (pilot point locations, same order as the PEST instruction file)
+pp = load_pp_data(os.path.dirname(mf_path)+os.sep+'pilot_point_data') # only r and c are read
+n_pp = pp['nx']*pp['ny']
 
-    #print(i)
-    head = data[obs][-1] # get head  at final timestep and format 
-    heads_raw.append(head)
-    name = 'obs'+"{:02d}".format(i)
-    line = name + r' '  + "{:02f}".format(head)+' \n'
-    file.writelines(line)
-file.close()
+# heads of the final time step straight from the binary head file (no HYDMOD, no flopy model load)
+heads_raw = read_final_heads(mf_path+os.sep+mf_modelname+'.hds', pp['r'].reshape(n_pp,), pp['c'].reshape(n_pp,))
+write_hdsraw(mf_path+os.sep+mf_modelname+'.hdsraw', heads_raw)
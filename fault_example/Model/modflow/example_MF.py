@@ -74,59 +74,65 @@ def example1_Modflow(data):
     lpf = flopy.modflow.ModflowLpf(mf, hk=hk, vka=vka, sy=sy, ss=ss, laytyp=laytyp,ipakcb=53)
     pcg = flopy.modflow.ModflowPcg(mf)
 
-    # HYDMOD package for reporting heads only at select locations
-    nhyd = data['pp']['nx']*data['pp']['ny'] # number of locations to report heads at
-    ihydun = 1 # If ihydun is non-zero hydmod data will be saved
-    hydnoh = 9999# is a user-specified value that is output if a value cannot be computed at a hydrograph location
+    # HYDMOD package for reporting heads only at select locations (optional, the .hdsraw file
+    # for PEST is written from the .hds file, see Model\head_observations.py)
+    if data.get('hydmod', False):
+        nhyd = data['pp']['nx']*data['pp']['ny'] # number of locations to report heads at
+        ihydun = 1 # If ihydun is non-zero hydmod data will be saved
+        hydnoh = 9999# is a user-specified value that is output if a value cannot be computed at a hydrograph location
 
-    obs_data = []# list of lists   or numpy array (nhyd, 7) - Each row of obsdata includes data defining pckg (3 character string), arr (2 characater string), intyp (1 character string) klay (int), xl (float), yl (float), hydlbl (14 character string) for each observation.
+        obs_data = []# list of lists   or numpy array (nhyd, 7) - Each row of obsdata includes data defining pckg (3 character string), arr (2 characater string), intyp (1 character string) klay (int), xl (float), yl (float), hydlbl (14 character string) for each observation.
 
-    x_pos = data['pp']['x'].reshape(nhyd,)
-    x_pos = x_pos - grid_ref.xul
+        x_pos = data['pp']['x'].reshape(nhyd,)
+        x_pos = x_pos - grid_ref.xul
 
-    y_pos = data['pp']['y'].reshape(nhyd,)
-    y_pos = y_pos + grid_ref.yul
+        y_pos = data['pp']['y'].reshape(nhyd,)
+        y_pos = y_pos + grid_ref.yul
     
-    for obs in np.arange(0,nhyd):
-        pckg = 'BAS' # is a 3-character flag to indicate which package is to be addressed by hydmod for the hydrograph of each observation point.
-        arr = 'HD' # text code indicating which model data value is to be accessed for the hydrograph of each observation point.
-        intyp = 'C'
-        klay = 0
-        xl = "{:.2E}".format(x_pos[obs])
-        yl = "{:.2E}".format(y_pos[obs])
-
-        #print(xl)
-        hydlbl = 'obs'+str("{:02d}".format(obs))
-        #print(len(hydlbl))
-        obs_data.append([pckg,arr,intyp,klay,xl,yl,hydlbl])
+        for obs in np.arange(0,nhyd):
+            pckg = 'BAS' # is a 3-character flag to indicate which package is to be addressed by hydmod for the hydrograph of each observation point.
+            arr = 'HD' # text code indicating which model data value is to be accessed for the hydrograph of each observation point.
+            intyp = 'C'
+            klay = 0
+            xl = "{:.2E}".format(x_pos[obs])
+            yl = "{:.2E}".format(y_pos[obs])
+
+            #print(xl)
+            hydlbl = 'obs'+str("{:02d}".format(obs))
+            #print(len(hydlbl))
+            obs_data.append([pckg,arr,intyp,klay,xl,yl,hydlbl])
 
     
-    hymod = flopy.modflow.mfhyd.ModflowHyd(model = mf,
-                                           nhyd = nhyd,
-                                           ihydun = ihydun,
-                                           hydnoh = hydnoh,
-                                           obsdata = obs_data,
-                                           extension = ['hyd','hyd.bin'])
+        hymod = flopy.modflow.mfhyd.ModflowHyd(model = mf,
+                                               nhyd = nhyd,
+                                               ihydun = ihydun,
+                                               hydnoh = hydnoh,
+                                               obsdata = obs_data,
+                                               extension = ['hyd','hyd.bin'])
     
     
-    # Output control
-    sp_data_OC = {}
-    for kper in range(nper):
-        for kstp in range(nstp[kper]):
-            sp_data_OC[(kper, kstp)] = ['save head',
-                                        'save drawdown',
-                                        'save budget']
+    # Output control, only what the consumers of the model output read (Model\output_control.py):
+    # PEST only needs the heads of the final time step at the observation cells
+    sp_data_OC = plan_output_control(nper, nstp, data.get('oc_consumers', ['heads']))
             
             
 ##    oc = flopy.modflow.ModflowOc(mf, stress_period_data=sp_data_OC,
 ##                                 compact=True)
+##    oc = flopy.modflow.ModflowOc(mf, stress_period_data=sp_data_OC,
+##                                 compact=True, chedfm ='('+str(nrow)+'G11.4)LABEL', extension = ['oc','hds','ddn','cbc','ibo','hyd'] )
+    # no chedfm: the heads are saved as a binary file, read by Model\head_observations.py and Model\binary_heads.py
     oc = flopy.modflow.ModflowOc(mf, stress_period_data=sp_data_OC,
-                                 compact=True, chedfm ='('+str(nrow)+'G11.4)LABEL', extension = ['oc','hds','ddn','cbc','ibo','hyd'] )
+                                 compact=True, extension = ['oc','hds','ddn','cbc','ibo','hyd'] )
 
 
     # Write the model input files
     mf.write_input()
 
+    # point the .lpf file to an external hk array file, which is rewritten directly
+    # by Krige_pilot_points.py during PEST runs (no flopy model load needed)
+    if data.get('hk_array_file', False):
+        reference_hk_array(mf, 'hk.ref')
+
 
     # Run the model
     success, mfoutput = mf.run_model(silent=False, pause=False, report=False)
@@ -134,29 +140,16 @@ def example1_Modflow(data):
         raise Exception('MODFLOW did not terminate normally.')
 
 
-    # read hydmod output and convert to text file
-    hydlbl_len=20# length of hydmod labels
-    #print(hydlbl_len)
-    obsout = flopy.utils.observationfile.HydmodObs(modelname+'.hyd.bin', verbose=True, hydlbl_len=hydlbl_len)
-    obsnames = obsout.get_obsnames()
-    heads_raw = []
-    data = obsout.get_data()
-    # create new file
-    file = open(modelname+'.hdsraw', 'w')
-    # write header
-    header = 'HEADS OUTPUT FOR USE WITH PEST \n'
-    file.writelines(header)
-
-    for i,obs in enumerate(obsnames,0):
-        #print(obs)
-
-        #print(i)
-        head = data[obs][-1] # get head  at final timestep and format 
-        heads_raw.append(head)
-        name = 'obs'+"{:02d}".format(i)
-        line = name + r' '  + "{:02f}".format(head)+' \n'
-        file.writelines(line)
-    file.close()
+    # heads of the final time step at the observation cells, written to the .hdsraw file read by PEST
+    heads_raw = read_final_heads(modelname+'.hds', data['pp']['r'].ravel(), data['pp']['c'].ravel())
+    write_hdsraw(modelname+'.hdsraw', heads_raw)
+
+    # compare the in-process flow solver (Model\flow_solver.py) with mf2005 at the observation cells
+    if data.get('validate_flow_solver', False):
+        fs = flow_solver_from_modflow(mf)
+        h_py = solve_heads(fs, hk)
+        dh = obs_heads(h_py, data['pp']['r'], data['pp']['c']) - heads_raw
+        print('flow solver vs mf2005 - max abs head difference at observations: '+str(np.max(np.abs(dh))))
 
     
         
@@ -173,9 +166,17 @@ hk_in = np.ones([nrow,ncol])
 
 # load pilot point location data
 fpath = r'C:\PEST_examples\fault_example\Model'
-pp_data = np.load(fpath + os.sep + 'pilot_point_and_variogram_data.npy').flatten()[0]
+sys.path.append(fpath)
+from pilot_point_data import load_pp_data
+pp_data = load_pp_data(fpath + os.sep + 'pilot_point_data')
+
+# external hk array file writer
+from hk_array import reference_hk_array
+from flow_solver import flow_solver_from_modflow, solve_heads, obs_heads
+from output_control import plan_output_control
+from head_observations import read_final_heads, write_hdsraw
 
-data_in = {'modelname': 'example','hk':hk_in, 'pp':pp_data}
+data_in = {'modelname': 'example','hk':hk_in, 'pp':pp_data, 'hk_array_file': True, 'validate_flow_solver': True}
 mf,grid_ref,h = example1_Modflow(data_in)
 
 
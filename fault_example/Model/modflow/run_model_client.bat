@@ -0,0 +1 @@
+@C:\PEST_examples\fault_example\Model\model_client.py
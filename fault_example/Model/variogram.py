@@ -0,0 +1,163 @@
+import numpy as np
+import scipy.fft
+from scipy.spatial import cKDTree
+from scipy.optimize import curve_fit
+from pykrige.variogram_models import spherical_variogram_model, exponential_variogram_model, gaussian_variogram_model
+
+############################################
+#### EXPERIMENTAL VARIOGRAMS AND FITTING ###
+############################################
+# gridded fields: the full 2D variogram map (every lag up to max_lag, every pair of cells) is
+# computed with FFTs in O(N log N) (Marcotte, 1996):
+#       2 N(h) gamma(h) = sum I(x)I(x+h) (z(x+h)-z(x))^2
+#                       = IFFT( conj(F(I)) F(I z^2) + conj(F(I z^2)) F(I) - 2 conj(F(I z)) F(I z) )
+#       N(h)            = IFFT( conj(F(I)) F(I) )
+# with I the indicator of the valid (non nan) cells, zero padded so lags up to max_lag do not wrap.
+# the map is reduced to binned gamma(h), omnidirectional or in one direction, and fitted with the
+# variogram models of pykrige, so the result can be used as pilot point variogram_parameters.
+# scattered samples: binned pairs estimator over the pairs closer than max_dist (KD-tree), so
+# memory and time grow with the number of pairs in range and not with n^2.
+# parameters follow pykrige: model parameters [psill, range, nugget], and the variogram_parameters
+# dict {'sill': psill+nugget, 'range': range, 'nugget': nugget}
+
+variogram_models = {'spherical'   : spherical_variogram_model,
+                    'exponential' : exponential_variogram_model,
+                    'gaussian'    : gaussian_variogram_model}
+
+
+###############################
+#### FFT VARIOGRAM MAP (2D) ###
+###############################
+def variogram_map(field, max_lag = None):
+    ## INPUT
+    # field   : (nrow,ncol) gridded field (nan for missing cells)
+    # max_lag : (max row lag, max col lag) in cells (half the grid in each direction if None)
+    ## OUTPUT
+    # gmap   : (2*max row lag+1, 2*max col lag+1) semivariance of each lag, lag (0,0) at the centre
+    #          (gmap[max row lag + drow, max col lag + dcol]), nan where there are no pairs
+    # npairs : same shape, number of cell pairs of each lag
+    z = np.asarray(field, dtype = float)
+    nrow,ncol = z.shape
+    if max_lag is None:
+        max_lag = (nrow//2,ncol//2)
+    lr,lc = int(min(max_lag[0],nrow-1)),int(min(max_lag[1],ncol-1))
+    valid = np.isfinite(z)
+    I = valid.astype(float)
+    z = np.where(valid,z,0.0)
+    z = z-np.sum(z)/np.sum(I) # centring keeps the sums of squares small (gamma is unchanged)
+    z = z*I
+
+    shape = (scipy.fft.next_fast_len(nrow+lr,real = True),scipy.fft.next_fast_len(ncol+lc,real = True))
+    FI  = scipy.fft.rfft2(I,shape)
+    Fz  = scipy.fft.rfft2(z,shape)
+    Fz2 = scipy.fft.rfft2(z*z,shape)
+    npairs = scipy.fft.irfft2(np.conj(FI)*FI,shape)
+    sq = scipy.fft.irfft2(np.conj(FI)*Fz2+np.conj(Fz2)*FI-2.0*np.conj(Fz)*Fz,shape)
+
+    # lags -lr..lr, -lc..lc (negative lags wrap to the end of the padded arrays)
+    rows = np.arange(-lr,lr+1) % shape[0]
+    cols = np.arange(-lc,lc+1) % shape[1]
+    npairs = np.round(npairs[np.ix_(rows,cols)])
+    sq = sq[np.ix_(rows,cols)]
+    gmap = np.full(npairs.shape,np.nan)
+    has = npairs > 0
+    gmap[has] = np.maximum(sq[has],0.0)/(2.0*npairs[has])
+    return gmap, npairs
+
+
+##################################
+#### BIN LAGS INTO GAMMA(DIST) ###
+##################################
+def _bin_gamma(dist, ang, sq, count, nbins, max_dist, angle, tol):
+    # sq: sum of semivariances (gamma * count), count: number of pairs of each lag (or pair)
+    keep = (dist > 0) & (dist <= max_dist) & (count > 0)
+    if angle is not None:
+        # direction of the lag, a lag and its opposite are the same pair
+        dang = np.abs((ang-angle+90.0) % 180.0-90.0)
+        keep = keep & (dang <= tol)
+    edges = np.linspace(0,max_dist,nbins+1)
+    ibin = np.clip(np.searchsorted(edges,dist[keep],side = 'left')-1,0,nbins-1)
+    n = np.bincount(ibin,weights = count[keep],minlength = nbins)
+    g = np.bincount(ibin,weights = sq[keep],minlength = nbins)
+    h = np.bincount(ibin,weights = dist[keep]*count[keep],minlength = nbins)
+    has = n > 0
+    return h[has]/n[has], g[has]/n[has], n[has]
+
+
+def bin_variogram_map(gmap, npairs, dx = 1.0, dy = 1.0, nbins = 20, max_dist = None, angle = None, tol = 22.5):
+    ## INPUT
+    # gmap, npairs : variogram map from variogram_map
+    # dx, dy       : cell size along rows (column width) and along columns (row height)
+    # nbins        : number of distance bins
+    # max_dist     : largest lag distance (largest distance of the map along both axes if None)
+    # angle        : direction in degrees counterclockwise from the x axis (None = omnidirectional)
+    # tol          : angular tolerance in degrees
+    ## OUTPUT
+    # lags   : (nb,) mean lag distance of each non empty bin
+    # gamma  : (nb,) pair weighted semivariance of each bin
+    # counts : (nb,) number of pairs of each bin
+    lr,lc = (gmap.shape[0]-1)//2,(gmap.shape[1]-1)//2
+    hx = np.arange(-lc,lc+1)[np.newaxis,:]*dx*np.ones(gmap.shape)
+    hy = -np.arange(-lr,lr+1)[:,np.newaxis]*dy*np.ones(gmap.shape) # rows are counted down (y decreases)
+    dist = np.sqrt(hx**2+hy**2)
+    if max_dist is None:
+        max_dist = min(lr*dy,lc*dx)
+    ang = np.degrees(np.arctan2(hy,hx))
+    # the map holds every pair twice (lags h and -h), halved so counts are numbers of pairs
+    count = 0.5*npairs
+    sq = np.where(npairs > 0,np.nan_to_num(gmap)*count,0.0)
+    return _bin_gamma(dist.ravel(),ang.ravel(),sq.ravel(),count.ravel(),nbins,max_dist,angle,tol)
+
+
+#########################################
+#### BINNED PAIRS (SCATTERED SAMPLES) ###
+#########################################
+def pairs_variogram(x, y, z, nbins = 20, max_dist = None, angle = None, tol = 22.5):
+    ## INPUT
+    # x, y, z  : sample coordinates and values
+    # nbins    : number of distance bins
+    # max_dist : largest pair distance (half the largest extent of the samples if None)
+    # angle    : direction in degrees counterclockwise from the x axis (None = omnidirectional)
+    # tol      : angular tolerance in degrees
+    ## OUTPUT
+    # lags, gamma, counts : as bin_variogram_map
+    x = np.asarray(x, dtype = float).ravel()
+    y = np.asarray(y, dtype = float).ravel()
+    z = np.asarray(z, dtype = float).ravel()
+    if max_dist is None:
+        max_dist = 0.5*max(np.ptp(x),np.ptp(y))
+    pairs = cKDTree(np.column_stack([x,y])).query_pairs(max_dist,output_type = 'ndarray')
+    i,j = pairs[:,0],pairs[:,1]
+    hx,hy = x[j]-x[i],y[j]-y[i]
+    dist = np.sqrt(hx**2+hy**2)
+    ang = np.degrees(np.arctan2(hy,hx))
+    sq = 0.5*(z[j]-z[i])**2
+    return _bin_gamma(dist,ang,sq,np.ones(len(dist)),nbins,max_dist,angle,tol)
+
+
+##########################
+#### FIT A MODEL CURVE ###
+##########################
+def fit_variogram(lags, gamma, counts = None, variogram_model = 'spherical'):
+    ## INPUT
+    # lags, gamma : binned experimental variogram
+    # counts      : number of pairs of each bin (bins weighted by their number of pairs if given)
+    # variogram_model : 'spherical', 'exponential' or 'gaussian' (pykrige definitions)
+    ## OUTPUT
+    # pars : [psill, range, nugget] (pykrige variogram_model_parameters)
+    if variogram_model not in variogram_models:
+        raise Exception('variogram_model must be spherical, exponential or gaussian.')
+    vfunc = variogram_models[variogram_model]
+    lags = np.asarray(lags, dtype = float)
+    gamma = np.asarray(gamma, dtype = float)
+    sigma = None if counts is None else 1.0/np.sqrt(np.asarray(counts, dtype = float))
+    p0 = [np.amax(gamma)-np.amin(gamma),0.25*np.amax(lags),np.amin(gamma)]
+    upper = [10*np.amax(gamma),np.inf,np.amax(gamma)]
+    pars,cov = curve_fit(lambda d,psill,rng,nug: vfunc([psill,rng,nug],d),lags,gamma,p0 = p0,sigma = sigma,
+                         bounds = ([0.0,1e-12*np.amax(lags),0.0],upper))
+    return [float(par) for par in pars]
+
+
+def variogram_parameter_dict(pars):
+    # pykrige variogram_parameters dict of [psill, range, nugget]
+    return {'sill': pars[0]+pars[2], 'range': pars[1], 'nugget': pars[2]}
@@ -0,0 +1,114 @@
+import numpy as np
+from matplotlib.path import Path
+
+####################################################
+#### RASTERIZE GEOLOGICAL FEATURES INTO K FIELDS ###
+####################################################
+# features are dicts, burned into the hk array(s) in list order. Geometry is given in grid
+# index coordinates (row, col), a cell (i,j) has its center at (i+0.5, j+0.5):
+#   {'type':'band',    'rows':(r0,r1), 'cols':(c0,c1), 'value':500}
+#           cells r0 <= row < r1, c0 <= col < c1 (same as hk[r0:r1,c0:c1] = 500)
+#   {'type':'polygon', 'vertices':[(row,col),...], 'value':500}
+#           cells with their center inside the polygon
+#   {'type':'fault',   'p0':(row,col), 'p1':(row,col), 'width':10, 'value':0.01}
+#           cells with their center within width/2 of the segment p0-p1 (fault zone)
+#   {'type':'fault',   'p0':(row,col), 'p1':(row,col), 'throw':(drow,dcol)}
+#           cells to the left of the line p0->p1 (looking from p0 to p1) take the value of the
+#           cell displaced by throw (offset of the K field across the fault, clipped at the grid edge)
+# optional key 'mode': 'set' (default) replaces hk by value, 'multiply' multiplies hk by value.
+# masks only depend on the geometry and the grid shape, so they are computed once and applied
+# to every field of an ensemble (N,nrow,ncol) at once.
+
+
+###########################################
+#### CELL MASK / INDEX MAP OF A FEATURE ###
+###########################################
+def feature_mask(feature, shape):
+    ## INPUT
+    # feature : feature dict (see above)
+    # shape   : (nrow,ncol) of the K field
+    ## OUTPUT
+    # mask    : (nrow,ncol) boolean array of the cells affected by the feature
+    nrow,ncol = shape
+    rows = np.arange(nrow)[:,np.newaxis]
+    cols = np.arange(ncol)[np.newaxis,:]
+    ftype = feature['type']
+    if ftype == 'band':
+        r0,r1 = feature['rows']
+        c0,c1 = feature['cols']
+        mask = (rows >= r0) & (rows < r1) & (cols >= c0) & (cols < c1)
+    elif ftype == 'polygon':
+        R,C = np.meshgrid(np.arange(nrow)+0.5,np.arange(ncol)+0.5, indexing = 'ij')
+        path = Path(np.asarray(feature['vertices'], dtype = float))
+        mask = path.contains_points(np.column_stack([R.ravel(),C.ravel()])).reshape(nrow,ncol)
+    elif ftype == 'fault':
+        p0 = np.asarray(feature['p0'], dtype = float)
+        p1 = np.asarray(feature['p1'], dtype = float)
+        d = p1-p0
+        r = rows+0.5-p0[0]
+        c = cols+0.5-p0[1]
+        if 'throw' in feature:
+            mask = (d[0]*c-d[1]*r) > 0 # left of the line p0->p1 (cross product)
+        else:
+            t = np.clip((r*d[0]+c*d[1])/np.sum(d**2),0.0,1.0) # projection on the segment
+            dist = np.sqrt((r-t*d[0])**2+(c-t*d[1])**2)
+            mask = dist <= feature['width']/2.0
+    else:
+        raise Exception('unknown feature type '+str(ftype))
+    return np.broadcast_to(mask,shape)
+
+
+def fault_index_map(feature, shape):
+    # source cells of the displaced side of a fault with a throw (row and column index arrays)
+    nrow,ncol = shape
+    drow,dcol = feature['throw']
+    R,C = np.meshgrid(np.arange(nrow),np.arange(ncol), indexing = 'ij')
+    return np.clip(R+drow,0,nrow-1), np.clip(C+dcol,0,ncol-1)
+
+
+##############################################
+#### BURN FEATURES INTO ONE OR MORE FIELDS ###
+##############################################
+def rasterize_features(fields, features, masks = None, chunk = 16):
+    ## INPUT
+    # fields   : (nrow,ncol) K field or (N,nrow,ncol) ensemble of K fields (modified in place)
+    # features : list of feature dicts, applied in order to every field
+    # masks    : dict used to cache masks between calls (key: repr of the feature geometry)
+    # chunk    : number of fields read at a time, so np.memmap ensembles are processed in blocks of
+    #            (chunk,nmask) values and never loaded as a whole
+    ## OUTPUT
+    # fields   : the fields with the features burned in
+    if masks is None:
+        masks = {}
+    batch = fields if fields.ndim == 3 else fields[np.newaxis,:,:]
+    shape = batch.shape[1:]
+    for feature in features:
+        key = repr(sorted((k,v) for k,v in feature.items() if k not in ('value','mode')))+repr(shape)
+        if key not in masks:
+            masks[key] = feature_mask(feature,shape)
+        mask = masks[key]
+        if feature['type'] == 'fault' and 'throw' in feature:
+            src_r,src_c = fault_index_map(feature,shape)
+            for i in np.arange(0,batch.shape[0]):
+                batch[i][mask] = batch[i][src_r[mask],src_c[mask]]
+        else:
+            for i0 in np.arange(0,batch.shape[0],chunk):
+                block = batch[i0:i0+chunk] # view of the fields (also for np.memmap)
+                if feature.get('mode','set') == 'multiply':
+                    block[:,mask] = block[:,mask]*feature['value']
+                else:
+                    block[:,mask] = feature['value']
+    return fields
+
+
+def rasterize_ensemble(fields, feature_sets):
+    ## INPUT
+    # fields       : (N,nrow,ncol) ensemble of base K fields (modified in place)
+    # feature_sets : list of N feature lists, one structural variant per field
+    ## OUTPUT
+    # fields       : the ensemble with the features of each variant burned in
+    # masks of features shared between variants are computed only once
+    masks = {}
+    for i in np.arange(0,fields.shape[0]):
+        rasterize_features(fields[i],feature_sets[i],masks)
+    return fields
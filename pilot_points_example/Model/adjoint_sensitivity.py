@@ -0,0 +1,130 @@
+import numpy as np
+import scipy.sparse
+import scipy.sparse.linalg
+from flow_solver import solve_heads, transmissivity, conductance, assemble
+
+######################################################
+#### ADJOINT STATE SENSITIVITIES (HEADS W.R.T. HK) ###
+######################################################
+# for the steady state model of flow_solver.py, A(hk) h = rhs(hk). The sensitivity of the head
+# at observation o to the hydraulic conductivity of cell j is
+#       dh_o/dhk_j = - lambda_o^T * d(A h - rhs)/dhk_j ,      A^T lambda_o = e_o
+# A is symmetric, so one sparse LU factorisation serves the forward solve and all adjoint
+# solves. Each connection c = (a,b) contributes C_c*(h_a - h_b) to the residual of a (and the
+# negative to b), so the derivative reduces to a sum over connections:
+#       dh_o/dhk_j = - sum_c dC_c/dhk_j * (h_a - h_b) * (lambda_o,a - lambda_o,b)
+# with lambda = 0 at constant head cells. Saturated thickness is taken as fixed at the
+# solution (exact when the layer is fully saturated, as in example_MF.py).
+# Sensitivities w.r.t. pilot point values follow from the kriging weights (hk = |W hk_pp|).
+
+
+#################################################
+#### SENSITIVITY OF OBSERVED HEADS TO CELL HK ###
+#################################################
+def head_sensitivity(fs, hk, obs_rows, obs_cols, h = None):
+    ## INPUT
+    # fs       : solver data from flow_solver.init_flow_solver
+    # hk       : (nrow,ncol) hydraulic conductivity
+    # obs_rows : (nobs,) row of each observation cell
+    # obs_cols : (nobs,) column of each observation cell
+    # h        : (nrow,ncol) heads for hk (solved here if None)
+    ## OUTPUT
+    # S : (nobs, nrow*ncol) array, S[o,j] = d(head at obs o)/d(hk of cell j)
+    # h : (nrow,ncol) heads
+    if h is None:
+        h = solve_heads(fs,hk)
+    hv = h.ravel()
+    T,thk = transmissivity(fs,hk,hv)
+    C = conductance(fs,T)
+    A,rhs = assemble(fs,C)
+    ncell = fs['nrow']*fs['ncol']
+    nact = A.shape[0]
+
+    # adjoint solves, one right hand side per observation (A symmetric)
+    obs_cells = np.asarray(obs_rows).ravel()*fs['ncol']+np.asarray(obs_cols).ravel()
+    obs_eqn = fs['eqn'][obs_cells]
+    nobs = len(obs_cells)
+    E = np.zeros((nact,nobs))
+    E[obs_eqn[obs_eqn >= 0],np.nonzero(obs_eqn >= 0)[0]] = 1.0 # heads at constant head cells have zero sensitivity
+    lu = scipy.sparse.linalg.splu(A.tocsc())
+    lam_act = lu.solve(E)
+    lam = np.zeros((ncell,nobs))
+    lam[fs['active'],:] = lam_act
+
+    # derivative of each connection conductance w.r.t. hk of its two cells
+    # C = 2 w Ta Tb / (Ta lb + Tb la)  ->  dC/dTa = 2 w Tb^2 la / (Ta lb + Tb la)^2
+    a,b = fs['a'],fs['b']
+    Ta,Tb = T[a],T[b]
+    denom = Ta*fs['lb']+Tb*fs['la']
+    dC_dka = np.zeros(len(a))
+    dC_dkb = np.zeros(len(a))
+    nz = denom > 0
+    dC_dka[nz] = 2.0*fs['w'][nz]*Tb[nz]**2*fs['la'][nz]/denom[nz]**2*thk[a][nz]
+    dC_dkb[nz] = 2.0*fs['w'][nz]*Ta[nz]**2*fs['lb'][nz]/denom[nz]**2*thk[b][nz]
+
+    # S[o,j] = - sum_c dC_c/dhk_j * dh_c * dlam_c,o
+    dh = hv[a]-hv[b]
+    dlam = lam[a,:]-lam[b,:] # (nconn,nobs)
+    nconn = len(a)
+    G = scipy.sparse.csr_matrix((np.concatenate([dC_dka,dC_dkb]),
+                                 (np.concatenate([np.arange(nconn),np.arange(nconn)]),np.concatenate([a,b]))),
+                                shape = (nconn,ncell))
+    S = -np.asarray(G.T.dot(dlam*dh[:,np.newaxis])).T
+    return S, h
+
+
+#################################################
+#### CHAIN CELL SENSITIVITIES TO PILOT POINTS ###
+#################################################
+def pilot_point_jacobian(S, wts, hk_pp):
+    ## INPUT
+    # S     : (nobs,ncell) sensitivities w.r.t. cell hk (head_sensitivity)
+    # wts   : (ncell,n_pp) kriging weights, hk = |wts hk_pp| (kriging_weights.py)
+    # hk_pp : (n_pp,) pilot point values
+    ## OUTPUT
+    # J : (nobs,n_pp) jacobian d(head at obs)/d(pilot point value)
+    krig = wts.dot(np.asarray(hk_pp).reshape(-1,))
+    dhk = np.sign(krig) # derivative of the abs() applied to the kriged field
+    dhk[dhk == 0] = 1.0
+    dwts = scipy.sparse.diags(dhk).dot(wts) # dense or sparse (scipy.sparse) weights
+    return np.asarray(dwts.T.dot(S.T)).T
+
+
+##########################################
+#### WRITE PEST BINARY JACOBIAN (.JCO) ###
+##########################################
+def write_jco(fname, J, parnames, obsnames):
+    ## INPUT
+    # J        : (nobs,npar) jacobian
+    # parnames : parameter names (max 12 characters)
+    # obsnames : observation names (max 20 characters)
+    # binary layout used by PEST: -npar, -nobs, number of non zero elements (int32),
+    # then (int32 index, float64 value) for each non zero element in column major order
+    # (index = ipar*nobs + iobs + 1), then parameter names (12 chars) and observation names (20 chars)
+    J = np.asarray(J, dtype = float)
+    nobs,npar = J.shape
+    Jc = J.T.ravel() # column major
+    nz = np.nonzero(Jc)[0]
+    rec = np.zeros(len(nz), dtype = np.dtype([('idx','<i4'),('val','<f8')]))
+    rec['idx'] = nz+1
+    rec['val'] = Jc[nz]
+    file = open(fname,'wb')
+    np.array([-npar,-nobs,len(nz)], dtype = '<i4').tofile(file)
+    rec.tofile(file)
+    file.write(''.join([name.lower().ljust(12)[:12] for name in parnames]).encode('ascii'))
+    file.write(''.join([name.lower().ljust(20)[:20] for name in obsnames]).encode('ascii'))
+    file.close()
+
+
+###########################################################
+#### WRITE PEST EXTERNAL DERIVATIVES FILE (JACFILE = 1) ###
+###########################################################
+def write_derivatives_file(fname, J):
+    # first line NPAR NOBS, then one row of derivatives (w.r.t. every parameter) per observation
+    J = np.asarray(J, dtype = float)
+    nobs,npar = J.shape
+    line = ' '.join(['%.10E']*npar)+'\n'
+    file = open(fname,'w')
+    file.write(str(npar)+' '+str(nobs)+'\n')
+    file.write((line*nobs) % tuple(J.ravel()))
+    file.close()
@@ -0,0 +1,137 @@
+import os
+import numpy as np
+
+######################################################
+#### MEMORY MAPPED MODFLOW BINARY HEAD FILE READER ###
+######################################################
+# a MODFLOW binary head (or drawdown) file is a sequence of records, one per saved layer:
+#       KSTP KPER PERTIM TOTIM TEXT(16) NCOL NROW ILAY   followed by NCOL*NROW values
+# (PERTIM, TOTIM and the values are 4 byte reals for single and 8 byte reals for double precision).
+# the headers are read once into a compact index, cached next to the head file (example.hds.idx)
+# and reused as long as the head file is not newer. Any record is then a zero-copy view into
+# a np.memmap of the file, so reading one time step does not scan or load the rest of the file.
+# kstpkper follow flopy: zero based (kstp-1, kper-1)
+
+index_dtype = np.dtype([('kstp','<i4'),('kper','<i4'),('pertim','<f8'),('totim','<f8'),('text','S16'),
+                        ('ncol','<i4'),('nrow','<i4'),('ilay','<i4'),('prec','<i4'),('offset','<i8')])
+
+
+############################################
+#### BUILD (OR LOAD CACHED) HEADER INDEX ###
+############################################
+def head_precision(fname):
+    # 4 (single) or 8 (double): the record text has to be readable at the position it has for that precision
+    file = open(fname,'rb')
+    header = file.read(52)
+    file.close()
+    for prec in [4,8]:
+        text = header[8+2*prec:24+2*prec]
+        if text.strip() and all(32 <= char < 127 for char in text):
+            return prec
+    raise Exception('could not determine precision of '+fname)
+
+
+def build_head_index(fname):
+    ## INPUT
+    # fname : MODFLOW binary head file
+    ## OUTPUT
+    # index : structured array (index_dtype), one entry per record (layer) with the header values
+    #         and the byte offset of the data
+    prec = head_precision(fname)
+    real = '<f4' if prec == 4 else '<f8'
+    header_dtype = np.dtype([('kstp','<i4'),('kper','<i4'),('pertim',real),('totim',real),('text','S16'),
+                             ('ncol','<i4'),('nrow','<i4'),('ilay','<i4')])
+    fsize = os.path.getsize(fname)
+    records = []
+    file = open(fname,'rb')
+    pos = 0
+    while pos+header_dtype.itemsize <= fsize:
+        file.seek(pos)
+        header = np.frombuffer(file.read(header_dtype.itemsize), dtype = header_dtype)[0]
+        offset = pos+header_dtype.itemsize
+        records.append((header['kstp'],header['kper'],header['pertim'],header['totim'],header['text'],
+                        header['ncol'],header['nrow'],header['ilay'],prec,offset))
+        pos = offset+int(header['ncol'])*int(header['nrow'])*prec
+    file.close()
+    return np.array(records, dtype = index_dtype)
+
+
+def head_index(fname):
+    # index of fname, from the cache file fname.idx if it is up to date
+    idx_name = fname+'.idx'
+    if os.path.isfile(idx_name) and os.path.getmtime(idx_name) >= os.path.getmtime(fname):
+        index = np.fromfile(idx_name, dtype = index_dtype)
+        # the last record has to end at the end of the file, otherwise the cache is stale
+        if len(index) > 0 and (index['offset'][-1]+int(index['ncol'][-1])*int(index['nrow'][-1])*int(index['prec'][-1])
+                               == os.path.getsize(fname)):
+            return index
+    index = build_head_index(fname)
+    index.tofile(idx_name)
+    return index
+
+
+#######################
+#### OPEN HEAD FILE ###
+#######################
+def open_head_file(fname):
+    ## INPUT
+    # fname : MODFLOW binary head file
+    ## OUTPUT
+    # hf : dict with the file name, the record index and a read only memory map of the file
+    index = head_index(fname)
+    hf = {'fname' : fname,
+          'index' : index,
+          'mm'    : np.memmap(fname, dtype = np.uint8, mode = 'r')}
+    return hf
+
+
+def get_kstpkper(hf):
+    # list of (kstp, kper) of the saved time steps (zero based, as flopy)
+    index = hf['index']
+    keys = []
+    for kstp,kper in zip(index['kstp'],index['kper']):
+        if (kstp-1,kper-1) not in keys:
+            keys.append((int(kstp)-1,int(kper)-1))
+    return keys
+
+
+def get_times(hf):
+    # list of the saved simulation times
+    return [float(totim) for totim in np.unique(hf['index']['totim'])]
+
+
+###################################
+#### GET HEADS OF ONE TIME STEP ###
+###################################
+def get_layer(hf, i):
+    # zero-copy (nrow,ncol) view of record i of the index
+    rec = hf['index'][i]
+    dtype = '<f4' if rec['prec'] == 4 else '<f8'
+    return np.ndarray((rec['nrow'],rec['ncol']), dtype = dtype, buffer = hf['mm'], offset = int(rec['offset']))
+
+
+def get_data(hf, kstpkper = None, totim = None, idx = None):
+    ## INPUT
+    # hf       : head file dict from open_head_file
+    # kstpkper : zero based (kstp, kper) of the time step (as flopy)
+    # totim    : simulation time of the time step
+    # idx      : number of the time step in get_kstpkper order
+    #            (last saved time step if none of the above is given)
+    ## OUTPUT
+    # heads : (nlay,nrow,ncol) heads, a zero-copy view of the file for single layer models
+    index = hf['index']
+    if kstpkper is not None:
+        sel = (index['kstp'] == kstpkper[0]+1) & (index['kper'] == kstpkper[1]+1)
+    elif totim is not None:
+        sel = index['totim'] == totim
+    else:
+        keys = get_kstpkper(hf)
+        key = keys[-1] if idx is None else keys[idx]
+        sel = (index['kstp'] == key[0]+1) & (index['kper'] == key[1]+1)
+    recs = np.nonzero(sel)[0]
+    if len(recs) == 0:
+        raise Exception('time step not found in '+hf['fname'])
+    recs = recs[np.argsort(index['ilay'][recs], kind = 'stable')]
+    if len(recs) == 1:
+        return get_layer(hf,recs[0])[np.newaxis,:,:]
+    return np.stack([get_layer(hf,i) for i in recs])
@@ -0,0 +1,159 @@
+import os
+import subprocess
+import flopy
+import flopy.utils.reference  as srf
+from kriging_weights import krige_weights, save_krige_weights, load_krige_weights, apply_krige_weights, krige_weights_current
+from pilot_point_values import read_pp_values
+from hk_array import write_hk_array
+from flow_solver import flow_solver_from_modflow, solve_heads, obs_heads
+from adjoint_sensitivity import head_sensitivity, pilot_point_jacobian, write_jco, write_derivatives_file
+from head_observations import read_final_heads, write_hdsraw
+from pilot_point_data import load_pp_data, pp_data_file
+
+####################################################
+#### FORWARD MODEL (KRIGE -> MODFLOW -> .HDSRAW) ###
+####################################################
+# same chain as Model\modflow\run_model.bat (Krige_pilot_points.py, mf2005.exe, build_hdsraw.py),
+# but everything that does not change between PEST runs (pilot point data, kriging weights,
+# grid reference, observation names) is loaded once by init_forward_model and kept in memory.
+# the observed heads are read from the final record of the .hds file (head_observations.py), HYDMOD
+# output is not used.
+# with engine = 'python' the MODFLOW run is replaced by the in-process solver in flow_solver.py
+# and jacobian_run gives the PEST jacobian by adjoint sensitivities (adjoint_sensitivity.py)
+
+
+#########################################
+#### LOAD EVERYTHING NEEDED FOR A RUN ###
+#########################################
+def init_forward_model(model_dir, mf_modelname = 'example', engine = 'mf2005', n_closest = None):
+    ## INPUT
+    # model_dir    : path to ...\Model directory (holds pilot point data and the modflow folder)
+    # mf_modelname : name of modflow model used by PEST
+    # engine       : 'mf2005' (external executable) or 'python' (in-process flow solver)
+    # n_closest    : pilot points used per cell for kriging (None = all, see kriging_weights.py)
+    ## OUTPUT
+    # fm : dict with the warm model state, passed to forward_run
+    mf_path = model_dir+os.sep+'modflow'
+    fpath   = model_dir+os.sep+'pilot_point_data' # path to pilot point data
+    wpath   = model_dir+os.sep+'kriging_weights.npz'
+    pp      = load_pp_data(fpath)
+    n_pp    = pp['nx']*pp['ny'] # number of pilot points
+
+    mf = flopy.modflow.Modflow.load(mf_path+os.sep+mf_modelname+ '.nam')# import modflow object
+    xul = -sum(mf.dis.delr)/2                   # modflow model spatial domain upper left x coordinate
+    yul =  sum(mf.dis.delc)/2                   # modflow model spatial domain upper left y coordinate
+    grid_ref = srf.SpatialReference(delr   = mf.dis.delr,
+                                    delc   = mf.dis.delc,
+                                    lenuni = mf.dis.lenuni,
+                                    xul    = xul,
+                                    yul    = yul)
+
+    # kriging operator (rebuilt if missing, older than the pilot point data or built for another n_closest)
+    if not krige_weights_current(wpath,pp_data_file(fpath),n_closest):
+        xpred = grid_ref.get_xcenter_array()+xul# get list of x of centers for cells
+        ypred = grid_ref.get_ycenter_array()-yul# get list of y of centers for cells
+        save_krige_weights(wpath,krige_weights(pp,xpred,ypred,n_closest),(len(ypred),len(xpred)),n_closest)
+    wts,grid_shape = load_krige_weights(wpath)
+
+    # modflow executable - local copy if present, otherwise mf2005 on the system PATH
+    exe_name = mf_path+os.sep+'mf2005.exe'
+    if not os.path.isfile(exe_name):
+        exe_name = 'mf2005'
+
+    fm = {'engine'      : engine,
+          'model_dir'   : model_dir,
+          'mf_path'     : mf_path,
+          'mf_modelname': mf_modelname,
+          'exe_name'    : exe_name,
+          'pp'          : pp,
+          'n_pp'        : n_pp,
+          'grid_ref'    : grid_ref,
+          'wts'         : wts,
+          'grid_shape'  : grid_shape,
+          'hk_path'     : mf_path+os.sep+'hk.ref',
+          'pval_path'   : model_dir+os.sep+'pilot_point_values.dat',
+          'hds_path'    : mf_path+os.sep+mf_modelname+'.hds',
+          'hdsraw_path' : mf_path+os.sep+mf_modelname+'.hdsraw',
+          'jco_path'    : mf_path+os.sep+mf_modelname+'.jco',
+          'drv_path'    : mf_path+os.sep+mf_modelname+'.drv'}
+
+    fm['obs_rows'] = pp['r'].reshape(n_pp,) # observations are at the pilot points (.hdsraw order)
+    fm['obs_cols'] = pp['c'].reshape(n_pp,)
+    # PEST parameter and observation names (as in pest\pest_input.py)
+    fm['parnames'] = ['hk'+"{:02d}".format(r)+"{:02d}".format(c) for r,c in zip(fm['obs_rows'],fm['obs_cols'])]
+    fm['obsnames'] = ['obs'+"{:02d}".format(r)+"{:02d}".format(c) for r,c in zip(fm['obs_rows'],fm['obs_cols'])]
+    if engine == 'python':
+        fm['fs'] = flow_solver_from_modflow(mf)
+    return fm
+
+
+#######################################
+#### KRIGE PILOT POINT VALUES TO HK ###
+#######################################
+def krige_hk(fm, hk_pp):
+    return abs(apply_krige_weights(fm['wts'],fm['grid_shape'],hk_pp))
+
+
+####################
+#### RUN MODFLOW ###
+####################
+def run_modflow(fm):
+    proc = subprocess.run([fm['exe_name'], fm['mf_modelname']+'.nam'],
+                          cwd = fm['mf_path'],
+                          stdout = subprocess.PIPE,
+                          stderr = subprocess.STDOUT)
+    if b'normal termination' not in proc.stdout.lower():
+        raise Exception('MODFLOW did not terminate normally.')
+
+
+#################################
+#### ONE COMPLETE FORWARD RUN ###
+#################################
+def forward_run(fm, hk_pp = None):
+    ## INPUT
+    # fm    : warm model state from init_forward_model
+    # hk_pp : (n_pp,) pilot point values, read from the PEST parameter file if None
+    ## OUTPUT
+    # heads_raw : (nobs,) simulated heads at the observation locations (also written to .hdsraw)
+    if hk_pp is None:
+        hk_pp = read_pp_values(fm['pval_path'])
+    return forward_run_hk(fm,krige_hk(fm,hk_pp))
+
+
+def forward_run_hk(fm, hk):
+    ## INPUT
+    # fm : warm model state from init_forward_model
+    # hk : (nrow,ncol) hydraulic conductivity of every cell (kriged, or cell by cell parameters)
+    ## OUTPUT
+    # heads_raw : (nobs,) simulated heads at the observation locations (also written to .hdsraw)
+    if fm['engine'] == 'python':
+        h = solve_heads(fm['fs'],hk)
+        heads_raw = obs_heads(h,fm['obs_rows'],fm['obs_cols'])
+    else:
+        write_hk_array(fm['hk_path'],hk)
+        run_modflow(fm)
+        heads_raw = read_final_heads(fm['hds_path'],fm['obs_rows'],fm['obs_cols']) # head at final timestep
+    write_hdsraw(fm['hdsraw_path'],heads_raw)
+    return heads_raw
+
+
+################################################
+#### ADJOINT JACOBIAN (PEST EXTERNAL DERIVS) ###
+################################################
+def jacobian_run(fm, hk_pp = None):
+    ## INPUT
+    # fm    : warm model state from init_forward_model (engine = 'python')
+    # hk_pp : (n_pp,) pilot point values, read from the PEST parameter file if None
+    ## OUTPUT
+    # J : (nobs,n_pp) d(head at obs)/d(pilot point value), also written to the .jco file and to the
+    #     external derivatives file read by PEST when JACFILE = 1 (see pest\pest_input.py)
+    if fm['engine'] != 'python':
+        raise Exception('adjoint jacobian requires engine = python (in-process flow solver).')
+    if hk_pp is None:
+        hk_pp = read_pp_values(fm['pval_path'])
+    hk = krige_hk(fm,hk_pp)
+    S,h = head_sensitivity(fm['fs'],hk,fm['obs_rows'],fm['obs_cols']) # one forward + nobs adjoint solves
+    J = pilot_point_jacobian(S,fm['wts'],hk_pp)
+    write_jco(fm['jco_path'],J,fm['parnames'],fm['obsnames'])
+    write_derivatives_file(fm['drv_path'],J)
+    return J
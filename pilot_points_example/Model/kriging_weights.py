@@ -0,0 +1,169 @@
+import os
+import numpy as np
+import scipy.linalg
+import scipy.sparse
+from scipy.spatial import cKDTree
+from scipy.spatial.distance import cdist
+from pykrige.ok import OrdinaryKriging
+
+#######################################################
+#### KRIGING WEIGHT OPERATOR (PILOT POINTS -> GRID) ###
+#######################################################
+# pilot point locations and variogram parameters do not change during a PEST run,
+# so the ordinary kriging system only has to be solved once. The result is a
+# (ncells x n_pp) weight matrix, and kriging a new set of pilot point values is
+# then a single matrix-vector product:
+#       hk_krig = wts.dot(hk_pp).reshape(grid_shape)
+# for large pilot point networks the weights can be limited to the n_closest pilot points of
+# each cell (moving neighbourhood kriging, as OK.execute(..., n_closest_points = n_closest)),
+# which gives a sparse (CSR) weight matrix with n_closest non zero entries per cell
+
+
+###########################################################
+#### SOLVE KRIGING SYSTEM FOR EVERY CELL CENTER AT ONCE ###
+###########################################################
+def krige_weights(pp, xpred, ypred, n_closest = None):
+    ## INPUT
+    # pp        : pilot point data dict (keys nx, ny, x, y, variogram_model, variogram_parameters)
+    # xpred     : x coordinates of cell centers along a row    (ncol,)
+    # ypred     : y coordinates of cell centers along a column (nrow,)
+    # n_closest : number of closest pilot points used for each cell (all pilot points if None)
+    ## OUTPUT
+    # wts       : (nrow*ncol, n_pp) array of kriging weights (row major cell order),
+    #             scipy.sparse CSR matrix if n_closest is given
+    if n_closest is not None:
+        return krige_weights_sparse(pp,xpred,ypred,n_closest)
+    n_pp = pp['nx']*pp['ny']
+    xpp = pp['x'].reshape(n_pp,)
+    ypp = pp['y'].reshape(n_pp,)
+
+    # kriging object is only used to resolve the variogram function and its parameters
+    # exactly as they are used by OK.execute (data values do not enter the weights)
+    OK = OrdinaryKriging(xpp,
+                         ypp,
+                         np.zeros(n_pp),
+                         variogram_model=pp['variogram_model'],
+                         variogram_parameters = pp['variogram_parameters'],
+                         verbose=False,
+                         enable_plotting=False)
+    vfunc = OK.variogram_function
+    vpars = OK.variogram_model_parameters
+
+    # kriging matrix (pilot point to pilot point), assembled the same way as pykrige
+    xy_pp = np.column_stack([xpp,ypp])
+    a = np.zeros((n_pp+1,n_pp+1))
+    a[:n_pp,:n_pp] = -vfunc(vpars,cdist(xy_pp,xy_pp))
+    np.fill_diagonal(a,0.0)
+    a[n_pp,:] = 1.0
+    a[:,n_pp] = 1.0
+    a[n_pp,n_pp] = 0.0
+
+    # right hand sides (pilot point to cell center) for every cell
+    Xpred,Ypred = np.meshgrid(xpred,ypred)
+    bd = cdist(np.column_stack([Xpred.ravel(),Ypred.ravel()]),xy_pp)
+    b = np.ones((n_pp+1,bd.shape[0]))
+    b[:n_pp,:] = -vfunc(vpars,bd).T
+    b[:n_pp,:][bd.T <= OK.eps] = 0.0 # honour exact values at cells holding a pilot point
+
+    # solve for all cells together and drop the lagrange multiplier
+    wts = scipy.linalg.solve(a,b).T[:,:n_pp]
+    return wts
+
+
+##########################################################
+#### MOVING NEIGHBOURHOOD KRIGING (SPARSE CSR WEIGHTS) ###
+##########################################################
+def krige_weights_sparse(pp, xpred, ypred, n_closest = 20, chunk = 20000):
+    ## INPUT
+    # pp        : pilot point data dict (keys nx, ny, x, y, variogram_model, variogram_parameters)
+    # xpred     : x coordinates of cell centers along a row    (ncol,)
+    # ypred     : y coordinates of cell centers along a column (nrow,)
+    # n_closest : number of closest pilot points used for each cell
+    # chunk     : number of cells whose local kriging systems are solved together
+    ## OUTPUT
+    # wts       : (nrow*ncol, n_pp) scipy.sparse CSR matrix of kriging weights (row major cell order)
+    n_pp = pp['nx']*pp['ny']
+    xpp = pp['x'].reshape(n_pp,)
+    ypp = pp['y'].reshape(n_pp,)
+    k = int(min(n_closest,n_pp))
+
+    OK = OrdinaryKriging(xpp,
+                         ypp,
+                         np.zeros(n_pp),
+                         variogram_model=pp['variogram_model'],
+                         variogram_parameters = pp['variogram_parameters'],
+                         verbose=False,
+                         enable_plotting=False)
+    vfunc = OK.variogram_function
+    vpars = OK.variogram_model_parameters
+
+    # k closest pilot points of every cell center
+    xy_pp = np.column_stack([xpp,ypp])
+    Xpred,Ypred = np.meshgrid(xpred,ypred)
+    xy_pred = np.column_stack([Xpred.ravel(),Ypred.ravel()])
+    ncell = xy_pred.shape[0]
+    tree = cKDTree(xy_pp)
+    bd,idx = tree.query(xy_pred, k = k)
+    bd = bd.reshape(ncell,k)
+    idx = idx.reshape(ncell,k)
+
+    wts = np.zeros((ncell,k))
+    for i0 in np.arange(0,ncell,chunk):
+        i1 = min(i0+chunk,ncell)
+        m = i1-i0
+        # local kriging matrices (m, k+1, k+1), assembled as in pykrige's moving window loop
+        xy_loc = xy_pp[idx[i0:i1]] # (m,k,2)
+        d = np.sqrt(np.sum((xy_loc[:,:,np.newaxis,:]-xy_loc[:,np.newaxis,:,:])**2, axis = -1))
+        a = np.ones((m,k+1,k+1))
+        a[:,:k,:k] = -vfunc(vpars,d.ravel()).reshape(m,k,k)
+        a[:,np.arange(k),np.arange(k)] = 0.0
+        a[:,k,k] = 0.0
+        b = np.ones((m,k+1,1))
+        b[:,:k,0] = -vfunc(vpars,bd[i0:i1].ravel()).reshape(m,k)
+        b[:,:k,0][bd[i0:i1] <= OK.eps] = 0.0 # honour exact values at cells holding a pilot point
+        wts[i0:i1,:] = np.linalg.solve(a,b)[:,:k,0]
+
+    rows = np.repeat(np.arange(ncell),k)
+    wts = scipy.sparse.csr_matrix((wts.ravel(),(rows,idx.ravel())),shape = (ncell,n_pp))
+    return wts
+
+
+####################################
+#### SAVE / LOAD WEIGHT OPERATOR ###
+####################################
+def save_krige_weights(fname, wts, grid_shape, n_closest = None):
+    # dense weights are stored as one array, sparse (CSR) weights by their CSR arrays
+    n_closest = -1 if n_closest is None else n_closest
+    if scipy.sparse.issparse(wts):
+        wts = wts.tocsr()
+        np.savez(fname, data = wts.data, indices = wts.indices, indptr = wts.indptr, shape = np.array(wts.shape),
+                 grid_shape = np.array(grid_shape), n_closest = n_closest)
+    else:
+        np.savez(fname, wts = wts, grid_shape = np.array(grid_shape), n_closest = n_closest)
+
+
+def load_krige_weights(fname):
+    data = np.load(fname)
+    if 'indptr' in data.files:
+        wts = scipy.sparse.csr_matrix((data['data'],data['indices'],data['indptr']),shape = tuple(data['shape']))
+    else:
+        wts = data['wts']
+    grid_shape = tuple(data['grid_shape'])
+    return wts, grid_shape
+
+
+def krige_weights_current(fname, pp_fname, n_closest = None):
+    # True if the stored weights exist, are newer than the pilot point data and were built
+    # with the same neighbourhood (n_closest)
+    if not os.path.isfile(fname) or os.path.getmtime(fname) < os.path.getmtime(pp_fname):
+        return False
+    data = np.load(fname)
+    stored = int(data['n_closest']) if 'n_closest' in data.files else -1
+    return stored == (-1 if n_closest is None else n_closest)
+
+
+######################################################
+#### KRIGE PILOT POINT VALUES USING STORED WEIGHTS ###
+######################################################
+def apply_krige_weights(wts, grid_shape, vals):
+    return wts.dot(np.asarray(vals).reshape(-1,)).reshape(grid_shape)
@@ -0,0 +1,59 @@
+import os
+import socket
+from forward_model import init_forward_model, forward_run
+from model_client import server_address
+
+########################################
+#### PERSISTENT FORWARD MODEL SERVER ###
+########################################
+# start once before running PEST:
+#       > python model_server.py
+# and set use_model_server = True in pest\pest_input.py, so the model command becomes
+# Model\modflow\run_model_client.bat. Numpy, flopy and pykrige are imported, and the pilot point data,
+# kriging weights and grid reference are loaded, only once - each PEST run then costs
+# one matrix-vector product, the MODFLOW solve and reading the observed heads from the final
+# record of the binary .hds file (head_observations.read_final_heads).
+# stop the server with
+#       > python model_client.py stop
+
+engine = 'mf2005' # 'mf2005' or 'python' (in-process flow solver, see flow_solver.py)
+
+model_dir = os.path.dirname(os.path.abspath(__file__))
+fm = init_forward_model(model_dir, engine = engine)
+
+family,address = server_address(model_dir)
+if family != socket.AF_INET and os.path.exists(address):
+    os.remove(address) # stale socket from a previous server
+server = socket.socket(family,socket.SOCK_STREAM)
+server.bind(address)
+server.listen(1)
+print('model server listening on '+str(address))
+
+running = True
+while running:
+    conn,addr = server.accept()
+    request = b''
+    while not request.endswith(b'\n'):
+        chunk = conn.recv(4096)
+        if not chunk:
+            break
+        request = request+chunk
+    request = request.decode().strip()
+
+    if request == 'run':
+        try:
+            forward_run(fm) # pilot point values are read from the file PEST just wrote
+            reply = 'ok'
+        except Exception as e:
+            reply = 'error '+str(e)
+    elif request == 'stop':
+        reply = 'ok'
+        running = False
+    else:
+        reply = 'error unknown request '+request
+    conn.sendall((reply+'\n').encode())
+    conn.close()
+
+server.close()
+if family != socket.AF_INET:
+    os.remove(address)
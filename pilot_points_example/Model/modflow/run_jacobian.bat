@@ -0,0 +1,2 @@
+cd /d C:\PEST_examples\pilot_points_example\Model 
+@C:\PEST_examples\pilot_points_example\Model\write_jacobian.py
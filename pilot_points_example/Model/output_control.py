@@ -0,0 +1,53 @@
+import numpy as np
+
+#####################################################
+#### OUTPUT CONTROL PLANNED FROM OUTPUT CONSUMERS ###
+#####################################################
+# instead of saving heads, drawdown and budget at every time step, the output control
+# (ModflowOc stress_period_data) is derived from what will actually read the model output:
+#   'hydmod'   : optional HYDMOD hydrographs (example_MF.py). HYDMOD writes its own .hyd.bin
+#                file, so it needs no OC records at all
+#   'heads'    : head file readers using the final heads of a stress period (head_observations.py
+#                for the PEST .hdsraw file, gen_observation_data.py, figures.py, results_figures.py)
+#   'pathline' : MODPATH (true_pathline_sim.py, model_pathline_sim.py) reads the budget of every
+#                time step and takes its time points from the saved head times, so it keeps
+#                head and budget at every time step
+#   'drawdown' : drawdown at every time step (no script of the examples reads the .ddn file)
+# each consumer lists (OC record, time steps) with time steps 'all' or 'last' (of each stress period)
+OC_CONSUMERS = {'hydmod'   : [],
+                'heads'    : [('save head','last')],
+                'pathline' : [('save head','all'),('save budget','all')],
+                'drawdown' : [('save drawdown','all')]}
+
+
+##########################################
+#### MINIMAL OUTPUT CONTROL DICTIONARY ###
+##########################################
+def plan_output_control(nper, nstp, consumers):
+    ## INPUT
+    # nper      : number of stress periods
+    # nstp      : list with the number of time steps of each stress period
+    # consumers : list of consumers of the model output (keys of OC_CONSUMERS)
+    ## OUTPUT
+    # sp_data_OC : stress_period_data for flopy.modflow.ModflowOc, {(kper,kstp): [records]},
+    #              holding only the time steps at which something is saved
+    records = []
+    for consumer in consumers:
+        if consumer not in OC_CONSUMERS:
+            raise Exception('unknown output control consumer '+str(consumer))
+        for rec in OC_CONSUMERS[consumer]:
+            if rec not in records:
+                records.append(rec)
+
+    sp_data_OC = {}
+    for kper in np.arange(0,nper):
+        for kstp in np.arange(0,nstp[kper]):
+            save = []
+            for text,steps in records:
+                if (steps == 'all' or kstp == nstp[kper]-1) and text not in save:
+                    save.append(text)
+            if len(save) > 0:
+                # keep the MODFLOW record order (head, drawdown, budget)
+                order = ['save head','save drawdown','save budget']
+                sp_data_OC[(int(kper),int(kstp))] = sorted(save, key = order.index)
+    return sp_data_OC
@@ -0,0 +1,104 @@
+import os
+import json
+import numpy as np
+
+###################################################
+#### PILOT POINT DATASET (.NPY ARRAYS + HEADER) ###
+###################################################
+# the pilot point data written by gen_observation_data.py is stored as a directory
+#       pilot_point_data\header.json   schema version, nx, ny, variogram model and parameters,
+#                                      name/shape/dtype of every array
+#       pilot_point_data\x.npy, y.npy, r.npy, c.npy, head.npy   (ny,nx) arrays
+# instead of one pickled dict (pilot_point_and_variogram_data.npy). load_pp_data only reads the
+# small header; each array is memory mapped the first time it is used, so a script needing nx, ny
+# (or only r and c) does not read (or unpickle) the rest. Nothing is unpickled at all.
+# the returned object is a dict, so pp['x'], pp['nx'], pp['variogram_parameters'] work as before.
+# the old pickled file is still read if the dataset directory does not exist (legacy fallback).
+
+pp_schema_version = 1
+pp_dirname = 'pilot_point_data'
+pp_legacy_fname = 'pilot_point_and_variogram_data.npy'
+
+
+class PilotPointData(dict):
+    # dict holding the header values, arrays are loaded (memory mapped) on first access
+    def __init__(self, path, header):
+        dict.__init__(self,header['meta'])
+        self.path = path
+        self.arrays = header['arrays']
+
+    def __missing__(self, key):
+        if key not in self.arrays:
+            raise KeyError(key)
+        value = np.load(self.path+os.sep+key+'.npy', mmap_mode = 'r')
+        self[key] = value
+        return value
+
+    def __contains__(self, key):
+        return dict.__contains__(self,key) or key in self.arrays
+
+    def keys(self):
+        return list(dict.keys(self))+[key for key in self.arrays if not dict.__contains__(self,key)]
+
+
+###############################
+#### WRITE PILOT POINT DATA ###
+###############################
+def save_pp_data(path, pp):
+    ## INPUT
+    # path : dataset directory (...\Model\pilot_point_data)
+    # pp   : pilot point data dict (arrays x, y, r, c, head, ... and nx, ny, variogram_model,
+    #        variogram_parameters)
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    arrays = {}
+    meta = {}
+    for key,value in pp.items():
+        if isinstance(value,np.ndarray):
+            np.save(path+os.sep+key+'.npy',np.ascontiguousarray(value))
+            arrays[key] = {'shape': list(value.shape), 'dtype': value.dtype.str}
+        else:
+            meta[key] = _to_json(value)
+    header = {'schema_version': pp_schema_version, 'meta': meta, 'arrays': arrays}
+    # header written last: its modification time marks a complete dataset (see pp_data_file)
+    file = open(path+os.sep+'header.json','w')
+    json.dump(header,file,indent = 1)
+    file.close()
+
+
+def _to_json(value):
+    # numpy scalars (e.g. fitted variogram parameters) as plain python values
+    if isinstance(value,dict):
+        return {key: _to_json(val) for key,val in value.items()}
+    if isinstance(value,np.generic):
+        return value.item()
+    return value
+
+
+##############################
+#### READ PILOT POINT DATA ###
+##############################
+def load_pp_data(path):
+    ## INPUT
+    # path : dataset directory (...\Model\pilot_point_data), or a legacy pickled .npy file
+    ## OUTPUT
+    # pp : pilot point data dict (arrays loaded lazily)
+    if os.path.isfile(path+os.sep+'header.json'):
+        file = open(path+os.sep+'header.json','r')
+        header = json.load(file)
+        file.close()
+        if header.get('schema_version',0) > pp_schema_version:
+            raise Exception('pilot point data schema version '+str(header['schema_version'])+
+                            ' is newer than supported ('+str(pp_schema_version)+')')
+        return PilotPointData(path,header)
+    legacy = path if path.endswith('.npy') else os.path.dirname(path)+os.sep+pp_legacy_fname
+    if os.path.isfile(legacy):
+        return np.load(legacy, allow_pickle = True).flatten()[0]
+    raise Exception('no pilot point data found at '+path)
+
+
+def pp_data_file(path):
+    # file whose modification time dates the pilot point data (for kriging_weights.krige_weights_current)
+    if os.path.isfile(path+os.sep+'header.json'):
+        return path+os.sep+'header.json'
+    return path if path.endswith('.npy') else os.path.dirname(path)+os.sep+pp_legacy_fname
@@ -0,0 +1,46 @@
+import numpy as np
+
+########################################
+#### PILOT POINT PARAMETER VALUE FILE ###
+########################################
+# compact model input file holding only the pilot point parameters, one line per parameter:
+#       hk0512      5.000000E+00
+# PEST writes this file from a matching template (instead of writing the full .lpf),
+# and Krige_pilot_points.py reads the n_pp values back without loading the MODFLOW model.
+# parameters are listed in the same (row major) order as the pilot point arrays in
+# the pilot point data (pilot_point_data.py), i.e. pp['x'].reshape(n_pp,)
+
+##############################
+#### WRITE PEST TEMPLATE FILE ###
+##############################
+def write_pp_template(fname, pnames, delim = '#', width = 20):
+    ## INPUT
+    # fname  : name of template file
+    # pnames : list/array of parameter names (n_pp,)
+    # delim  : parameter delimiter used in template
+    # width  : number of characters PEST may use to write each value
+    lines = ['ptf '+delim+'\n']
+    for name in pnames:
+        lines.append(name+' '+(delim+name).ljust(width-1)+delim+'\n')
+    file = open(fname,'w')
+    file.writelines(lines)
+    file.close()
+
+
+#############################################
+#### WRITE VALUE FILE (e.g. initial values) ###
+#############################################
+def write_pp_values(fname, pnames, vals):
+    vals = np.asarray(vals,dtype = float).reshape(-1,)
+    lines = [name+' '+'{:.6E}'.format(val)+'\n' for name,val in zip(pnames,vals)]
+    file = open(fname,'w')
+    file.writelines(lines)
+    file.close()
+
+
+######################
+#### READ VALUE FILE ###
+######################
+def read_pp_values(fname):
+    # returns (n_pp,) array of parameter values in file order
+    return np.loadtxt(fname, usecols = 1, ndmin = 1)
@@ -0,0 +1,179 @@
+import os
+import shutil
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+##########################################################
+#### LOCAL PARALLEL RUN MANAGER (FINITE DIFF JACOBIAN) ###
+##########################################################
+# the Model directory is cloned into n_workers isolated worker directories (..\workers\worker_NN),
+# each holding its own pilot point value file, hk array file, MODFLOW input and output files.
+# every process of the pool claims one worker directory when it starts, loads the forward model
+# there once (forward_model.init_forward_model) and then runs any parameter sets it is given.
+# results are gathered back in the order of the parameter sets, so with 32 workers a 40 parameter
+# jacobian costs two rounds of model runs instead of 40 sequential ones.
+# run_parallel starts and stops the pool for one batch; start_pool / pool_run / stop_pool keep the
+# pool (and the warm worker models) alive over many batches (e.g. every iteration of lm_inversion.py)
+# note: scripts using the run manager need an if __name__ == '__main__': guard on Windows
+
+
+########################################
+#### CLONE MODEL INTO WORKER FOLDERS ###
+########################################
+def init_workers(model_dir, n_workers, worker_root = None):
+    ## INPUT
+    # model_dir   : path to ...\Model directory
+    # n_workers   : number of worker directories
+    # worker_root : folder holding the worker directories (..\workers if None)
+    ## OUTPUT
+    # worker_dirs : list of worker directories (each a copy of model_dir)
+    if worker_root is None:
+        worker_root = os.path.dirname(model_dir)+os.sep+'workers'
+    ignore = shutil.ignore_patterns('__pycache__','*.pyc')
+    worker_dirs = []
+    for i in np.arange(0,n_workers):
+        worker_dir = worker_root+os.sep+'worker_'+"{:02d}".format(i)
+        if os.path.isdir(worker_dir):
+            shutil.rmtree(worker_dir) # start from a clean copy of the current model
+        shutil.copytree(model_dir,worker_dir,ignore = ignore)
+        worker_dirs.append(worker_dir)
+    return worker_dirs
+
+
+#################################
+#### WORKER PROCESS FUNCTIONS ###
+#################################
+_worker = {} # warm model state of this worker process
+
+
+def _init_worker(dir_queue, engine):
+    # runs once in each pool process: claim a worker directory and load the model there
+    from forward_model import init_forward_model
+    _worker['fm'] = init_forward_model(dir_queue.get(), engine = engine)
+
+
+def _worker_run(hk_pp):
+    from forward_model import forward_run
+    return forward_run(_worker['fm'],hk_pp) # heads at the observations (.hdsraw of the worker)
+
+
+def _worker_run_hk(hk):
+    from forward_model import forward_run_hk
+    return forward_run_hk(_worker['fm'],hk.reshape(_worker['fm']['grid_shape'])) # cell by cell K
+
+
+########################################
+#### PERSISTENT POOL OF WARM WORKERS ###
+########################################
+def start_pool(model_dir, n_workers = None, engine = 'mf2005', worker_root = None):
+    ## INPUT
+    # model_dir   : path to ...\Model directory
+    # n_workers   : number of worker processes/directories (number of cpus if None)
+    # engine      : 'mf2005' or 'python', see forward_model.py
+    # worker_root : folder holding the worker directories
+    ## OUTPUT
+    # rm : dict with the process pool, passed to pool_run and stop_pool
+    if n_workers is None:
+        n_workers = os.cpu_count()
+    n_workers = int(max(1,n_workers))
+    worker_dirs = init_workers(model_dir,n_workers,worker_root)
+
+    manager = multiprocessing.Manager()
+    dir_queue = manager.Queue()
+    for worker_dir in worker_dirs:
+        dir_queue.put(worker_dir)
+    pool = ProcessPoolExecutor(max_workers = n_workers,
+                               initializer = _init_worker,
+                               initargs = (dir_queue,engine))
+    rm = {'pool'       : pool,
+          'manager'    : manager,
+          'n_workers'  : n_workers,
+          'worker_dirs': worker_dirs}
+    return rm
+
+
+def pool_run(rm, par_sets, parameters = 'pilot_points'):
+    # (nrun,nobs) heads of each parameter set, in the order of par_sets
+    # parameters : 'pilot_points' (par_sets (nrun,n_pp), kriged to the grid) or 'cells' (par_sets (nrun,nrow*ncol) K)
+    par_sets = np.atleast_2d(np.asarray(par_sets, dtype = float))
+    if parameters == 'cells':
+        return np.array(list(rm['pool'].map(_worker_run_hk,par_sets)))
+    return np.array(list(rm['pool'].map(_worker_run,par_sets))) # map keeps the order of par_sets
+
+
+def stop_pool(rm):
+    rm['pool'].shutdown()
+    rm['manager'].shutdown()
+
+
+######################################
+#### RUN A BATCH OF PARAMETER SETS ###
+######################################
+def run_parallel(model_dir, par_sets, n_workers = None, engine = 'mf2005', worker_root = None):
+    ## INPUT
+    # model_dir   : path to ...\Model directory
+    # par_sets    : (nrun,n_pp) pilot point values of each run
+    # n_workers   : number of worker processes/directories (number of cpus if None)
+    # engine      : 'mf2005' or 'python', see forward_model.py
+    # worker_root : folder holding the worker directories
+    ## OUTPUT
+    # heads : (nrun,nobs) simulated heads at the observations, in the order of par_sets
+    par_sets = np.atleast_2d(np.asarray(par_sets, dtype = float))
+    if n_workers is None:
+        n_workers = os.cpu_count()
+    rm = start_pool(model_dir,min(n_workers,len(par_sets)),engine,worker_root)
+    heads = pool_run(rm,par_sets)
+    stop_pool(rm)
+    return heads
+
+
+################################################
+#### FINITE DIFFERENCE JACOBIAN (PEST STYLE) ###
+################################################
+def jacobian_runs(model_dir, hk_pp, derinc = 0.01, derinclb = 0.0, inctyp = 'relative', forcen = 'always_2',
+                  n_workers = None, engine = 'mf2005', worker_root = None):
+    ## INPUT
+    # model_dir : path to ...\Model directory
+    # hk_pp     : (n_pp,) pilot point values at which the jacobian is taken
+    # derinc    : parameter increment (DERINC of the PEST parameter group)
+    # derinclb  : lower bound of the increment (DERINCLB)
+    # inctyp    : 'relative' (increment derinc*|value|) or 'absolute' (INCTYP)
+    # forcen    : 'always_2' (forward differences, npar+1 runs) or 'always_3' (central differences, 2*npar+1 runs)
+    ## OUTPUT
+    # J     : (nobs,n_pp) jacobian d(head at obs)/d(pilot point value)
+    # heads : (nobs,) heads at hk_pp
+    hk_pp = np.asarray(hk_pp, dtype = float).reshape(-1,)
+    inc = fd_increments(hk_pp,derinc,derinclb,inctyp)
+    heads = run_parallel(model_dir,fd_par_sets(hk_pp,inc,forcen),n_workers,engine,worker_root)
+    return fd_jacobian(heads,inc,forcen)
+
+
+def fd_increments(hk_pp, derinc = 0.01, derinclb = 0.0, inctyp = 'relative'):
+    # parameter increments of a PEST parameter group (derinc, derinclb, inctyp scalars or one per parameter)
+    npar = len(hk_pp)
+    inctyp = np.broadcast_to(inctyp,(npar,))
+    if not np.all((inctyp == 'relative') | (inctyp == 'absolute')):
+        raise Exception('inctyp must be relative or absolute.')
+    inc = np.where(inctyp == 'relative',np.maximum(derinc*np.abs(hk_pp),derinclb),np.maximum(derinc*np.ones(npar),derinclb))
+    return np.where(inc == 0,derinc,inc) # parameters at zero with relative increments
+
+
+def fd_par_sets(hk_pp, inc, forcen = 'always_2'):
+    # base run followed by one (or two) perturbed runs per parameter, all in one batch
+    dpar = np.diag(inc)
+    if forcen == 'always_2':
+        return np.vstack([hk_pp[np.newaxis,:],hk_pp+dpar])
+    if forcen == 'always_3':
+        return np.vstack([hk_pp[np.newaxis,:],hk_pp+dpar,hk_pp-dpar])
+    raise Exception('forcen must be always_2 or always_3.')
+
+
+def fd_jacobian(heads, inc, forcen = 'always_2'):
+    # jacobian and base heads from the heads of the runs of fd_par_sets
+    npar = len(inc)
+    if forcen == 'always_2':
+        J = ((heads[1:npar+1,:]-heads[0,:])/inc[:,np.newaxis]).T
+    else:
+        J = ((heads[1:npar+1,:]-heads[npar+1:,:])/(2*inc[:,np.newaxis])).T
+    return J, heads[0,:]
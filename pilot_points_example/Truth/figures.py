@@ -3,7 +3,9 @@ import os
 import numpy as np
 import flopy 
 import flopy.utils.reference  as srf
-import flopy.utils.binaryfile as bf
+import sys
+sys.path.append(os.path.dirname(os.getcwd())+os.sep+'Model') # memory mapped head file reader
+from binary_heads import open_head_file, get_kstpkper, get_data
 
 
 path = np.load('modpath'+ os.sep+ 'path_ex' + os.sep+ 'path_ex_tserdata.npy')
@@ -17,9 +19,9 @@ mf           = flopy.modflow.Modflow.load(mf_path+os.sep+mf_modelname+ '.nam')
 # load K field
 hk= mf.lpf.hk.array[0,:,:]
 # load heads
-hdobj        = bf.HeadFile(mf_path+os.sep+mf_modelname+'.hds', precision = 'single')         # import heads file as flopy object ( output from modflow)
-kstpkper =hdobj.get_kstpkper()
-hds =  hdobj.get_data(kstpkper = kstpkper[0])
+hdobj        = open_head_file(mf_path+os.sep+mf_modelname+'.hds')         # memory mapped heads file ( output from modflow)
+kstpkper = get_kstpkper(hdobj)
+hds =  get_data(hdobj, kstpkper = kstpkper[-1])
 
 # create reference grid object corresponding to modflow model
 xul = -sum(mf.dis.delr)/2                   # modflow model spatial domain upper left x coordinate 
@@ -75,3 +75,43 @@ def XYZtoCell(X,Y,Z,mf,grid_ref):
     return row, col, lay, xloc, yloc, zloc
 
 
+#################################################################
+#### CONVERT GLOBAL X-Y-Z TO R-C-L AND LOCAL XYZ (VECTORIZED) ###
+#################################################################
+def XYZtoCellVec(X,Y,Z,mf,grid_ref):
+    ## INPUT
+    # X,Y,Z    : (npt,) global coordinates of particles (same coordinates as grid_ref)
+    # mf       : flopy modflow object
+    # grid_ref : flopy spatial reference object of mf
+    ## OUTPUT
+    # row, col : (npt,) zero based row and column (as XYZtoCell)
+    # lay      : (npt,) one based layer
+    # xloc, yloc, zloc : (npt,) local coordinates within the cell (0-1)
+    X = np.asarray(X,dtype = float).reshape(-1,)
+    Y = np.asarray(Y,dtype = float).reshape(-1,)
+    Z = np.asarray(Z,dtype = float).reshape(-1,)
+    delr = np.asarray(mf.dis.delr.array,dtype = float)
+    delc = np.asarray(mf.dis.delc.array,dtype = float)
+
+    # model coordinates (origin at lower left corner, handles offset and rotation)
+    xm,ym = grid_ref.transform(X.copy(),Y.copy(),inverse = True)
+    ym = sum(delc)-ym # distance from top edge of grid (rows are numbered from the top)
+
+    # cell edges along rows and columns, points on an edge go to the lower index (as get_rc). Unlike the
+    # nearest cell center used by XYZtoCell, this is the cell containing the point also on non uniform grids
+    xedge = np.concatenate([[0.0],np.cumsum(delr)])
+    yedge = np.concatenate([[0.0],np.cumsum(delc)])
+    col = np.clip(np.searchsorted(xedge,xm,side = 'left')-1,0,mf.ncol-1)
+    row = np.clip(np.searchsorted(yedge,ym,side = 'left')-1,0,mf.nrow-1)
+
+    xloc = (xm-xedge[col])/delr[col]
+    yloc = 1-(ym-yedge[row])/delc[row]
+
+    # layer from the cell bottoms below each particle, local z within that layer
+    zsurf = np.concatenate([mf.dis.top.array[np.newaxis,:,:],mf.dis.botm.array],axis = 0)[:,row,col] # (nlay+1,npt)
+    k = np.clip(np.sum(zsurf[1:,:] > Z,axis = 0),0,mf.nlay-1)
+    pts = np.arange(len(Z))
+    zloc = 1-(zsurf[k,pts]-Z)/(zsurf[k,pts]-zsurf[k+1,pts])
+    lay = k+1
+
+    return row, col, lay, xloc, yloc, zloc
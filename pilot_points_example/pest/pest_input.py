@@ -3,15 +3,14 @@ import os
 import numpy as np
 import flopy
 import flopy.utils.binaryfile as bf
-import flopy.utils.formattedfile as ff
 import flopy.utils.reference  as srf
 import shutil
+import sys
 
 # specify modflow modeldirectory and load relevant model data 
 mfdir = 'C:\PEST_examples\pilot_points_example\Model\modflow'
 mdlname  = 'example' # name of modflow model  
 mf           = flopy.modflow.Modflow.load(mfdir+os.sep+mdlname+ '.nam')               # import modflow object
-hdobj = ff.FormattedHeadFile(mfdir+os.sep+mdlname+'.hds', precision = 'single') # import heads file as flopy object ( output from modflow)
 hk = mf.lpf.hk.array # get hydraulic conductivity array (used for initial guess for parameters) 
 
 Lx =sum(mf.dis.delr.array)
@@ -21,12 +20,30 @@ yul = Ly/2
 grid_ref = flopy.utils.reference.SpatialReference(delr=mf.dis.delr, delc=mf.dis.delc, lenuni=mf.dis.lenuni ,xul = xul,yul = yul)
 
 ## load pilot point data
-fpath = 'C:\PEST_examples\pilot_points_example\Model\pilot_point_and_variogram_data.npy' # path to pilot point data
-pp = np.load(fpath).flatten()[0]
+fpath = 'C:\PEST_examples\pilot_points_example\Model\pilot_point_data' # path to pilot point data
+sys.path.append(os.path.dirname(fpath))
+from pilot_point_data import load_pp_data
+pp = load_pp_data(fpath)
 nx = pp['nx']
 ny = pp['ny']
 n_pp = pp['nx']*pp['ny'] # number of pilot points
 
+# if True, PEST writes only the pilot point values to a compact parameter file (one line per parameter)
+# instead of the full .lpf file -- must match use_pp_value_file in Model\Krige_pilot_points.py
+use_pp_value_file = True
+sys.path.append(os.path.dirname(fpath))
+from pilot_point_values import write_pp_template, write_pp_values
+from head_observations import hdsraw_columns
+from pst_io import par_data, obs_data, format_par_data, format_obs_data
+
+# if True, PEST runs the model through the persistent model server (Model\model_server.py)
+use_model_server = False
+
+# if True, PEST reads the jacobian from the external derivatives file written by Model\write_jacobian.py
+# (adjoint sensitivities of the in-process flow solver) instead of running finite difference perturbations
+# requires use_pp_value_file, as write_jacobian.py reads the pilot point values from that file
+use_external_derivatives = False
+
 
 
 
@@ -53,8 +70,13 @@ for i in np.arange(0,ny):
         param = flopy.pest.params.Params('LPF','hk',parname = name,startvalue= startvalue[i,j], lbound = lbound[i,j], ubound= ubound[i,j], span = span) 
         params.append(param)                    
 pnames_raw = pnames_raw.decode("utf-8")
-tpl = flopy.pest.templatewriter.TemplateWriter(mf,params)
-tpl.write_template()
+if use_pp_value_file:
+    # template for the pilot point value file and initial values for the first model run
+    write_pp_template(mdlname+'.ppv.tpl',pnames_raw.reshape(n_pp,))
+    write_pp_values(os.path.dirname(fpath)+os.sep+'pilot_point_values.dat',pnames_raw.reshape(n_pp,),startvalue)
+else:
+    tpl = flopy.pest.templatewriter.TemplateWriter(mf,params)
+    tpl.write_template()
 
 
 
@@ -93,13 +115,13 @@ obsnames = obsnames.decode("utf-8")
 obsnames_raw = obsnames_raw.decode("utf-8") 
 
 line_advance =  'l1' # number of lines to advance after each primary marker
-width = 11 # number of spaces occupied by each head entry
+first_col,last_col = hdsraw_columns(n_pp) # columns of the head values in the .hdsraw file (depend on the label width)
 primary_marker = delim + hds_marker +delim +'\n' # primary marker for identifying observations 
 instruction.writelines(primary_marker)
 
 for i in np.arange(0,ny):
     for j in np.arange(0,nx):
-        obstxt = obsnames[i,j]+'7:15'
+        obstxt = obsnames[i,j]+str(first_col)+':'+str(last_col)
         line = ' '.join([line_advance,obstxt])
         instruction.writelines(line + ' \n')          
 instruction.close()
@@ -141,6 +163,8 @@ PRECIS = 'single' # output precision
 DPOINT = 'point' # decimal place representation (nopoint omits redundant decimils - not reccomended)
 NUMCOM = 1 #controls how PEST takes derivatives (set to 1 normally)
 JACFILE = 0 #controls how PEST takes derivatives (set to 0 normally)
+if use_external_derivatives:
+    JACFILE = 1 # derivatives read from file written by the derivatives command line
 MESSFILE = 0 #controls how PEST takes derivatives (set to 0 normally)
 
 vals = [NTPLFLE,NINSFLE,PRECIS, DPOINT, NUMCOM, JACFILE, MESSFILE]
@@ -220,24 +244,21 @@ control.writelines(line+  '\n')
 control.writelines('* parameter data \n')
 
 #First part - one line for each estmiated parameter - -Lines 2-NPAR+2
-#for par in np.arange(0,NPAR):
-for i in np.arange(0,ny):
-    for j in np.arange(0,nx):
-        PARNME = pnames_raw[i,j] # parameter name
-        PARTRANS = 'none' # 'fixed','tied','log' (log can help inversion alot if parameter doesnt take zero or negative values)
-        PARCHGLIM = 'relative' # designate whether an adjustable parameter is relative-limited, factor-limited or absolute-limited
-        PARVAL1 = 5# Initial parameter value # hk[0,i,j]
-        PARLBND = 0.0001 # parameter lower bound
-        PARUBND = 50 # parameter upper bound
-        PARGP = 'hk' # name of parameter group param belongs to
-        SCALE = 1.0 # parameter scale
-        OFFSET = 0.0 # paramter offset
-        DERCOM = 1 # not sure exactly what this is (pg 121 of pdf)
-
-        vals = [PARNME, PARTRANS, PARCHGLIM, PARVAL1, PARLBND, PARUBND, PARGP,SCALE,OFFSET,DERCOM]
-        vals = [str(item) for item in vals]
-        line = delim.join(vals)
-        control.writelines(line+  '\n')
+# (parameter table built from the arrays and written in one call, see pst_io.py)
+PARTRANS = 'none' # 'fixed','tied','log' (log can help inversion alot if parameter doesnt take zero or negative values)
+PARCHGLIM = 'relative' # designate whether an adjustable parameter is relative-limited, factor-limited or absolute-limited
+PARVAL1 = 5# Initial parameter value # hk[0,i,j]
+PARLBND = 0.0001 # parameter lower bound
+PARUBND = 50 # parameter upper bound
+PARGP = 'hk' # name of parameter group param belongs to
+SCALE = 1.0 # parameter scale
+OFFSET = 0.0 # paramter offset
+DERCOM = 1 # not sure exactly what this is (pg 121 of pdf)
+if use_external_derivatives:
+    DERCOM = 0 # derivatives for this parameter are supplied externally
+par = par_data(pnames_raw.reshape(n_pp,),PARVAL1,PARLBND,PARUBND,PARGP,partrans = PARTRANS,parchglim = PARCHGLIM,
+               scale = SCALE,offset = OFFSET,dercom = DERCOM)
+control.write(format_par_data(par))
 # second part - one line for each tied parameter
 # no tied parameters here
 
@@ -270,33 +291,44 @@ measured_hds = np.zeros([ny,nx], dtype = float)# measured TRUTH heads at each ce
 ##X,Y = np.meshgrid(xc,yc)
 
 # get measurment value for each MODFLOW model cell
-for i in np.arange(0,ny):
-    for j in np.arange(0,nx):
-        measured_hds[i,j] = pp['head'][i,j]
-        OBSNME = obsnames_raw[i,j]  # name of observation variable
-        OBSVAL = '{:.2f}'.format(round(measured_hds[i,j],7))  # field or lab measurment corresponding to observaation variable (for obj fun)
-        WEIGHT = 1
-        OBSGNME = 'heads'
+measured_hds[:,:] = pp['head']
+OBSNME = obsnames_raw.reshape(n_pp,)  # name of observation variable
+OBSVAL = np.round(measured_hds.reshape(n_pp,),7)  # field or lab measurment corresponding to observaation variable (for obj fun)
+WEIGHT = 1
+OBSGNME = 'heads'
+obs = obs_data(OBSNME,OBSVAL,WEIGHT,OBSGNME)
+control.write(format_obs_data(obs,val_fmt = '%.2f'))
 
-        vals = [OBSNME, OBSVAL, WEIGHT, OBSGNME]
-        vals = [str(item) for item in vals]
-        line = delim.join(vals)
-        control.writelines(line+  '\n')
 
+fpath = r'C:\PEST_examples\pilot_points_example'+os.sep
+
+#Derivatives command line
+if use_external_derivatives:
+    #first line
+    control.writelines('* derivatives command line \n')
+    DERCOMLINE = fpath +r'Model\modflow\run_jacobian' # command writing the external derivatives file
+    EXTDERFLE = fpath +r'Model\modflow\example.drv' # external derivatives file
+    control.writelines(DERCOMLINE+  '\n')
+    control.writelines(EXTDERFLE+  '\n')
 
 #Model command line
 #first line
 control.writelines('* model command line \n')
 # second line (once for each NUMCOM command lines)
-fpath = r'C:\PEST_examples\pilot_points_example'+os.sep
 COMLINE = fpath +r'Model\modflow\run_model'
+if use_model_server:
+    COMLINE = fpath +r'Model\modflow\run_model_client' # requires Model\model_server.py to be running
 control.writelines(COMLINE+  '\n')
 #Model input/output
 #first line
 control.writelines('* model input/output \n')
 # one line for each template file 
-TEMPFLE = fpath +'pest\example.lpf.tpl' # name of template file 
-INFLE = fpath +'Model\modflow\example.lpf' #name of model input file corresponding to template file
+if use_pp_value_file:
+    TEMPFLE = fpath +'pest\example.ppv.tpl' # name of template file
+    INFLE = fpath +'Model\pilot_point_values.dat' #name of model input file corresponding to template file
+else:
+    TEMPFLE = fpath +'pest\example.lpf.tpl' # name of template file 
+    INFLE = fpath +'Model\modflow\example.lpf' #name of model input file corresponding to template file
 vals = [TEMPFLE, INFLE]
 vals = [str(item) for item in vals]
 line = delim.join(vals)
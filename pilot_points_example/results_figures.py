@@ -2,19 +2,22 @@ import matplotlib.pyplot as plt
 import os
 import numpy as np
 import flopy
-import flopy.utils.binaryfile as bf
 import flopy.utils.formattedfile as ff
 import flopy.utils.reference  as srf
 import shutil
+import sys
 
 fmain = 'C:\PEST_examples\pilot_points_example' # directory folder for all data used in this PEST run (MODEL, TRUTH, PEST results etc.. )
+sys.path.append(fmain+os.sep+'Model') # memory mapped head file reader
+from binary_heads import open_head_file, get_data
+from pilot_point_data import load_pp_data
 
 # Load TRUTH model  
 mfdir = fmain+os.sep+'Truth\modflow'
 mdlname  = 'example_Truth' # name of TRUTH modflow model
 mf_truth           = flopy.modflow.Modflow.load(mfdir+os.sep+mdlname+ '.nam')               # import modflow object
-hdobj_truth        = bf.HeadFile(mfdir+os.sep+mdlname+'.hds', precision = 'single')         # import heads file as flopy object ( output from modflow)
-hd_truth = hdobj_truth.get_data((2,0))[0,:,:]
+hdobj_truth        = open_head_file(mfdir+os.sep+mdlname+'.hds')         # memory mapped heads file ( output from modflow)
+hd_truth = get_data(hdobj_truth)[0,:,:] # final heads
 #hdobj_truth = ff.FormattedHeadFile(mfdir+os.sep+mdlname+'.hds', precision = 'single')
 hk_truth = mf_truth.lpf.hk.array[0,:,:] # get hydraulic conductivity array (used for initial guess for parameters)
 Lx =sum(mf_truth.dis.delr.array)
@@ -31,8 +34,8 @@ mfdir = fmain+os.sep+'Model_results\modflow'
 mdlname  = 'example_pest_results' # name of modflow model
 # load flopy modflow model   
 mf  = flopy.modflow.Modflow.load(mfdir+os.sep+mdlname+ '.nam')               # import modflow object
-hdobj_est        = bf.HeadFile(mfdir+os.sep+mdlname+'.hds', precision = 'single')
-hd_est = hdobj_est.get_data((2,0))[0,:,:]
+hdobj_est        = open_head_file(mfdir+os.sep+mdlname+'.hds')
+hd_est = get_data(hdobj_est)[0,:,:] # final heads
 #hdobj = ff.FormattedHeadFile(mfdir+os.sep+mdlname+'.hds', precision = 'single') # import heads file as flopy object ( output from modflow)
 hk_est = mf.lpf.hk.array[0,:,:] # get hydraulic conductivity array (used for initial guess for parameters) 
 grid_ref = flopy.utils.reference.SpatialReference(delr=mf.dis.delr, delc=mf.dis.delc, lenuni=mf.dis.lenuni ,xul = xul,yul = yul)
@@ -53,7 +56,7 @@ path_sim = np.load(fpath + os.sep + 'modpath'+ os.sep+ rname + os.sep+rname +'_t
 
 # load pilot point location data
 fpath = fmain + os.sep + 'Model'
-pp_data = np.load(fpath + os.sep + 'pilot_point_and_variogram_data.npy').flatten()[0]
+pp_data = load_pp_data(fpath + os.sep + 'pilot_point_data')
 
 
 
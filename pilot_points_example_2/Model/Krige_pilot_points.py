@@ -1,71 +1,121 @@
 import os
 import numpy as np
-import flopy 
-import flopy.utils.reference  as srf
 import pykrige.kriging_tools as kt
 from pykrige.ok import OrdinaryKriging
 import matplotlib.pyplot as plt
+from kriging_weights import krige_weights, save_krige_weights, load_krige_weights, apply_krige_weights, krige_weights_current
+from pilot_point_values import read_pp_values
+from hk_array import write_hk_array
+from pilot_point_data import load_pp_data, pp_data_file
 
-fmain = 'C:\PEST_examples\pilot_points_example_2'
-# load model being used with PEST
-mf_path      = fmain +os.sep+'Model'+os.sep+'modflow'
-mf_modelname = 'example'
-mf           = flopy.modflow.Modflow.load(mf_path+os.sep+mf_modelname+ '.nam')# import modflow object
-# create reference grid object corresponding to model
-xul = -sum(mf.dis.delr)/2                   # modflow model spatial domain upper left x coordinate 
-yul =  sum(mf.dis.delc)/2                   # modflow model spatial domain upper left y coordinate
-grid_ref = srf.SpatialReference(delr   = mf.dis.delr,   
-                                delc   = mf.dis.delc,
-                                lenuni = mf.dis.lenuni,
-                                xul    = xul,
-                                yul    = yul)
-
-# load current K array
-hk           = np.zeros(np.shape(mf.lpf.hk.array[0,:,:]))
-hk[:,:] = mf.lpf.hk.array[0,:,:]
-# load K field
-#hk[10:50,10:50] = 9
-
-
-# load pilot point data
-fpath = fmain +os.sep +'Model'+os.sep+'pilot_point_and_variogram_data.npy' # path to pilot point data
-pp = np.load(fpath).flatten()[0]
-n_pp = pp['nx']*pp['ny'] # number of pilot points
-
-# get hk parameter value at each pilot point
-hk_pp = hk[pp['r'],pp['c']]
+# kriging mode - if True, the kriging system is solved once and the (ncells x n_pp) weight matrix is
+# stored next to the pilot point data; later runs only multiply it by the pilot point values
+use_krige_weights = True
 
+# number of closest pilot points used to krige each cell (moving neighbourhood, sparse weight matrix)
+# None uses every pilot point for every cell (global kriging, dense weight matrix)
+n_closest = None
 
+# if True, pilot point values are read from the compact parameter file written by PEST
+# (pilot_point_values.dat, see pest_input.py) instead of from the hk array of the .lpf file
+use_pp_value_file = True
 
-# krige pilot point parameters using experimental variogram data
-OK = OrdinaryKriging(pp['x'].reshape(n_pp,),
-                     pp['y'].reshape(n_pp,),
-                     hk_pp.reshape(n_pp,),
-                     variogram_model=pp['variogram_model'],
-                     variogram_parameters = pp['variogram_parameters'],
-                     verbose=False,
-                     enable_plotting=False)
-
-# kriging predictions
-xpred = grid_ref.get_xcenter_array()+xul# get list of x of centers for cells
-ypred = grid_ref.get_ycenter_array()-yul# get list of y of centers for cells
-Xpred,Ypred = np.meshgrid(xpred,ypred) # form grid
-pred,ss = OK.execute('grid',xpred,ypred)  
-hk_krig = abs(pred.data)
-
-
+# if True, kriged hk is written to the external OPEN/CLOSE array file referenced by the .lpf file
+# (see hk_array.py and example_MF.py); together with the two options above a run needs no flopy model load
+use_hk_array_file = True
 
+fmain = 'C:\PEST_examples\pilot_points_example_2'
+# load pilot point data
+fpath = fmain +os.sep +'Model'+os.sep+'pilot_point_data' # path to pilot point data (arrays are only read if used)
+pp = load_pp_data(fpath)
+n_pp = pp['nx']*pp['ny'] # number of pilot points
 
-# update hk and rewrite .lpf file
-hknew = mf.lpf.hk.array
-hknew[0,:,:] = hk_krig
-hkout = flopy.utils.util_array.Util3d(mf,shape = (mf.nlay,mf.nrow,mf.ncol), dtype = np.float32, value = hknew, name = 'hk')
-mf.lpf.hk = hkout
-mf.lpf.fn_path = mf_path+os.sep+mf.lpf.file_name[0]
-mf.lpf.write_file()
+mf_path      = fmain +os.sep+'Model'+os.sep+'modflow'
+mf_modelname = 'example'
+wpath = os.path.dirname(fpath)+os.sep+'kriging_weights.npz'
+hk_path = mf_path+os.sep+'hk.ref'
+
+# fast run: stored kriging weights, pilot point values from file and hk written straight to the array file
+fast_run = (use_krige_weights and use_pp_value_file and use_hk_array_file and
+            krige_weights_current(wpath,pp_data_file(fpath),n_closest))
+
+if not fast_run:
+    import flopy # only needed when the model itself has to be loaded
+    import flopy.utils.reference  as srf
+
+    # load model being used with PEST
+    mf           = flopy.modflow.Modflow.load(mf_path+os.sep+mf_modelname+ '.nam')# import modflow object
+    # create reference grid object corresponding to model
+    xul = -sum(mf.dis.delr)/2                   # modflow model spatial domain upper left x coordinate 
+    yul =  sum(mf.dis.delc)/2                   # modflow model spatial domain upper left y coordinate
+    grid_ref = srf.SpatialReference(delr   = mf.dis.delr,   
+                                    delc   = mf.dis.delc,
+                                    lenuni = mf.dis.lenuni,
+                                    xul    = xul,
+                                    yul    = yul)
+
+    # load current K array
+    hk           = np.zeros(np.shape(mf.lpf.hk.array[0,:,:]))
+    hk[:,:] = mf.lpf.hk.array[0,:,:]
+    # load K field
+    #hk[10:50,10:50] = 9
 
-# retrieve updated K array for testing purposes)
-hk_new = mf.lpf.hk.array[0,:,:]
+# get hk parameter value at each pilot point
+if use_pp_value_file:
+    hk_pp = read_pp_values(os.path.dirname(fpath)+os.sep+'pilot_point_values.dat')
+else:
+    hk_pp = hk[pp['r'],pp['c']]
+
+
+
+if fast_run:
+    wts,grid_shape = load_krige_weights(wpath)
+    hk_krig = abs(apply_krige_weights(wts,grid_shape,hk_pp))
+else:
+    # kriging predictions
+    xpred = grid_ref.get_xcenter_array()+xul# get list of x of centers for cells
+    ypred = grid_ref.get_ycenter_array()-yul# get list of y of centers for cells
+    Xpred,Ypred = np.meshgrid(xpred,ypred) # form grid
+
+    if use_krige_weights:
+        # (re)build weight matrix if missing, older than the pilot point data or built for another n_closest
+        if not krige_weights_current(wpath,pp_data_file(fpath),n_closest):
+            wts = krige_weights(pp,xpred,ypred,n_closest)
+            save_krige_weights(wpath,wts,Xpred.shape,n_closest)
+        wts,grid_shape = load_krige_weights(wpath)
+        hk_krig = abs(apply_krige_weights(wts,grid_shape,hk_pp))
+    else:
+        # krige pilot point parameters using experimental variogram data
+        OK = OrdinaryKriging(pp['x'].reshape(n_pp,),
+                             pp['y'].reshape(n_pp,),
+                             hk_pp.reshape(n_pp,),
+                             variogram_model=pp['variogram_model'],
+                             variogram_parameters = pp['variogram_parameters'],
+                             verbose=False,
+                             enable_plotting=False)
+        if n_closest is None:
+            pred,ss = OK.execute('grid',xpred,ypred)
+        else:
+            pred,ss = OK.execute('grid',xpred,ypred,backend='loop',n_closest_points=n_closest)
+        hk_krig = abs(pred.data)
+
+
+
+
+if use_hk_array_file:
+    # write kriged hk to the external array file read by the .lpf file
+    write_hk_array(hk_path,hk_krig)
+else:
+    # update hk and rewrite .lpf file
+    hknew = mf.lpf.hk.array
+    hknew[0,:,:] = hk_krig
+    hkout = flopy.utils.util_array.Util3d(mf,shape = (mf.nlay,mf.nrow,mf.ncol), dtype = np.float32, value = hknew, name = 'hk')
+    mf.lpf.hk = hkout
+    mf.lpf.fn_path = mf_path+os.sep+mf.lpf.file_name[0]
+    mf.lpf.write_file()
+
+    # retrieve updated K array for testing purposes)
+    hk_new = mf.lpf.hk.array[0,:,:]
 
 
 ####
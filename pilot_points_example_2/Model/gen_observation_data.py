@@ -3,9 +3,12 @@ import os
 import numpy as np
 import flopy 
 import flopy.utils.reference  as srf
-import flopy.utils.binaryfile as bf
 import pykrige.kriging_tools as kt
 from pykrige.ok import OrdinaryKriging
+from binary_heads import open_head_file, get_kstpkper, get_data
+from grid_sampling import sampler_from_modflow, locate_points, sample_field
+from variogram import variogram_map, bin_variogram_map, fit_variogram, variogram_parameter_dict
+from pilot_point_data import save_pp_data, pp_dirname
 
 # sample TRUTH MODEL to get observtions (i.e. field measurements) for use in PEST
 # also fit variograms based on sample data for kriging step in pilot point approach
@@ -16,9 +19,9 @@ mf_path      = fmain + os.sep+'Truth'+os.sep+'modflow' # path to true model
 mf_modelname = 'example_Truth'
 mf           = flopy.modflow.Modflow.load(mf_path+os.sep+mf_modelname+ '.nam')# import modflow object
 hk= mf.lpf.hk.array[0,:,:]# load K field
-hdobj        = bf.HeadFile(mf_path+os.sep+mf_modelname+'.hds', precision = 'single')# load heads
-kstpkper =hdobj.get_kstpkper() #list of valid kstep kper from TRUTH model
-hds =  hdobj.get_data(kstpkper = kstpkper[0]) # array of heads from final timestep of SS stress period
+hdobj        = open_head_file(mf_path+os.sep+mf_modelname+'.hds')# load heads (memory mapped, see binary_heads.py)
+kstpkper = get_kstpkper(hdobj) #list of valid kstep kper from TRUTH model
+hds =  get_data(hdobj, kstpkper = kstpkper[-1]) # array of heads from final timestep of SS stress period
 
 
 # create reference grid object corresponding to TRUTH modflow model
@@ -43,32 +46,40 @@ scly = ny_samp/mf.dis.delr[0]#1E6#7.5
 xsamp = np.linspace(xul-xul/sclx,-xul+xul/sclx,nx_samp)
 ysamp = np.linspace(yul-yul/scly,-yul+yul/scly,ny_samp)
 Xsamp,Ysamp = np.meshgrid(xsamp,ysamp)
-r,c = grid_ref.get_rc(Xsamp.reshape(nsamp,),Ysamp.reshape(nsamp,))
-r = r.reshape((ny_samp,nx_samp))
-c = c.reshape((ny_samp,nx_samp))
 
 ## SAMPLE HEADS - (experimental/field data for PEST input)
 ## and SAMPLE K - (for fitting experimental variogram and kriging intermediate K values from pilot point estimates)
-hds_samp = np.zeros((ny_samp,nx_samp)) #experimental head measurements from corresponding cells in TRUTH model 
-hk_samp = np.zeros((ny_samp,nx_samp)) #experimental K measurements from corresponding cells in TRUTH model 
-for row in np.arange(0,ny_samp):
-    for col in np.arange(0,nx_samp):
-        hds_samp[row,col] = hds[0,r[row,col],c[row,col]]# Sample head 
-        hk_samp[row,col] = hk[r[row,col],c[row,col]]# Sample K  
+# 'nearest' takes the value of the TRUTH cell containing each sampling point, 'bilinear' interpolates
+# between the 4 surrounding cell centres (see grid_sampling.py)
+sample_method = 'nearest'
+truth_grid = sampler_from_modflow(mf, xul, yul)
+samp_loc = locate_points(truth_grid, Xsamp, Ysamp, sample_method) # sampling points located once, for heads and K
+r = samp_loc['r'].reshape((ny_samp,nx_samp))
+c = samp_loc['c'].reshape((ny_samp,nx_samp))
+hds_samp = sample_field(samp_loc, hds[0,:,:]) #experimental head measurements from corresponding cells in TRUTH model 
+hk_samp = sample_field(samp_loc, hk) #experimental K measurements from corresponding cells in TRUTH model 
 
 
 # Krige experimental K data
 variogram_model = 'spherical'
-OK_init = OrdinaryKriging(Xsamp.reshape(nsamp,),
-                     Ysamp.reshape(nsamp,),
-                     hk_samp.reshape(nsamp,),
-                     variogram_model=variogram_model,
-                     verbose=False,
-                     enable_plotting=False)
-
-# get variogram parameters
-sill,rng,nug = OK_init.variogram_model_parameters
-variogram_parameters = {'sill': sill, 'range': rng, 'nugget':nug}
+# 'samples' : variogram fitted by pykrige to the sampled K values
+# 'truth'   : reference variogram of the full TRUTH K grid (FFT variogram map, see variogram.py)
+variogram_source = 'samples'
+if variogram_source == 'truth':
+    gmap,npairs = variogram_map(hk)
+    lags,gamma,counts = bin_variogram_map(gmap,npairs,dx = mf.dis.delr[0],dy = mf.dis.delc[0],nbins = 30)
+    variogram_parameters = variogram_parameter_dict(fit_variogram(lags,gamma,counts,variogram_model))
+else:
+    OK_init = OrdinaryKriging(Xsamp.reshape(nsamp,),
+                         Ysamp.reshape(nsamp,),
+                         hk_samp.reshape(nsamp,),
+                         variogram_model=variogram_model,
+                         verbose=False,
+                         enable_plotting=False)
+
+    # get variogram parameters
+    sill,rng,nug = OK_init.variogram_model_parameters
+    variogram_parameters = {'sill': sill, 'range': rng, 'nugget':nug}
 
 
 #hk_pred = ax.imshow(z.data, cmap = 'jet', extent =[xul, -xul, -yul, yul])
@@ -103,7 +114,7 @@ pp = {'nx':nx_samp,
       'variogram_model':variogram_model,
       'variogram_parameters' : variogram_parameters}
 
-np.save('pilot_point_and_variogram_data', pp)
+save_pp_data(os.getcwd()+os.sep+pp_dirname, pp) # .npy arrays + json header (see pilot_point_data.py)
 
 
 
@@ -0,0 +1,102 @@
+import os
+import numpy as np
+from binary_heads import head_precision, head_index
+
+###################################################
+#### OBSERVED HEADS STRAIGHT FROM THE .HDS FILE ###
+###################################################
+# replaces the HYDMOD -> .hyd.bin -> HydmodObs -> .hdsraw chain: the heads at the observation
+# cells are read from the final head record of the binary head file (one seek and one read of
+# the span of the record holding the observation cells) and all .hdsraw lines are formatted at once.
+# the .hdsraw layout is fixed width so that pest\pest_input.py can compute the instruction columns:
+#       HEADS OUTPUT FOR USE WITH PEST
+#       obs00    10.123456
+# with observation labels 'obs' + number, padded to the number of digits of the last observation
+# (at least 2, as the HYDMOD labels obs00, obs01, ...)
+
+hdsraw_header = 'HEADS OUTPUT FOR USE WITH PEST \n'
+head_width = 12 # characters of each head value ('%12.6f')
+
+
+###########################################
+#### LOCATE THE FINAL HEAD RECORD BYTES ###
+###########################################
+def final_head_record(fname, layer = 0):
+    ## INPUT
+    # fname : MODFLOW binary head file
+    # layer : zero based layer of the observations
+    ## OUTPUT
+    # offset    : byte offset of the data of the final record of layer
+    # nrow,ncol : size of the record
+    # prec      : 4 (single) or 8 (double) bytes per value
+    prec = head_precision(fname)
+    hsize = 8+2*prec+16+12 # kstp kper pertim totim text ncol nrow ilay
+    file = open(fname,'rb')
+    header = file.read(hsize)
+    ncol,nrow = np.frombuffer(header[hsize-12:hsize-4], dtype = '<i4')
+    recsize = hsize+int(ncol)*int(nrow)*prec
+    fsize = os.path.getsize(fname)
+    offset = None
+    if fsize % recsize == 0:
+        # equal sized records: the final record is the last one, step back to the wanted layer
+        file.seek(fsize-recsize+hsize-4)
+        ilay = int(np.frombuffer(file.read(4), dtype = '<i4')[0])
+        pos = fsize-recsize*(1+ilay-1-layer)
+        if pos >= 0:
+            file.seek(pos+hsize-4)
+            if int(np.frombuffer(file.read(4), dtype = '<i4')[0]) == layer+1:
+                offset = pos+hsize
+    file.close()
+    if offset is None:
+        # records of different size (or missing layers): use the header index of binary_heads.py
+        index = head_index(fname)
+        recs = np.nonzero(index['ilay'] == layer+1)[0]
+        if len(recs) == 0:
+            raise Exception('layer '+str(layer+1)+' not found in '+fname)
+        rec = index[recs[-1]]
+        offset,nrow,ncol = int(rec['offset']),rec['nrow'],rec['ncol']
+    return offset, int(nrow), int(ncol), prec
+
+
+def read_final_heads(fname, obs_rows, obs_cols, layer = 0):
+    ## INPUT
+    # fname    : MODFLOW binary head file
+    # obs_rows : (nobs,) row of each observation cell
+    # obs_cols : (nobs,) column of each observation cell
+    # layer    : zero based layer of the observations
+    ## OUTPUT
+    # heads : (nobs,) heads of the final saved time step at the observation cells
+    offset,nrow,ncol,prec = final_head_record(fname,layer)
+    cells = np.asarray(obs_rows).ravel()*ncol+np.asarray(obs_cols).ravel()
+    first,last = np.min(cells),np.max(cells)
+    file = open(fname,'rb')
+    file.seek(offset+int(first)*prec)
+    span = np.fromfile(file, dtype = '<f4' if prec == 4 else '<f8', count = int(last-first)+1)
+    file.close()
+    return span[cells-first].astype(float)
+
+
+###################################
+#### .HDSRAW LABELS AND COLUMNS ###
+###################################
+def hdsraw_names(nobs):
+    # observation labels of the .hdsraw file
+    ndigit = max(2,len(str(nobs-1)))
+    return ['obs'+str(i).zfill(ndigit) for i in np.arange(0,nobs)]
+
+
+def hdsraw_columns(nobs):
+    # first and last (1 based) column of the head values, for the PEST instruction file
+    first = len(hdsraw_names(nobs)[-1])+2
+    return first, first+head_width-1
+
+
+def write_hdsraw(fname, heads_raw):
+    heads_raw = np.asarray(heads_raw, dtype = float).ravel()
+    names = hdsraw_names(len(heads_raw))
+    values = np.empty(2*len(heads_raw), dtype = object)
+    values[0::2] = names
+    values[1::2] = heads_raw
+    file = open(fname,'w')
+    file.write(hdsraw_header+(('%s %'+str(head_width)+'.6f \n')*len(heads_raw)) % tuple(values))
+    file.close()
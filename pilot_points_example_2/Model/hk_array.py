@@ -0,0 +1,70 @@
+import os
+import numpy as np
+
+###########################################################
+#### EXTERNAL (OPEN/CLOSE) HYDRAULIC CONDUCTIVITY ARRAY ###
+###########################################################
+# the .lpf file of the PEST model reads hk from an external array file:
+#       OPEN/CLOSE hk.ref 1.0 (FREE) -1 HK
+# so a forward run only has to rewrite that array file with the kriged hk values,
+# without loading (and rewriting) the MODFLOW model with flopy
+
+
+###############################################
+#### WRITE HK ARRAY (single bulk format call) ###
+###############################################
+def write_hk_array(fname, hk, fmt = '%15.7E'):
+    ## INPUT
+    # fname : name of array file
+    # hk    : (nrow,ncol) array of hydraulic conductivities
+    # fmt   : format of each value (free format, one model row per line)
+    hk = np.asarray(hk, dtype = float)
+    nrow,ncol = hk.shape[-2:]
+    line = ' '.join([fmt]*ncol)+'\n'
+    file = open(fname,'w')
+    file.write((line*nrow) % tuple(hk.ravel()))
+    file.close()
+
+
+###################################
+#### READ HK ARRAY (for testing) ###
+###################################
+def read_hk_array(fname):
+    return np.loadtxt(fname, ndmin = 2)
+
+
+###################################################################
+#### POINT THE .LPF FILE OF A (WRITTEN) FLOPY MODEL TO HK ARRAY(S) ###
+###################################################################
+def reference_hk_array(mf, fname = 'hk.ref'):
+    ## INPUT
+    # mf    : flopy modflow object, input files already written with mf.write_input()
+    # fname : name of external array file, relative to the model working directory
+    #         (one file per layer, layer number appended for nlay > 1)
+    lpf_path = os.path.join(mf.model_ws, mf.lpf.file_name[0])
+    file = open(lpf_path,'r')
+    lpf = file.read()
+    file.close()
+
+    fnames = []
+    pos = 0 # hk arrays are the first array of each layer block, search forward from the last one
+    for lay in np.arange(0,mf.nlay):
+        if mf.nlay == 1:
+            lay_fname = fname
+        else:
+            lay_fname = fname.replace('.ref','_'+str(lay+1)+'.ref')
+        entry = mf.lpf.hk[lay].get_file_entry()
+        idx = lpf.find(entry,pos)
+        if idx < 0:
+            raise Exception('hk array for layer '+str(lay+1)+' not found in '+lpf_path)
+        record = 'OPEN/CLOSE '+lay_fname+' 1.0 (FREE) -1 HK\n'
+        lpf = lpf[:idx] + record + lpf[idx+len(entry):]
+        pos = idx+len(record)
+
+        write_hk_array(os.path.join(mf.model_ws,lay_fname),mf.lpf.hk.array[lay,:,:])
+        fnames.append(lay_fname)
+
+    file = open(lpf_path,'w')
+    file.write(lpf)
+    file.close()
+    return fnames
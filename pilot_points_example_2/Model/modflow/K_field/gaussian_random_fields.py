@@ -8,8 +8,12 @@ from __future__ import division
 from __future__ import print_function
 
 # Main dependencies
+import os
 import numpy
 import scipy.fftpack
+import scipy.fft
+import numpy.lib.format
+from concurrent.futures import ProcessPoolExecutor
 import matplotlib
 import matplotlib.pyplot as plt
 import numpy as np
@@ -97,6 +101,347 @@ def gaussian_random_field(alpha = 3.25,
 
 
 
+def rfftind(shape):
+    """ Returns the Fourier coordinates k_y, k_x of a real 2D FFT (rfft2) of a field
+        of shape (ny, nx), scaled to the larger dimension so that for a square field
+        they are the integer coordinates returned by fftind.
+        
+        Input args:
+            shape (tuple of integers): (ny, nx) shape of the real field
+        Returns:
+            k_y, numpy array of shape (ny, 1)
+            k_x, numpy array of shape (1, nx//2 + 1)
+            
+        Example:
+        
+            print(rfftind((4, 5)))
+            
+            (array([[ 0. ], [ 1.25], [-2.5 ], [-1.25]]),
+             array([[0., 1., 2.]]))
+        """
+    ny, nx = shape
+    n = max(ny, nx)
+    k_y = numpy.fft.fftfreq(ny)[:, numpy.newaxis] * n
+    k_x = numpy.fft.rfftfreq(nx)[numpy.newaxis, :] * n
+    return( k_y, k_x )
+
+
+
+# amplitude spectra already computed in this process, keyed by (shape, alpha, dtype)
+_amplitude_cache = {}
+
+def rfft_amplitude(shape, alpha = 3.25, dtype = numpy.float64):
+    """ Returns the (cached) amplitude of the half spectrum of a real field of shape (ny, nx).
+        
+        The power law 1/|k|^(alpha/2) on the rfft2 coordinates of rfftind, with the
+        columns 0 < k_x < nx/2 scaled by 1/sqrt(2): irfft2 adds the complex conjugate
+        of each of these modes, doubling its variance, while the k_x = 0 (and Nyquist)
+        columns are taken as they are. The field then has the variance of
+        gaussian_random_field (flag_normalize = False) for a square shape.
+        Computed once per (shape, alpha, dtype) and process.
+        
+        Input args:
+            shape (tuple of integers): (ny, nx) shape of the real field
+            alpha (double, default = 3.25): 
+                The power of the power-law momentum distribution
+            dtype (numpy.float64 or numpy.float32, default = numpy.float64)
+        Returns:
+            amplitude, numpy array of shape (ny, nx//2 + 1) (read only)
+        """
+    dtype = numpy.dtype(dtype)
+    key = (tuple(shape), alpha, dtype.str)
+    if key not in _amplitude_cache:
+        amplitude = _amplitude_rows(shape, alpha, 0, shape[0]).astype(dtype)
+        amplitude.flags.writeable = False
+        _amplitude_cache[key] = amplitude
+    return _amplitude_cache[key]
+
+
+
+def _amplitude_rows(shape, alpha, r0, r1):
+    """ Returns rows r0:r1 of the half spectrum amplitude of rfft_amplitude (float64, not cached). """
+    ny, nx = shape
+    k_y, k_x = rfftind(shape)
+    amplitude = numpy.power( k_x**2 + k_y[r0:r1]**2 + 1e-10, -alpha/4.0 )
+    if r0 == 0:
+        amplitude[0,0] = 0
+    amplitude[:,1:(nx + 1)//2] /= numpy.sqrt(2)
+    return amplitude
+
+
+
+def gaussian_random_field_rect(alpha = 3.25,
+                               shape = (800, 500),
+                               flag_normalize = True,
+                               dtype = numpy.float64,
+                               seed = None):
+    """ Returns a Gaussian Random Field of arbitrary shape (ny, nx).
+        
+        Same power-law spectrum as gaussian_random_field, but generated with a
+        real inverse FFT (irfft2) of Hermitian-symmetric noise, so only the
+        (ny, nx//2 + 1) half spectrum is drawn and transformed and no square
+        field has to be generated and cropped.
+        
+        Input args:
+            alpha (double, default = 3.25): 
+                The power of the power-law momentum distribution
+            shape (tuple of integers, default = (800, 500)):
+                The (ny, nx) shape of the output Gaussian Random Field
+            flag_normalize (boolean, default = True):
+                Normalizes the Gaussian Field:
+                    - to have an average of 0.0
+                    - to have a standard deviation of 1.0
+            dtype (numpy.float64 or numpy.float32, default = numpy.float64):
+                Precision of the noise, the FFT and the output field
+                (float32 halves memory and FFT time)
+            seed (None, integer or numpy.random.SeedSequence, default = None):
+                Seed of the random generator (numpy.random.default_rng)
+
+        Returns:
+            gfield (numpy array of shape (ny, nx)):
+                The random gaussian random field
+                
+        Example:
+        import matplotlib
+        import matplotlib.pyplot as plt
+        example = gaussian_random_field_rect(shape = (800, 500))
+        plt.imshow(example)
+        """
+    dtype = numpy.dtype(dtype)
+    rng = numpy.random.default_rng(seed)
+    ny, nx = shape
+    
+        # Defines the amplitude as a power law 1/|k|^(alpha/2)
+    amplitude = rfft_amplitude(shape, alpha, dtype)
+    
+        # Draws a complex gaussian random noise on the half spectrum
+    noise = rng.standard_normal(size = (ny, nx//2 + 1), dtype = dtype) \
+        + 1j * rng.standard_normal(size = (ny, nx//2 + 1), dtype = dtype)
+    noise *= amplitude
+    
+        # To real space
+    gfield = scipy.fft.irfft2(noise, s = (ny, nx), overwrite_x = True)
+    del noise
+    
+        # Sets the standard deviation to one
+    if flag_normalize:
+        gfield -= numpy.mean(gfield, dtype = numpy.float64)
+        gfield /= numpy.std(gfield, dtype = numpy.float64)
+        
+    return gfield.astype(dtype, copy = False)
+
+
+
+def _ensemble_block(args):
+    """ Generates members idx of an ensemble into the .npy file fname (one pool task). """
+    fname, idx, entropy, alpha, shape, flag_normalize, dtype = args
+    fields = numpy.lib.format.open_memmap(fname, mode = 'r+')
+    for i in idx:
+        seed = numpy.random.SeedSequence(entropy, spawn_key = (int(i),))
+        fields[i] = gaussian_random_field_rect(alpha, shape, flag_normalize, dtype, seed)
+    fields.flush()
+    del fields
+
+
+
+def gaussian_random_field_ensemble(n_fields,
+                                   fname,
+                                   alpha = 3.25,
+                                   shape = (800, 500),
+                                   flag_normalize = True,
+                                   dtype = numpy.float32,
+                                   seed = None,
+                                   n_workers = None):
+    """ Generates an ensemble of Gaussian Random Fields into one memory-mapped .npy file.
+        
+        Member i is drawn from its own random stream, the child
+        numpy.random.SeedSequence(entropy, spawn_key = (i,)) of the ensemble seed
+        (the i-th stream of SeedSequence(seed).spawn(n_fields)), so every member can
+        be regenerated on its own and members can be generated in any order or in
+        parallel. Members are split in blocks over a process pool; every process
+        computes the amplitude spectrum once (rfft_amplitude) and writes its fields
+        straight into the memory-mapped file. When called from a script, the call
+        has to be inside an if __name__ == '__main__': block on Windows.
+        
+        Input args:
+            n_fields (integer): number of realizations N
+            fname (string): name of the .npy file holding the (N, ny, nx) ensemble
+            alpha, shape, flag_normalize, dtype: see gaussian_random_field_rect
+                (dtype defaults to float32 to halve the size of the ensemble file)
+            seed (None or integer, default = None):
+                Entropy of the ensemble seed (random if None, returned for reproducibility)
+            n_workers (integer, default = None):
+                Number of worker processes (number of cpus if None, 1 runs in this process)
+
+        Returns:
+            fields (numpy.memmap of shape (N, ny, nx)):
+                The ensemble, opened read only
+            entropy (integer):
+                Entropy of the ensemble seed, member i is reproduced by
+                gaussian_random_field_rect(..., seed = numpy.random.SeedSequence(entropy, spawn_key = (i,)))
+                
+        Example:
+        fields, entropy = gaussian_random_field_ensemble(100, 'K_ensemble.npy', seed = 1)
+        """
+    dtype = numpy.dtype(dtype)
+    entropy = numpy.random.SeedSequence(seed).entropy
+    fields = numpy.lib.format.open_memmap(fname, mode = 'w+', dtype = dtype,
+                                          shape = (n_fields,) + tuple(shape))
+    del fields
+    
+    if n_workers is None:
+        n_workers = os.cpu_count()
+    n_workers = max(1, min(n_workers, n_fields))
+    blocks = numpy.array_split(numpy.arange(n_fields), min(n_fields, 4*n_workers))
+    tasks = [(fname, idx, entropy, alpha, tuple(shape), flag_normalize, dtype) for idx in blocks]
+    if n_workers == 1:
+        for task in tasks:
+            _ensemble_block(task)
+    else:
+        pool = ProcessPoolExecutor(max_workers = n_workers)
+        list(pool.map(_ensemble_block, tasks))
+        pool.shutdown()
+        
+    return numpy.lib.format.open_memmap(fname, mode = 'r'), entropy
+
+
+
+def _slabs(n, size):
+    """ Yields (start, stop) of consecutive slabs of at most size elements along an axis of length n. """
+    size = int(max(1, size))
+    for i0 in range(0, n, size):
+        yield i0, min(i0 + size, n)
+
+
+
+def gaussian_random_field_memmap(fname,
+                                 alpha = 3.25,
+                                 shape = (800, 500),
+                                 flag_normalize = True,
+                                 dtype = numpy.float32,
+                                 seed = None,
+                                 ram_budget = 2**28):
+    """ Generates one (large) Gaussian Random Field out of core, into a memory-mapped .npy file.
+        
+        Same field as gaussian_random_field_rect (same seed gives the same field, up to
+        FFT round off), but the half spectrum is kept in a temporary disk-backed array
+        (fname + '.spec') and transformed in slabs:
+            - noise and amplitude are written in row slabs
+            - the inverse FFT along y runs on column slabs of the spectrum (in place)
+            - the inverse real FFT along x runs on row slabs, written to fname
+            - normalisation takes two passes over row slabs (mean, then standard deviation)
+        so peak memory is set by ram_budget and not by the size of the domain.
+        
+        Input args:
+            fname (string): name of the .npy file holding the (ny, nx) field
+            alpha, shape, flag_normalize, dtype, seed: see gaussian_random_field_rect
+                (dtype defaults to float32)
+            ram_budget (integer, default = 2**28):
+                Approximate number of bytes of memory used for the slabs
+
+        Returns:
+            gfield (numpy.memmap of shape (ny, nx)):
+                The random gaussian random field, opened read only
+                
+        Example:
+        example = gaussian_random_field_memmap('K_big.npy', shape = (8000, 5000), seed = 1)
+        """
+    dtype = numpy.dtype(dtype)
+    cdtype = numpy.result_type(dtype, numpy.complex64)
+    rng = numpy.random.default_rng(seed)
+    ny, nx = shape
+    nxh = nx//2 + 1
+    
+        # slab sizes (input, output and FFT work arrays of each slab within the budget)
+    row_slab = ram_budget // (4 * nxh * cdtype.itemsize)
+    col_slab = ram_budget // (4 * ny * cdtype.itemsize)
+    
+        # Draws the complex noise on the half spectrum (real parts of all rows, then
+        # imaginary parts, the same order of random numbers as gaussian_random_field_rect)
+    spec_name = fname + '.spec'
+    spec = numpy.memmap(spec_name, dtype = cdtype, mode = 'w+', shape = (ny, nxh))
+    for r0, r1 in _slabs(ny, row_slab):
+        spec[r0:r1].real = rng.standard_normal(size = (r1 - r0, nxh), dtype = dtype)
+    for r0, r1 in _slabs(ny, row_slab):
+        spec[r0:r1].imag = rng.standard_normal(size = (r1 - r0, nxh), dtype = dtype)
+        spec[r0:r1] *= _amplitude_rows(shape, alpha, r0, r1).astype(dtype)
+    
+        # Inverse FFT along y, column slabs
+    for c0, c1 in _slabs(nxh, col_slab):
+        spec[:, c0:c1] = scipy.fft.ifft(spec[:, c0:c1], axis = 0, overwrite_x = True)
+    
+        # Inverse real FFT along x, row slabs, to real space
+    gfield = numpy.lib.format.open_memmap(fname, mode = 'w+', dtype = dtype, shape = (ny, nx))
+    for r0, r1 in _slabs(ny, row_slab):
+        gfield[r0:r1] = scipy.fft.irfft(spec[r0:r1], n = nx, axis = 1)
+    del spec
+    os.remove(spec_name)
+    
+        # Sets the standard deviation to one (two passes: mean, then standard deviation)
+    if flag_normalize:
+        row_slab = ram_budget // (4 * nx * 8)
+        total = 0.0
+        for r0, r1 in _slabs(ny, row_slab):
+            total += numpy.sum(gfield[r0:r1], dtype = numpy.float64)
+        mean = total/(ny*nx)
+        total = 0.0
+        for r0, r1 in _slabs(ny, row_slab):
+            total += numpy.sum((gfield[r0:r1].astype(numpy.float64) - mean)**2)
+        std = numpy.sqrt(total/(ny*nx))
+        for r0, r1 in _slabs(ny, row_slab):
+            gfield[r0:r1] = (gfield[r0:r1] - mean)/std
+    gfield.flush()
+    del gfield
+    
+    return numpy.lib.format.open_memmap(fname, mode = 'r')
+
+
+
+def power_transform_memmap(fname_in,
+                           fname_out,
+                           power = 4,
+                           ram_budget = 2**28):
+    """ Rescales a (memory-mapped) field to [0, 1] and applies ((k + 1)**power) - 1 out of core.
+        
+        The transform used for the truth hydraulic conductivity in example_Truth_MF.py:
+            hk = hk - min(hk)
+            hk = hk/max(hk)
+            hk = ((hk + 1)**4) - 1
+        The minimum and maximum are found in a first pass over row slabs, the
+        transformed field is written to fname_out in a second pass.
+        
+        Input args:
+            fname_in (string): .npy file holding the (ny, nx) field
+            fname_out (string): .npy file for the transformed field (same dtype)
+            power (double, default = 4)
+            ram_budget (integer, default = 2**28):
+                Approximate number of bytes of memory used for the slabs
+
+        Returns:
+            hk (numpy.memmap of shape (ny, nx)):
+                The transformed field, opened read only
+        """
+    field = numpy.load(fname_in, mmap_mode = 'r')
+    ny, nx = field.shape
+    row_slab = ram_budget // (4 * nx * 8)
+    
+    kmin = numpy.inf
+    kmax = -numpy.inf
+    for r0, r1 in _slabs(ny, row_slab):
+        kmin = min(kmin, numpy.min(field[r0:r1]))
+        kmax = max(kmax, numpy.max(field[r0:r1]))
+    
+    hk = numpy.lib.format.open_memmap(fname_out, mode = 'w+', dtype = field.dtype, shape = (ny, nx))
+    for r0, r1 in _slabs(ny, row_slab):
+        slab = (field[r0:r1].astype(numpy.float64) - kmin)/(kmax - kmin)
+        hk[r0:r1] = ((slab + 1)**power) - 1
+    hk.flush()
+    del hk, field
+    
+    return numpy.lib.format.open_memmap(fname_out, mode = 'r')
+
+
+
 
 def main():
     example = gaussian_random_field()
@@ -108,11 +453,10 @@ def main():
     
     
 
-example = main()
-plt.show()
+if __name__ == '__main__':
+    example = main()
+    plt.show()
 
 #np.save('K1',example)
-##if __name__ == '__main__':
-##    main()
 
 
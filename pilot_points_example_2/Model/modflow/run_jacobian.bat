@@ -0,0 +1,2 @@
+cd /d C:\PEST_examples\pilot_points_example_2\Model 
+@C:\PEST_examples\pilot_points_example_2\Model\write_jacobian.py
@@ -0,0 +1 @@
+@C:\PEST_examples\pilot_points_example_2\Model\model_client.py
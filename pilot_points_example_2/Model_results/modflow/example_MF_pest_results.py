@@ -5,7 +5,6 @@ import os
 import shutil
 import flopy.utils.reference  as srf
 import pykrige.kriging_tools as kt
-from pykrige.ok import OrdinaryKriging
 import matplotlib.pyplot as plt
 
 
@@ -79,13 +78,9 @@ def example1_Modflow(data):
     pcg = flopy.modflow.ModflowPcg(mf)
    
     
-    # Output control
-    sp_data_OC = {}
-    for kper in range(nper):
-        for kstp in range(nstp[kper]):
-            sp_data_OC[(kper, kstp)] = ['save head',
-                                        'save drawdown',
-                                        'save budget']
+    # Output control, only what the consumers of the results output read (Model\output_control.py):
+    # final heads for results_figures.py, heads and budget of every step for MODPATH
+    sp_data_OC = plan_output_control(nper, nstp, data.get('oc_consumers', ['heads','pathline']))
             
             
     oc = flopy.modflow.ModflowOc(mf, stress_period_data=sp_data_OC,
@@ -133,7 +128,9 @@ hk = mf_pst.lpf.hk.array[0,:,:]
 
 # load pilot point location data
 fpath = fmain + os.sep + 'Model'
-pp_data = np.load(fpath + os.sep + 'pilot_point_and_variogram_data.npy').flatten()[0]
+sys.path.append(fpath)
+from pilot_point_data import load_pp_data, pp_data_file
+pp_data = load_pp_data(fpath + os.sep + 'pilot_point_data')
 nx = pp_data['nx'] # number of pilot points in x dir
 ny = pp_data['ny'] # number of pilot points in y dir
 nparams = nx*ny
@@ -141,30 +138,26 @@ nparams = nx*ny
 
 ## load estimated HK from pest results
 fpath = fmain + os.sep + 'pest'
-pest_pars = open(fpath +os.sep+'example'+'.par','r').readlines()
-hk_est = []# estimated hk's at pilot points from PEST
-
-for item in np.arange(1,nparams+1):
-    #print(float(pest_pars[item][18:45]))
-    val = '{:4f}'.format(float(pest_pars[item][18:45]),7)
-    #print(val)
-    hk_est.append(val)    
-hk_est = np.array(hk_est, dtype = float).reshape(nparams)
-
-# krige pilot point values to modflow model grid
-OK = OrdinaryKriging(pp_data['x'].reshape(nparams,),
-                     pp_data['y'].reshape(nparams,),
-                     hk_est,
-                     variogram_model=pp_data['variogram_model'],
-                     variogram_parameters = pp_data['variogram_parameters'],
-                     verbose=False,
-                     enable_plotting=False)
+sys.path.append(fpath)
+from pest_output import read_par
+pest_pars = read_par(fpath +os.sep+'example'+'.par') # parameters in the order of the control file (pilot point order)
+hk_est = pest_pars['parval1'][:nparams]# estimated hk's at pilot points from PEST
+
+# krige pilot point values to modflow model grid, with the kriging weights used during the PEST run
+# (Model\kriging_weights.npz, rebuilt if missing or out of date)
+sys.path.append(fmain + os.sep + 'Model')
+from kriging_weights import krige_weights, save_krige_weights, load_krige_weights, apply_krige_weights, krige_weights_current
+from output_control import plan_output_control
+n_closest = None # pilot points used per cell (None = all), as in Model\Krige_pilot_points.py
+wpath = fmain + os.sep + 'Model' + os.sep + 'kriging_weights.npz'
 
 xpred = grid_ref.get_xcenter_array()+xul# get list of x of centers for cells
 ypred = grid_ref.get_ycenter_array()-yul# get list of y of centers for cells
 Xpred,Ypred = np.meshgrid(xpred,ypred) # form grid
-pred,ss = OK.execute('grid',xpred,ypred) 
-hk_krig = abs(pred.data)
+if not krige_weights_current(wpath,pp_data_file(fmain + os.sep + 'Model' + os.sep + 'pilot_point_data'),n_closest):
+    save_krige_weights(wpath,krige_weights(pp_data,xpred,ypred,n_closest),Xpred.shape,n_closest)
+wts,grid_shape = load_krige_weights(wpath)
+hk_krig = abs(apply_krige_weights(wts,grid_shape,hk_est))
 
 #run model with optimized pilot point K parameters kriged to MF grid
 
@@ -0,0 +1,179 @@
+import numpy as np
+import scipy.sparse
+import scipy.sparse.linalg
+
+###########################################################
+#### IN-PROCESS STEADY STATE FLOW SOLVER (1 LAYER, LPF) ###
+###########################################################
+# block centred finite difference model equivalent to the MODFLOW model built in
+# Model\modflow\example_MF.py: one convertible layer (laytyp = 1), harmonic mean
+# inter-cell conductances (LPF default), constant heads where ibound < 0, no flow
+# where ibound = 0. Heads are solved with scipy.sparse instead of mf2005 + PCG, so a
+# forward run needs no input files, no external executable and no binary output.
+# The solution can be checked against mf2005 with validate_flow_solver in example_MF.py.
+
+
+#######################################################
+#### GRID, BOUNDARY CONDITIONS AND CELL CONNECTIONS ###
+#######################################################
+def init_flow_solver(delr, delc, top, botm, ibound, strt):
+    ## INPUT
+    # delr   : (ncol,) column widths
+    # delc   : (nrow,) row widths
+    # top    : (nrow,ncol) or scalar top elevation of the layer
+    # botm   : (nrow,ncol) or scalar bottom elevation of the layer
+    # ibound : (nrow,ncol) boundary array (<0 constant head, 0 inactive, >0 active)
+    # strt   : (nrow,ncol) starting heads (constant head values where ibound < 0)
+    ## OUTPUT
+    # fs : dict with grid data and connection arrays, passed to solve_heads
+    delr   = np.asarray(delr, dtype = float).reshape(-1,)
+    delc   = np.asarray(delc, dtype = float).reshape(-1,)
+    nrow,ncol = len(delc),len(delr)
+    ibound = np.asarray(ibound).reshape(nrow,ncol)
+    top    = np.broadcast_to(np.asarray(top, dtype = float),(nrow,ncol)).ravel()
+    botm   = np.broadcast_to(np.asarray(botm, dtype = float),(nrow,ncol)).ravel()
+    strt   = np.asarray(strt, dtype = float).reshape(nrow,ncol).ravel()
+
+    # cell numbers
+    cell = np.arange(nrow*ncol).reshape(nrow,ncol)
+    ib = ibound.ravel()
+
+    # connections along rows (cell a = (i,j), cell b = (i,j+1)) and along columns (a = (i,j), b = (i+1,j))
+    # for each: length of a and b in flow direction and width of the connecting face
+    a_r = cell[:,:-1].ravel()
+    b_r = cell[:,1:].ravel()
+    la_r = np.tile(delr[:-1],nrow)
+    lb_r = np.tile(delr[1:],nrow)
+    w_r = np.repeat(delc,ncol-1)
+
+    a_c = cell[:-1,:].ravel()
+    b_c = cell[1:,:].ravel()
+    la_c = np.repeat(delc[:-1],ncol)
+    lb_c = np.repeat(delc[1:],ncol)
+    w_c = np.tile(delr,nrow-1)
+
+    a = np.concatenate([a_r,a_c])
+    b = np.concatenate([b_r,b_c])
+    la = np.concatenate([la_r,la_c])
+    lb = np.concatenate([lb_r,lb_c])
+    w = np.concatenate([w_r,w_c])
+
+    # keep connections between two non-inactive cells with at least one active cell
+    keep = (ib[a] != 0) & (ib[b] != 0) & ((ib[a] > 0) | (ib[b] > 0))
+
+    # numbering of active cells (unknowns)
+    active = ib > 0
+    eqn = -np.ones(nrow*ncol, dtype = int)
+    eqn[active] = np.arange(np.sum(active))
+
+    fs = {'nrow'   : nrow,
+          'ncol'   : ncol,
+          'delr'   : delr,
+          'delc'   : delc,
+          'top'    : top,
+          'botm'   : botm,
+          'ibound' : ib,
+          'strt'   : strt,
+          'active' : active,
+          'eqn'    : eqn,
+          'a'      : a[keep],
+          'b'      : b[keep],
+          'la'     : la[keep],
+          'lb'     : lb[keep],
+          'w'      : w[keep]}
+    return fs
+
+
+################################################
+#### BUILD SOLVER FROM A FLOPY MODFLOW MODEL ###
+################################################
+def flow_solver_from_modflow(mf):
+    return init_flow_solver(mf.dis.delr.array,
+                            mf.dis.delc.array,
+                            mf.dis.top.array,
+                            mf.dis.botm.array[0],
+                            mf.bas6.ibound.array[0],
+                            mf.bas6.strt.array[0])
+
+
+########################################
+#### TRANSMISSIVITY AND CONDUCTANCES ###
+########################################
+def transmissivity(fs, hk, h):
+    # saturated thickness of a convertible layer: min(head,top) - bottom
+    thk = np.minimum(h,fs['top'])-fs['botm']
+    thk = np.maximum(thk,0.0)
+    return np.asarray(hk, dtype = float).ravel()*thk, thk
+
+
+def conductance(fs, T):
+    # harmonic mean inter-cell conductance (MODFLOW LPF, LAYAVG = 0)
+    Ta = T[fs['a']]
+    Tb = T[fs['b']]
+    denom = Ta*fs['lb']+Tb*fs['la']
+    C = np.zeros(len(Ta))
+    nz = denom > 0
+    C[nz] = 2.0*fs['w'][nz]*Ta[nz]*Tb[nz]/denom[nz]
+    return C
+
+
+#########################################
+#### ASSEMBLE LINEAR SYSTEM A h = rhs ###
+#########################################
+def assemble(fs, C):
+    eqn = fs['eqn']
+    a,b = fs['a'],fs['b']
+    ea,eb = eqn[a],eqn[b]
+    n = np.sum(fs['active'])
+    hfix = fs['strt'] # constant heads
+
+    # off diagonal terms between two active cells, diagonal terms for every active end of a connection
+    both = (ea >= 0) & (eb >= 0)
+    ma = ea >= 0
+    mb = eb >= 0
+    rows = np.concatenate([ea[both],eb[both],ea[ma],eb[mb]])
+    cols = np.concatenate([eb[both],ea[both],ea[ma],eb[mb]])
+    vals = np.concatenate([-C[both],-C[both],C[ma],C[mb]])
+    A = scipy.sparse.csr_matrix((vals,(rows,cols)),shape = (n,n))
+
+    # constant head neighbours go to the right hand side
+    rhs = np.zeros(n)
+    fa = ma & (eb < 0)
+    fb = mb & (ea < 0)
+    np.add.at(rhs,ea[fa],C[fa]*hfix[b[fa]])
+    np.add.at(rhs,eb[fb],C[fb]*hfix[a[fb]])
+    return A, rhs
+
+
+########################
+#### SOLVE FOR HEADS ###
+########################
+def solve_heads(fs, hk, h0 = None, hclose = 1e-6, max_iter = 50):
+    ## INPUT
+    # fs       : solver data from init_flow_solver
+    # hk       : (nrow,ncol) hydraulic conductivity
+    # h0       : (nrow,ncol) initial heads (starting heads if None)
+    # hclose   : head change criterion for the (Picard) iterations on saturated thickness
+    # max_iter : maximum number of outer iterations
+    ## OUTPUT
+    # h : (nrow,ncol) heads (hnoflo cells are returned as nan)
+    h = fs['strt'].copy() if h0 is None else np.asarray(h0, dtype = float).ravel().copy()
+    active = fs['active']
+    h[fs['ibound'] == 0] = np.nan
+    for it in np.arange(0,max_iter):
+        T,thk = transmissivity(fs,hk,h)
+        A,rhs = assemble(fs,conductance(fs,T))
+        hact = scipy.sparse.linalg.spsolve(A.tocsc(),rhs)
+        dh = np.max(np.abs(hact-h[active]))
+        h[active] = hact
+        # heads above the top of every active cell -> thickness (and solution) no longer change
+        if dh < hclose or np.all(h[active] >= fs['top'][active]):
+            break
+    return h.reshape(fs['nrow'],fs['ncol'])
+
+
+############################################
+#### HEADS AT OBSERVATION (HYDMOD) CELLS ###
+############################################
+def obs_heads(h, rows, cols):
+    return h[np.asarray(rows).ravel(),np.asarray(cols).ravel()]
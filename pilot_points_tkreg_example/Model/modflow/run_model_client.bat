@@ -0,0 +1 @@
+@C:\PEST_examples\pilot_points_tkreg_example\Model\model_client.py
@@ -0,0 +1,30 @@
+import os
+from forward_model import init_forward_model, jacobian_run
+from pilot_point_values import read_pp_values
+from adjoint_sensitivity import write_jco, write_derivatives_file
+from run_manager import jacobian_runs
+
+####################################################
+#### PEST DERIVATIVES COMMAND (ADJOINT JACOBIAN) ###
+####################################################
+# run by PEST (Model\modflow\run_jacobian.bat) in place of finite difference perturbation runs
+# when use_external_derivatives = True in pest\pest_input.py. Reads the current pilot point values
+# (pilot_point_values.dat), computes the jacobian and writes Model\modflow\example.drv (read by PEST)
+# and Model\modflow\example.jco.
+#   method = 'adjoint'  : one forward and one adjoint solve per observation (in-process flow solver)
+#   method = 'parallel' : finite differences with MODFLOW, perturbed runs spread over n_workers
+#                         cloned model directories (run_manager.py)
+
+method = 'adjoint'
+n_workers = None # number of parallel workers (number of cpus if None)
+
+if __name__ == '__main__': # required by the process pool of run_manager.py on Windows
+    model_dir = os.path.dirname(os.path.abspath(__file__))
+    if method == 'adjoint':
+        fm = init_forward_model(model_dir, engine = 'python')
+        J = jacobian_run(fm)
+    else:
+        fm = init_forward_model(model_dir, engine = 'mf2005')
+        J,heads = jacobian_runs(model_dir, read_pp_values(fm['pval_path']), n_workers = n_workers)
+        write_jco(fm['jco_path'],J,fm['parnames'],fm['obsnames'])
+        write_derivatives_file(fm['drv_path'],J)
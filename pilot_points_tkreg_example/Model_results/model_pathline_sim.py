@@ -4,10 +4,11 @@ import numpy as np
 import matplotlib.pyplot as plt
 import flopy
 import shutil
-from modpath_functions import XYZtoCell
+from modpath_functions import XYZtoCellVec
 #from modpath_functions import tser_sim
-import flopy.utils.binaryfile as bf
 import flopy.utils.reference  as srf
+sys.path.append(os.path.dirname(os.getcwd())+os.sep+'Model') # memory mapped head file reader
+from binary_heads import open_head_file, get_times
 import flopy.utils.formattedfile as ff
 
 def tser_sim(mp_data):
@@ -100,14 +101,14 @@ def tser_sim(mp_data):
     label_prefix = 'p'
     particle_labels = [label_prefix+'{}'.format(i) for i in range(1, n_particles+1)]
     sloc_data['label']= particle_labels
-    for particle in np.arange(0,n_particles):
-        sloc_data[particle]['i0']    = sloc_raw[0][particle]
-        sloc_data[particle]['j0']    = sloc_raw[1][particle]
-        sloc_data[particle]['k0']    = sloc_raw[2][particle]-1
-        sloc_data[particle]['xloc0'] = sloc_raw[3][particle]
-        sloc_data[particle]['yloc0'] = sloc_raw[4][particle]
-        sloc_data[particle]['zloc0'] = sloc_raw[5][particle]
-        #sloc_data[particle]['initialtime'] = mp_data['times'][0]
+    # fill starting locations for all particles at once (columns of the record array)
+    sloc_data['i0']    = sloc_raw[0][:n_particles]
+    sloc_data['j0']    = sloc_raw[1][:n_particles]
+    sloc_data['k0']    = np.asarray(sloc_raw[2][:n_particles])-1
+    sloc_data['xloc0'] = sloc_raw[3][:n_particles]
+    sloc_data['yloc0'] = sloc_raw[4][:n_particles]
+    sloc_data['zloc0'] = sloc_raw[5][:n_particles]
+    #sloc_data['initialtime'] = mp_data['times'][0]
     sloc.data = sloc_data
 
     sim.ref_time = mp_data['times'][0]
@@ -159,8 +160,8 @@ mf_path      = os.getcwd()+os.sep+'modflow'
 mf_modelname = 'example_pest_results'
 mf           = flopy.modflow.Modflow.load(mf_path+os.sep+mf_modelname+ '.nam')               # import modflow object
 #hdobj = ff.FormattedHeadFile(mf_path+os.sep+mf_modelname+'.hds', precision = 'single') # import heads file as flopy object ( output from modflow)
-hdobj        = bf.HeadFile(mf_path+os.sep+mf_modelname+'.hds', precision = 'single')         # import heads file as flopy object ( output from modflow)
-mf_times     = hdobj.get_times()# get list of valid solution times from modflow heads file
+hdobj        = open_head_file(mf_path+os.sep+mf_modelname+'.hds')         # memory mapped heads file ( output from modflow)
+mf_times     = get_times(hdobj)# get list of valid solution times from modflow heads file
 
 # create reference grid object corresponding to modflow model
 xul = -sum(mf.dis.delr)/2                   # modflow model spatial domain upper left x coordinate 
@@ -180,7 +181,7 @@ x = 2*[0]
 y = 2*[yul]
 z = 2*[-5]
 
-row,col,lay,xloc,yloc,zloc = XYZtoCell(x,y,z,mf,grid_ref)
+row,col,lay,xloc,yloc,zloc = XYZtoCellVec(x,y,z,mf,grid_ref)
 sloc_raw = [row,col,lay,xloc,yloc,zloc]
 times = mf_times
 rname = 'model_path_ex'
@@ -4,6 +4,9 @@ import sys
 import os
 import matplotlib.pyplot as plt
 
+sys.path.append(os.path.dirname(os.path.dirname(os.getcwd()))+os.sep+'Model') # output control planner
+from output_control import plan_output_control
+
 def example1_Modflow(data):
     modelname = data['modelname']# 'example1'
     
@@ -70,13 +73,9 @@ def example1_Modflow(data):
     lpf = flopy.modflow.ModflowLpf(mf, hk=hk, vka=vka, sy=sy, ss=ss, laytyp=laytyp,ipakcb=53)
     pcg = flopy.modflow.ModflowPcg(mf)
 
-    # Output control
-    sp_data_OC = {}
-    for kper in range(nper):
-        for kstp in range(nstp[kper]):
-            sp_data_OC[(kper, kstp)] = ['save head',
-                                        'save drawdown',
-                                        'save budget']
+    # Output control, only what the consumers of the truth output read (Model\output_control.py):
+    # final heads for the observations and figures, heads and budget of every step for MODPATH
+    sp_data_OC = plan_output_control(nper, nstp, data.get('oc_consumers', ['heads','pathline']))
             
     oc = flopy.modflow.ModflowOc(mf, stress_period_data=sp_data_OC,
                                  compact=True)
@@ -95,13 +94,36 @@ def example1_Modflow(data):
 
 
 
-# load hyraulic conductivity data
-rawK = np.load('K_field' + os.sep +'K1_n1000.npy')
+# if True, the random K field is generated directly on the 800 x 500 model grid (real FFT generator,
+# K_field\gaussian_random_fields.py) instead of cropping the stored 1000 x 1000 field K1_n1000.npy
+generate_K_field = False
+K_seed = None # seed of the generated field (None = random)
+K_dtype = np.float64 # np.float32 halves memory and FFT time for large truth domains
+# if True (with generate_K_field), the field and its transform are computed in row slabs straight to
+# disk (K_field\K_truth.npy and K_field\hk_truth.npy), so memory use is set by K_ram_budget (bytes)
+# and not by the size of the truth domain
+K_out_of_core = False
+K_ram_budget = 2**28
 
-hk_in = rawK[200:,200:700] # crok hydraulic conductivity field to fit model domain
-hk_in = hk_in - np.min(hk_in)
-hk_in = hk_in/np.amax(hk_in)
-hk_in = (((hk_in+1)**4)-1)# 25*(hk_in + 0.01)
+# load hyraulic conductivity data
+if generate_K_field and K_out_of_core:
+    sys.path.append('K_field')
+    from gaussian_random_fields import gaussian_random_field_memmap, power_transform_memmap
+    gaussian_random_field_memmap('K_field' + os.sep +'K_truth.npy', shape = (800,500), dtype = K_dtype, seed = K_seed, ram_budget = K_ram_budget)
+    power_transform_memmap('K_field' + os.sep +'K_truth.npy', 'K_field' + os.sep +'hk_truth.npy', power = 4, ram_budget = K_ram_budget)
+    hk_in = np.load('K_field' + os.sep +'hk_truth.npy', mmap_mode = 'r+') # ((hk+1)**4)-1 of the rescaled field
+else:
+    if generate_K_field:
+        sys.path.append('K_field')
+        from gaussian_random_fields import gaussian_random_field_rect
+        hk_in = gaussian_random_field_rect(shape = (800,500), dtype = K_dtype, seed = K_seed)
+    else:
+        rawK = np.load('K_field' + os.sep +'K1_n1000.npy')
+
+        hk_in = rawK[200:,200:700] # crok hydraulic conductivity field to fit model domain
+    hk_in = hk_in - np.min(hk_in)
+    hk_in = hk_in/np.amax(hk_in)
+    hk_in = (((hk_in+1)**4)-1)# 25*(hk_in + 0.01)
 
 
 #plt.imshow(rawK,cmap = 'jet')
@@ -3,9 +3,9 @@ import os
 import numpy as np
 import flopy
 import flopy.utils.binaryfile as bf
-import flopy.utils.formattedfile as ff
 import flopy.utils.reference  as srf
 import shutil
+import sys
 
 fmain ='C:\PEST_examples\pilot_points_tkreg_example' # main directory for all files
 
@@ -13,7 +13,6 @@ fmain ='C:\PEST_examples\pilot_points_tkreg_example' # main directory for all fi
 mfdir = fmain +os.sep+'Model\modflow'
 mdlname  = 'example' # name of modflow model  
 mf           = flopy.modflow.Modflow.load(mfdir+os.sep+mdlname+ '.nam')               # import modflow object
-hdobj = ff.FormattedHeadFile(mfdir+os.sep+mdlname+'.hds', precision = 'single') # import heads file as flopy object ( output from modflow)
 hk = mf.lpf.hk.array # get hydraulic conductivity array (used for initial guess for parameters) 
 
 Lx =sum(mf.dis.delr.array)
@@ -23,12 +22,43 @@ yul = Ly/2
 grid_ref = flopy.utils.reference.SpatialReference(delr=mf.dis.delr, delc=mf.dis.delc, lenuni=mf.dis.lenuni ,xul = xul,yul = yul)
 
 ## load pilot point data
-fpath = fmain +os.sep+'Model\pilot_point_and_variogram_data.npy' # path to pilot point data
-pp = np.load(fpath).flatten()[0]
+fpath = fmain +os.sep+'Model\pilot_point_data' # path to pilot point data
+sys.path.append(os.path.dirname(fpath))
+from pilot_point_data import load_pp_data
+pp = load_pp_data(fpath)
 nx = pp['nx']
 ny = pp['ny']
 n_pp = pp['nx']*pp['ny'] # number of pilot points
 
+# if True, PEST writes only the pilot point values to a compact parameter file (one line per parameter)
+# instead of the full .lpf file -- must match use_pp_value_file in Model\Krige_pilot_points.py
+use_pp_value_file = True
+sys.path.append(os.path.dirname(fpath))
+from pilot_point_values import write_pp_template, write_pp_values
+from head_observations import hdsraw_columns
+from pst_io import par_data, obs_data, format_par_data, format_obs_data, format_prior_data
+from regularisation import regularisation_operator, operator_prior
+from prior_covariance import pp_covariance, inverse_cholesky, vecchia_inverse_cholesky, covariance_prior, preferred_value_prior, write_pest_matrix, write_unc
+
+# if True, PEST runs the model through the persistent model server (Model\model_server.py)
+use_model_server = False
+
+# if True, PEST reads the jacobian from the external derivatives file written by Model\write_jacobian.py
+# (adjoint sensitivities of the in-process flow solver) instead of running finite difference perturbations
+# requires use_pp_value_file, as write_jacobian.py reads the pilot point values from that file
+use_external_derivatives = False
+
+# tikhonov regularisation (prior information) built from the pilot point coordinates, see regularisation.py
+reg_graph = 'radius' # 'radius' (the 4 neighbours of the regular pilot point lattice) or 'delaunay' (irregular networks)
+reg_operator = 'difference' # 'difference' (one article per neighbour pair) or 'laplacian' (one article per pilot point)
+reg_weight_power = None # None: all articles weighted equally, else inverse distance weights (median pair distance/distance)**power
+
+# geostatistical prior (covariance of the pilot points from the fitted variogram) as a second regularisation group regul_cov, see prior_covariance.py
+reg_covariance = None # None (no covariance prior), 'equations' (weighted prior information) or 'unc' (covariance matrix file as COVFILE of regul_cov)
+cov_factor = 'cholesky' # 'equations' only: 'cholesky' (dense, exact) or 'vecchia' (sparse, for large numbers of pilot points)
+cov_nneigh = 8 # 'vecchia' only: number of conditioning pilot points of each pilot point
+cov_taper_range = None # None, or range of the spherical taper applied to the covariance (sparse storage for non spherical variograms)
+
 
 
 
@@ -55,8 +85,13 @@ for i in np.arange(0,ny):
         param = flopy.pest.params.Params('LPF','hk',parname = name,startvalue= startvalue[i,j], lbound = lbound[i,j], ubound= ubound[i,j], span = span) 
         params.append(param)                    
 pnames_raw = pnames_raw.decode("utf-8")
-tpl = flopy.pest.templatewriter.TemplateWriter(mf,params)
-tpl.write_template()
+if use_pp_value_file:
+    # template for the pilot point value file and initial values for the first model run
+    write_pp_template(mdlname+'.ppv.tpl',pnames_raw.reshape(n_pp,))
+    write_pp_values(os.path.dirname(fpath)+os.sep+'pilot_point_values.dat',pnames_raw.reshape(n_pp,),startvalue)
+else:
+    tpl = flopy.pest.templatewriter.TemplateWriter(mf,params)
+    tpl.write_template()
 
 
 
@@ -95,13 +130,13 @@ obsnames = obsnames.decode("utf-8")
 obsnames_raw = obsnames_raw.decode("utf-8") 
 
 line_advance =  'l1' # number of lines to advance after each primary marker
-width = 11 # number of spaces occupied by each head entry
+first_col,last_col = hdsraw_columns(n_pp) # columns of the head values in the .hdsraw file (depend on the label width)
 primary_marker = delim + hds_marker +delim +'\n' # primary marker for identifying observations 
 instruction.writelines(primary_marker)
 
 for i in np.arange(0,ny):
     for j in np.arange(0,nx):
-        obstxt = obsnames[i,j]+'7:15'
+        obstxt = obsnames[i,j]+str(first_col)+':'+str(last_col)
         line = ' '.join([line_advance,obstxt])
         instruction.writelines(line + ' \n')          
 instruction.close()
@@ -109,6 +144,11 @@ instruction.close()
         
 
 
+## tikhonov regularisation operator (one row per prior information article)
+reg_op = regularisation_operator(pp['x'],pp['y'],operator = reg_operator,method = reg_graph,weight_power = reg_weight_power)
+if reg_graph == 'radius' and reg_operator == 'difference' and reg_op.shape[0] != 2*n_pp-nx-ny:
+    raise Exception('regularisation graph has '+str(reg_op.shape[0])+' pairs, the pilot point lattice has '+str(2*n_pp-nx-ny))
+
 ## create control file
 control = open(mdlname+'.pst','w')
 delim = ' '
@@ -129,8 +169,11 @@ control.writelines(line+  '\n')
 NPAR = n_pp # number of parameters
 NOBS = n_pp # number of observations
 NPARGP = 1 # number of parameter groups
-NPRIOR = 2*n_pp-pp['nx']-pp['ny'] # number of articles of prior information (set to n_pp for tihkunov reg)
+NPRIOR = reg_op.shape[0] # number of articles of prior information (one per row of the regularisation operator)
 NOBSGP = 2 # number of observation groups
+if reg_covariance is not None:
+    NPRIOR = NPRIOR+n_pp # one covariance article per pilot point
+    NOBSGP = NOBSGP+1 # regul_cov
 
 
 vals = [NPAR,NOBS,NPARGP,NPRIOR,NOBSGP]
@@ -145,6 +188,8 @@ PRECIS = 'single' # output precision
 DPOINT = 'point' # decimal place representation (nopoint omits redundant decimils - not reccomended)
 NUMCOM = 1 #controls how PEST takes derivatives (set to 1 normally)
 JACFILE = 0 #controls how PEST takes derivatives (set to 0 normally)
+if use_external_derivatives:
+    JACFILE = 1 # derivatives read from file written by the derivatives command line
 MESSFILE = 0 #controls how PEST takes derivatives (set to 0 normally)
 
 vals = [NTPLFLE,NINSFLE,PRECIS, DPOINT, NUMCOM, JACFILE, MESSFILE]
@@ -224,24 +269,21 @@ control.writelines(line+  '\n')
 control.writelines('* parameter data \n')
 
 #First part - one line for each estmiated parameter - -Lines 2-NPAR+2
-#for par in np.arange(0,NPAR):
-for i in np.arange(0,ny):
-    for j in np.arange(0,nx):
-        PARNME = pnames_raw[i,j] # parameter name
-        PARTRANS = 'none' # 'fixed','tied','log' (log can help inversion alot if parameter doesnt take zero or negative values)
-        PARCHGLIM = 'relative' # designate whether an adjustable parameter is relative-limited, factor-limited or absolute-limited
-        PARVAL1 = 5# Initial parameter value # hk[0,i,j]
-        PARLBND = 0.0001 # parameter lower bound
-        PARUBND = 50 # parameter upper bound
-        PARGP = 'hk' # name of parameter group param belongs to
-        SCALE = 1.0 # parameter scale
-        OFFSET = 0.0 # paramter offset
-        DERCOM = 1 # not sure exactly what this is (pg 121 of pdf)
-
-        vals = [PARNME, PARTRANS, PARCHGLIM, PARVAL1, PARLBND, PARUBND, PARGP,SCALE,OFFSET,DERCOM]
-        vals = [str(item) for item in vals]
-        line = delim.join(vals)
-        control.writelines(line+  '\n')
+# (parameter table built from the arrays and written in one call, see pst_io.py)
+PARTRANS = 'none' # 'fixed','tied','log' (log can help inversion alot if parameter doesnt take zero or negative values)
+PARCHGLIM = 'relative' # designate whether an adjustable parameter is relative-limited, factor-limited or absolute-limited
+PARVAL1 = 5# Initial parameter value # hk[0,i,j]
+PARLBND = 0.0001 # parameter lower bound
+PARUBND = 50 # parameter upper bound
+PARGP = 'hk' # name of parameter group param belongs to
+SCALE = 1.0 # parameter scale
+OFFSET = 0.0 # paramter offset
+DERCOM = 1 # not sure exactly what this is (pg 121 of pdf)
+if use_external_derivatives:
+    DERCOM = 0 # derivatives for this parameter are supplied externally
+par = par_data(pnames_raw.reshape(n_pp,),PARVAL1,PARLBND,PARUBND,PARGP,partrans = PARTRANS,parchglim = PARCHGLIM,
+               scale = SCALE,offset = OFFSET,dercom = DERCOM)
+control.write(format_par_data(par))
 # second part - one line for each tied parameter
 # no tied parameters here
 
@@ -257,6 +299,13 @@ control.writelines(OBGNME +' \n')
 ##control.writelines(OBGNME_prior +' \n')
 OBGNME_regul = 'regul' # observarion group name for tikuhnov regulation
 control.writelines(OBGNME_regul +' \n')
+if reg_covariance is not None:
+    OBGNME_cov = 'regul_cov' # observation group name for the covariance prior
+    COVFILE = fmain +os.sep+'pest'+os.sep+mdlname+'.cov.mat' # covariance matrix of the group ('unc' only)
+    if reg_covariance == 'unc':
+        control.writelines(OBGNME_cov +' '+COVFILE+' \n')
+    else:
+        control.writelines(OBGNME_cov +' \n')
 
 # no prior information here
 
@@ -266,50 +315,13 @@ control.writelines('* observation data \n')
 
 # one line for each observation listed in the in the PEST instruction file
 measured_hds = np.zeros([ny,nx], dtype = float)# measured TRUTH heads at each cell on MODFLOW MODEL
-for i in np.arange(0,ny):
-    for j in np.arange(0,nx):
-        measured_hds[i,j] = pp['head'][i,j]
-        OBSNME = obsnames_raw[i,j]  # name of observation variable
-        OBSVAL = '{:.2f}'.format(round(measured_hds[i,j],7))  # field or lab measurment corresponding to observaation variable (for obj fun)
-        WEIGHT = 1
-        OBSGNME = 'heads'
-
-        vals = [OBSNME, OBSVAL, WEIGHT, OBSGNME]
-        vals = [str(item) for item in vals]
-        line = delim.join(vals)
-        control.writelines(line+  '\n')
-
-# one line for each prior information article used in regularisation
-# make prior information names
-prior_lbls = np.chararray([NPRIOR],itemsize = 9)
-cnt = 0
-for row in np.arange(0,pp['ny']):
-    for col in np.arange(0,pp['nx']-1):
-        PILBL = 'prior'+str(row)+str(col)+'x'
-        prior_lbls[cnt] = PILBL
-        cnt = cnt+1
-        
-        OBSVAL = str(0.0)  # field or lab measurment corresponding to observaation variable (for obj fun)
-        WEIGHT = 1
-        OBSGNME = 'regul'
-        vals = [PILBL, OBSVAL, WEIGHT, OBSGNME]
-        vals = [str(item) for item in vals]
-        line = delim.join(vals)
-        control.writelines(line+  '\n')
-        
-for row in np.arange(0,pp['ny']-1):
-    for col in np.arange(0,pp['nx']):
-        PILBL = 'prior'+str(row)+str(col)+'y'
-        prior_lbls[cnt] = PILBL
-        cnt = cnt+1
-        OBSVAL = str(0.0)  # field or lab measurment corresponding to observaation variable (for obj fun)
-        WEIGHT = 1
-        OBSGNME = 'regul'
-        vals = [PILBL, OBSVAL, WEIGHT, OBSGNME]
-        vals = [str(item) for item in vals]
-        line = delim.join(vals)
-        control.writelines(line+  '\n')
-prior_lbls = prior_lbls.decode("utf-8")
+measured_hds[:,:] = pp['head']
+OBSNME = obsnames_raw.reshape(n_pp,)  # name of observation variable
+OBSVAL = np.round(measured_hds.reshape(n_pp,),7)  # field or lab measurment corresponding to observaation variable (for obj fun)
+WEIGHT = 1
+OBSGNME = 'heads'
+obs = obs_data(OBSNME,OBSVAL,WEIGHT,OBSGNME)
+control.write(format_obs_data(obs,val_fmt = '%.2f'))
 
 ##cnt = 0
 ##for row in np.arange(0,pp['ny']):
@@ -336,20 +348,36 @@ prior_lbls = prior_lbls.decode("utf-8")
 ##        line = delim.join(vals)
 ##        control.writelines(line+  '\n')
         
+fpath = fmain +os.sep
+
+#Derivatives command line
+if use_external_derivatives:
+    #first line
+    control.writelines('* derivatives command line \n')
+    DERCOMLINE = fpath +r'Model\modflow\run_jacobian' # command writing the external derivatives file
+    EXTDERFLE = fpath +r'Model\modflow\example.drv' # external derivatives file
+    control.writelines(DERCOMLINE+  '\n')
+    control.writelines(EXTDERFLE+  '\n')
+
 #Model command line
 #first line
 control.writelines('* model command line \n')
 # second line (once for each NUMCOM command lines)
-fpath = fmain +os.sep
 COMLINE = fpath +r'Model\modflow\run_model'
+if use_model_server:
+    COMLINE = fpath +r'Model\modflow\run_model_client' # requires Model\model_server.py to be running
 control.writelines(COMLINE+  '\n')
 
 #Model input/output
 #first line
 control.writelines('* model input/output \n')
 # one line for each template file 
-TEMPFLE = fpath +'pest\example.lpf.tpl' # name of template file 
-INFLE = fpath +'Model\modflow\example.lpf' #name of model input file corresponding to template file
+if use_pp_value_file:
+    TEMPFLE = fpath +'pest\example.ppv.tpl' # name of template file
+    INFLE = fpath +'Model\pilot_point_values.dat' #name of model input file corresponding to template file
+else:
+    TEMPFLE = fpath +'pest\example.lpf.tpl' # name of template file 
+    INFLE = fpath +'Model\modflow\example.lpf' #name of model input file corresponding to template file
 vals = [TEMPFLE, INFLE]
 vals = [str(item) for item in vals]
 line = delim.join(vals)
@@ -374,39 +402,28 @@ PIFAC = 1.0
 PIVAL = 0 # value on RHS of prior information equation
 WEIGHT = 1
 
-prior_eqns = np.chararray([NPRIOR],itemsize = 9)
-# equations for pilot params along x dir K(x)-K(x+1) = 0
-cnt = 0
-for row in np.arange(0,pp['ny']):
-    for col in np.arange(0,pp['nx']-1):
-        PILBL = prior_lbls[cnt]
-        main_pname = pnames_raw[row,col]
-        adjx_pname = pnames_raw[row,col+1]
-        eqn= ' '.join([PILBL,str(PIFAC),'*',main_pname,'-',str(PIFAC),'*',adjx_pname ,'=',str(PIVAL),str(WEIGHT),OBGNME])
-        control.writelines(eqn+' \n')
-       # print(eqn)
-        prior_eqns[cnt] = eqn
-        cnt = cnt+1
-# equations for pilot params along x dir K(x)-K(x+1) = 0
-for row in np.arange(0,pp['ny']-1):
-    for col in np.arange(0,pp['nx']):
-        PILBL = prior_lbls[cnt]
-        main_pname = pnames_raw[row,col]
-        adjy_pname = pnames_raw[row+1,col]
-        eqn= ' '.join([PILBL,str(PIFAC),'*',main_pname,'-',str(PIFAC),'*',adjx_pname ,'=',str(PIVAL),str(WEIGHT),OBGNME])
-        #print(eqn)
-        control.writelines(eqn+' \n')
-        prior_eqns[cnt] = eqn
-        cnt = cnt+1
-prior_eqns = prior_eqns.decode("utf-8")        
-
-for prior in np.arange(0,NPRIOR):
-    PILBL = 'prior'+str(prior)# prior information label
-    PIFAC = 1.0
-
-    parterms = []
-    
-    
+# equations for neighbouring pilot params PIFAC*K(i)-PIFAC*K(j) = 0 (or the laplacian of K = 0)
+prior = operator_prior(PIFAC*reg_op,pnames_raw.reshape(n_pp,),'prior',PIVAL,WEIGHT,OBGNME)
+control.write(format_prior_data(prior))
+
+# covariance prior of the pilot point values, preferred value PARVAL1 (prior mean)
+if reg_covariance == 'unc':
+    C = pp_covariance(pp['x'],pp['y'],pp['variogram_model'],pp['variogram_parameters'],cov_taper_range)
+    prior_cov = preferred_value_prior(pnames_raw.reshape(n_pp,),PARVAL1,'cov',OBGNME_cov)
+    control.write(format_prior_data(prior_cov))
+    # COVFILE rows and columns are the members of regul_cov (prior information labels cov00, ...)
+    write_pest_matrix(COVFILE,C,prior_cov['pilbl'])
+    # same matrix with parameter names, listed in the .unc file (parameter uncertainty)
+    PARCOVFILE = fmain +os.sep+'pest'+os.sep+mdlname+'.parcov.mat'
+    write_pest_matrix(PARCOVFILE,C,pnames_raw.reshape(n_pp,))
+    write_unc(mdlname+'.unc',PARCOVFILE)
+elif reg_covariance == 'equations':
+    if cov_factor == 'vecchia':
+        R = vecchia_inverse_cholesky(pp['x'],pp['y'],pp['variogram_model'],pp['variogram_parameters'],cov_taper_range,cov_nneigh)
+    else:
+        R = inverse_cholesky(pp_covariance(pp['x'],pp['y'],pp['variogram_model'],pp['variogram_parameters'],cov_taper_range))
+    prior_cov = covariance_prior(R,pnames_raw.reshape(n_pp,),PARVAL1,'cov',OBGNME_cov)
+    control.write(format_prior_data(prior_cov))
 
 
 # regularisation section
@@ -0,0 +1,132 @@
+import re
+import numpy as np
+
+#####################################################
+#### READ PEST OUTPUT FILES (.PAR .RES .REC .JCO) ###
+#####################################################
+# text files are read in one go and split on whitespace, the tokens reshaped into columns and
+# converted one column at a time (no per line parsing, no fixed character positions):
+#   .par : PRECIS DPOINT, then PARNME PARVAL SCALE OFFSET for every parameter
+#   .res : header line naming the columns, then one row per observation / prior information article
+#   .rec : run record, the phi, lambda and model call history is pulled out with regular expressions
+# the binary .jco (layout of adjoint_sensitivity.write_jco) is memory mapped: the non zero elements
+# are scattered into the (nobs,npar) jacobian with one fancy indexing call.
+
+par_file_dtype = np.dtype([('parnme','U12'),('parval1','f8'),('scale','f8'),('offset','f8')])
+jco_rec_dtype = np.dtype([('idx','<i4'),('val','<f8')])
+
+
+##################
+#### .PAR FILE ###
+##################
+def read_par(fname):
+    ## INPUT
+    # fname : PEST parameter value file (case.par, or case.par.N / case.bpa)
+    ## OUTPUT
+    # par : structured array (parnme, parval1, scale, offset), in the order of the control file
+    file = open(fname,'r')
+    tokens = file.read().split()
+    file.close()
+    cols = np.array(tokens[2:], dtype = object).reshape(-1,4).T
+    par = np.zeros(cols.shape[1], dtype = par_file_dtype)
+    par['parnme'] = cols[0].astype(str)
+    for k,field in enumerate(par_file_dtype.names[1:]):
+        par[field] = cols[k+1].astype(float)
+    return par
+
+
+##################
+#### .RES FILE ###
+##################
+def read_res(fname):
+    ## INPUT
+    # fname : PEST residuals file (case.res, or case.rei)
+    ## OUTPUT
+    # res : structured array with one field per column of the header (lower case, '*' -> '_':
+    #       name, group, measured, modelled, residual, weight_measured, ...), 'na' read as nan
+    file = open(fname,'r')
+    lines = file.read().splitlines()
+    file.close()
+    # .rei files start with a few lines of text, the table starts at the header line
+    head = [i for i,line in enumerate(lines) if line.split()[:2] == ['Name','Group']]
+    if len(head) == 0:
+        raise Exception(fname+' has no residuals table (no Name Group header line)')
+    header = [col.lower().replace('*','_') for col in lines[head[0]].split()]
+    tokens = ' '.join(lines[head[0]+1:]).split()
+    cols = np.array(tokens, dtype = object).reshape(-1,len(header)).T
+    cols[cols == 'na'] = 'nan'
+    res = np.zeros(cols.shape[1], dtype = [(col,'U20') if k < 2 else (col,'f8') for k,col in enumerate(header)])
+    for k,col in enumerate(header):
+        res[col] = cols[k].astype(str) if k < 2 else cols[k].astype(float)
+    return res
+
+
+##################
+#### .REC FILE ###
+##################
+rec_patterns = {'phi_start'   : r'Starting phi for this iteration[^:]*:\s*(\S+)',
+                'phi_lowest'  : r'Lowest phi this iteration[^:]*:\s*(\S+)',
+                'lambda'      : r'Lambda\s*=\s*(\S+)\s*----->',
+                'lambda_phi'  : r'----->\s*Phi\s*=\s*(\S+)',
+                'model_calls' : r'Model calls so far\s*:\s*(\S+)'}
+
+
+def read_rec(fname):
+    ## INPUT
+    # fname : PEST run record file (case.rec)
+    ## OUTPUT
+    # rec : dict with arrays of the values found in the record
+    #       'phi_start'   : starting objective function of each iteration
+    #       'phi_lowest'  : lowest objective function of each iteration
+    #       'lambda', 'lambda_phi' : every marquardt lambda tested and the objective function it gave
+    #       'model_calls' : model calls so far at the start of each iteration
+    #       'termination' : reason given for the end of the optimisation ('' if not finished)
+    file = open(fname,'r')
+    text = file.read()
+    file.close()
+    rec = {}
+    for key,pattern in rec_patterns.items():
+        vals = re.findall(pattern,text)
+        rec[key] = np.array([_rec_float(val) for val in vals])
+    stop = re.search(r'Optimi[sz]ation complete:\s*(.*)',text)
+    rec['termination'] = '' if stop is None else stop.group(1).strip()
+    return rec
+
+
+def _rec_float(val):
+    # values in the record may be followed by punctuation (nan if not a number)
+    try:
+        return float(val.rstrip(',;)'))
+    except ValueError:
+        return np.nan
+
+
+##################
+#### .JCO FILE ###
+##################
+def read_jco(fname):
+    ## INPUT
+    # fname : binary PEST jacobian file (case.jco, written by PEST or adjoint_sensitivity.write_jco)
+    ## OUTPUT
+    # jco : dict with 'J' (nobs,npar) jacobian, 'parnames', 'obsnames' and the name indexes
+    #       'par_index', 'obs_index' (name -> column / row of J)
+    head = np.fromfile(fname, dtype = '<i4', count = 3)
+    if head[0] >= 0:
+        raise Exception(fname+' is an old format (uncompressed) jacobian file, not supported')
+    npar,nobs,nnz = -int(head[0]),-int(head[1]),int(head[2])
+    offset = 3*4
+    rec = np.memmap(fname, dtype = jco_rec_dtype, mode = 'r', offset = offset, shape = (nnz,))
+    offset = offset+nnz*jco_rec_dtype.itemsize
+    pnames = np.memmap(fname, dtype = 'S12', mode = 'r', offset = offset, shape = (npar,))
+    onames = np.memmap(fname, dtype = 'S20', mode = 'r', offset = offset+12*npar, shape = (nobs,))
+    J = np.zeros((nobs,npar))
+    idx = np.asarray(rec['idx'],dtype = np.int64)-1 # column major, 1 based
+    J[idx % nobs,idx//nobs] = rec['val']
+    parnames = np.char.strip(np.char.decode(np.asarray(pnames),'ascii'))
+    obsnames = np.char.strip(np.char.decode(np.asarray(onames),'ascii'))
+    jco = {'J'         : J,
+           'parnames'  : parnames,
+           'obsnames'  : obsnames,
+           'par_index' : dict(zip(parnames.tolist(),range(npar))),
+           'obs_index' : dict(zip(obsnames.tolist(),range(nobs)))}
+    return jco
@@ -0,0 +1,165 @@
+import numpy as np
+import scipy.sparse as sparse
+from scipy.linalg import cholesky, solve_triangular
+from scipy.spatial import cKDTree
+from variogram import variogram_models
+from pst_io import prior_data
+from regularisation import operator_prior
+
+#############################################
+#### GEOSTATISTICAL PRIOR OF PILOT POINTS ###
+#############################################
+# prior covariance of the pilot point parameters from the variogram fitted in gen_observation_data.py
+#       C(h) = sill - gamma(h)  (h > 0),   C(0) = sill     (pykrige models, gamma includes the nugget)
+# optionally multiplied by a spherical taper of range taper_range (Furrer et al., 2006), which keeps C
+# positive definite and makes it zero beyond taper_range. The spherical model is already zero beyond
+# its range, so C is stored sparse (KD-tree pairs in range only) whenever it has a finite support.
+# the prior is passed to PEST either as
+#   'unc'       : one article per pilot point  1.0 * p_i = p0_i  in group regul_cov, with C written
+#                 to a PEST matrix file given as COVFILE of regul_cov (rows named by the article labels,
+#                 the members of the group; a copy named by the parameters is listed in a .unc file)
+#   'equations' : weighted articles R p = R p0 in group regul_cov, with R^T R = C^-1
+#                 'cholesky' : R = L^-1, L the (dense) cholesky factor of C
+#                 'vecchia'  : sparse inverse cholesky factor, each point conditioned on up to nneigh
+#                              nearest preceding points, O(npp nneigh^3) (Vecchia, 1988)
+# so the articles are independent with unit variance and PHI_regul = (p-p0)^T C^-1 (p-p0).
+
+
+#############################
+#### COVARIANCE OF POINTS ###
+#############################
+def covariance_function(variogram_model, variogram_parameters, taper_range = None):
+    ## INPUT
+    # variogram_model      : 'spherical', 'exponential' or 'gaussian'
+    # variogram_parameters : dict {'sill','range','nugget'} (pilot point data)
+    # taper_range          : range of the spherical taper (None: no taper)
+    ## OUTPUT
+    # cov     : function of distance returning the covariance
+    # support : distance beyond which cov is zero (np.inf if not compact)
+    if variogram_model not in variogram_models:
+        raise Exception('variogram_model must be spherical, exponential or gaussian.')
+    vfunc = variogram_models[variogram_model]
+    sill = variogram_parameters['sill']
+    pars = [sill-variogram_parameters['nugget'],variogram_parameters['range'],variogram_parameters['nugget']]
+    support = variogram_parameters['range'] if variogram_model == 'spherical' else np.inf
+    if taper_range is not None:
+        support = min(support,taper_range)
+
+    def cov(h):
+        h = np.asarray(h, dtype = float)
+        c = np.where(h > 0,sill-vfunc(pars,h),sill)
+        if taper_range is not None:
+            t = np.minimum(h/taper_range,1.0)
+            c = c*(1.0-1.5*t+0.5*t**3)
+        return np.where(h < support,c,0.0)
+    return cov, support
+
+
+def pp_covariance(x, y, variogram_model, variogram_parameters, taper_range = None):
+    ## INPUT
+    # x, y : pilot point coordinates (any shape, flattened in C order like the parameter names)
+    # variogram_model, variogram_parameters, taper_range : as covariance_function
+    ## OUTPUT
+    # C : (npp,npp) prior covariance, scipy.sparse csr if it has a finite support, else dense
+    xy = np.column_stack([np.asarray(x, dtype = float).ravel(),np.asarray(y, dtype = float).ravel()])
+    cov,support = covariance_function(variogram_model,variogram_parameters,taper_range)
+    npp = len(xy)
+    if np.isinf(support):
+        h = np.sqrt(np.sum((xy[:,np.newaxis,:]-xy[np.newaxis,:,:])**2,axis = 2))
+        return cov(h)
+    pairs = cKDTree(xy).query_pairs(support,output_type = 'ndarray')
+    h = np.sqrt(np.sum((xy[pairs[:,1]]-xy[pairs[:,0]])**2,axis = 1))
+    c = cov(h)
+    rows = np.concatenate([np.arange(npp),pairs[:,0],pairs[:,1]])
+    cols = np.concatenate([np.arange(npp),pairs[:,1],pairs[:,0]])
+    vals = np.concatenate([cov(np.zeros(npp)),c,c])
+    return sparse.csr_matrix((vals,(rows,cols)),shape = (npp,npp))
+
+
+####################################
+#### INVERSE CHOLESKY FACTOR (R) ###
+####################################
+def inverse_cholesky(C):
+    # R = L^-1 with C = L L^T (dense, exact): R^T R = C^-1, R lower triangular
+    C = C.toarray() if sparse.issparse(C) else np.asarray(C)
+    L = cholesky(C,lower = True)
+    R = solve_triangular(L,np.eye(len(C)),lower = True)
+    return sparse.csr_matrix(np.tril(R))
+
+
+def vecchia_inverse_cholesky(x, y, variogram_model, variogram_parameters, taper_range = None, nneigh = 8):
+    ## INPUT
+    # x, y : pilot point coordinates
+    # variogram_model, variogram_parameters, taper_range : as covariance_function
+    # nneigh : largest number of conditioning points of each pilot point
+    ## OUTPUT
+    # R : (npp,npp) sparse, row i = (p_i - sum_j b_ij p_j)/sqrt(d_i) over up to nneigh nearest
+    #     preceding points j < i, with b_i, d_i the simple kriging weights and variance: R^T R ~ C^-1
+    xy = np.column_stack([np.asarray(x, dtype = float).ravel(),np.asarray(y, dtype = float).ravel()])
+    cov,support = covariance_function(variogram_model,variogram_parameters,taper_range)
+    npp = len(xy)
+    # nearest neighbours of every point, keeping the preceding ones (about half of them)
+    k = min(npp,4*nneigh+1)
+    dist,nbr = cKDTree(xy).query(xy,k = k)
+    nbr = nbr.reshape(npp,k)
+    prev = (nbr < np.arange(npp)[:,np.newaxis]) & (np.cumsum(nbr < np.arange(npp)[:,np.newaxis],axis = 1) <= nneigh)
+    nprev = np.sum(prev,axis = 1)
+    c0 = cov(0.0)
+    rows,cols,vals = [np.arange(npp)],[np.arange(npp)],[np.full(npp,1.0)]
+    dvar = np.full(npp,c0)
+    # points with the same number of conditioning points solved together (batched kriging systems)
+    for m in np.unique(nprev[nprev > 0]):
+        pts = np.where(nprev == m)[0]
+        N = nbr[pts][prev[pts]].reshape(len(pts),m)
+        dNN = np.sqrt(np.sum((xy[N][:,:,np.newaxis,:]-xy[N][:,np.newaxis,:,:])**2,axis = 3))
+        dNi = np.sqrt(np.sum((xy[N]-xy[pts][:,np.newaxis,:])**2,axis = 2))
+        cNi = cov(dNi)
+        b = np.linalg.solve(cov(dNN),cNi[:,:,np.newaxis])[:,:,0]
+        dvar[pts] = c0-np.sum(b*cNi,axis = 1)
+        rows.append(np.repeat(pts,m))
+        cols.append(N.ravel())
+        vals.append(-b.ravel())
+    rows,cols,vals = np.concatenate(rows),np.concatenate(cols),np.concatenate(vals)
+    vals = vals/np.sqrt(dvar[rows])
+    return sparse.csr_matrix((vals,(rows,cols)),shape = (npp,npp))
+
+
+#########################################
+#### PRIOR INFORMATION AND PEST FILES ###
+#########################################
+def covariance_prior(R, parnames, p0, prefix = 'cov', obgnme = 'regul_cov'):
+    # weighted articles R p = R p0 (unit weight), one per row of R
+    p0 = np.broadcast_to(np.asarray(p0, dtype = float).ravel(),(R.shape[1],))
+    return operator_prior(R,parnames,prefix,R.dot(p0),1.0,obgnme)
+
+
+def preferred_value_prior(parnames, p0, prefix = 'cov', obgnme = 'regul_cov'):
+    # one article per parameter 1.0 * p_i = p0_i, weighted by the COVFILE of the group
+    parnames = np.asarray(parnames).ravel()
+    width = len(str(max(len(parnames)-1,0)))
+    pilbl = np.char.add(prefix,np.char.zfill(np.arange(len(parnames)).astype(str),width))
+    return prior_data(pilbl,parnames[:,np.newaxis],1.0,p0,1.0,obgnme)
+
+
+def write_pest_matrix(fname, C, names):
+    ## INPUT
+    # fname : PEST matrix file (NROW NCOL ICODE, matrix rows, then the row and column names)
+    # C     : (n,n) symmetric matrix (dense or sparse; the file itself is always dense)
+    # names : (n,) row and column names (prior information labels for a COVFILE, parameter names for a .unc file)
+    C = C.toarray() if sparse.issparse(C) else np.asarray(C)
+    file = open(fname,'w')
+    file.write('%d %d 1\n' % C.shape)
+    np.savetxt(file,C,fmt = '%.8E')
+    file.write('* row and column names\n')
+    file.write('\n'.join(np.asarray(names).ravel().tolist())+'\n')
+    file.close()
+
+
+def write_unc(fname, matfile, variance_multiplier = 1.0):
+    # PEST uncertainty file listing the covariance matrix file
+    file = open(fname,'w')
+    file.write('START COVARIANCE_MATRIX\n')
+    file.write('  file '+matfile+'\n')
+    file.write('  variance_multiplier '+str(variance_multiplier)+'\n')
+    file.write('END COVARIANCE_MATRIX\n')
+    file.close()
@@ -0,0 +1,159 @@
+import numpy as np
+
+###################################################
+#### PEST CONTROL FILE (.PST) TABLES AND READER ###
+###################################################
+# the large sections of the control file (parameter data, observation data, prior information)
+# are held in numpy structured arrays, one record per line, and written with one string
+# formatting pass per section and a single write call, instead of one writelines per parameter.
+# read_pst parses a control file back into the same arrays, so a .pst written by pest_input.py
+# (or by PEST utilities) can be checked or edited without PEST.
+#       * parameter data      PARNME PARTRANS PARCHGLIM PARVAL1 PARLBND PARUBND PARGP SCALE OFFSET DERCOM
+#                             (followed by PARNME PARTIED for tied parameters)
+#       * observation data    OBSNME OBSVAL WEIGHT OBGNME
+#       * prior information   PILBL PIFAC * PARNME + PIFAC * PARNME ... = PIVAL WEIGHT OBGNME
+
+par_dtype = np.dtype([('parnme','U12'),('partrans','U8'),('parchglim','U8'),('parval1','f8'),('parlbnd','f8'),
+                      ('parubnd','f8'),('pargp','U12'),('scale','f8'),('offset','f8'),('dercom','i4')])
+tied_dtype = np.dtype([('parnme','U12'),('partied','U12')])
+obs_dtype = np.dtype([('obsnme','U20'),('obsval','f8'),('weight','f8'),('obgnme','U12')])
+prior_dtype = np.dtype([('pilbl','U20'),('equation','O'),('pival','f8'),('weight','f8'),('obgnme','U12')])
+
+
+#########################################
+#### BUILD SECTION TABLES FROM ARRAYS ###
+#########################################
+def _table(dtype, columns):
+    # structured array from columns (arrays or scalars, broadcast to the longest column)
+    n = max([np.size(col) for col in columns.values()])
+    table = np.zeros(n, dtype = dtype)
+    for name,col in columns.items():
+        table[name] = np.broadcast_to(np.asarray(col).ravel() if np.size(col) > 1 else col,(n,))
+    return table
+
+
+def par_data(parnme, parval1, parlbnd, parubnd, pargp, partrans = 'none', parchglim = 'relative',
+             scale = 1.0, offset = 0.0, dercom = 1):
+    # parameter data table, one record per parameter (any argument may be a scalar)
+    return _table(par_dtype,{'parnme': parnme, 'partrans': partrans, 'parchglim': parchglim,
+                             'parval1': parval1, 'parlbnd': parlbnd, 'parubnd': parubnd, 'pargp': pargp,
+                             'scale': scale, 'offset': offset, 'dercom': dercom})
+
+
+def obs_data(obsnme, obsval, weight = 1.0, obgnme = 'heads'):
+    # observation data table, one record per observation
+    return _table(obs_dtype,{'obsnme': obsnme, 'obsval': obsval, 'weight': weight, 'obgnme': obgnme})
+
+
+def prior_data(pilbl, parnames, pifac, pival = 0.0, weight = 1.0, obgnme = 'regul'):
+    ## INPUT
+    # pilbl    : (nprior,) prior information labels
+    # parnames : (nprior,nterm) parameter name of each term of each article
+    # pifac    : (nprior,nterm) factor of each term
+    # pival, weight, obgnme : right hand side, weight and group (arrays or scalars)
+    ## OUTPUT
+    # prior : prior information table, the left hand side of each article as an equation string
+    parnames = np.atleast_2d(np.asarray(parnames))
+    pifac = np.broadcast_to(np.asarray(pifac, dtype = float),parnames.shape)
+    # first term with its signed factor, the following terms as + or - |factor|
+    terms = ['%s * %s' % (fac,name) for fac,name in zip(pifac[:,0].tolist(),parnames[:,0].tolist())]
+    for k in np.arange(1,parnames.shape[1]):
+        sign = np.where(pifac[:,k] < 0,'-','+')
+        terms = ['%s %s %s * %s' % (term,sgn,fac,name) for term,sgn,fac,name in
+                 zip(terms,sign.tolist(),np.abs(pifac[:,k]).tolist(),parnames[:,k].tolist())]
+    return _table(prior_dtype,{'pilbl': pilbl, 'equation': np.array(terms, dtype = object),
+                               'pival': pival, 'weight': weight, 'obgnme': obgnme})
+
+
+############################
+#### BULK SECTION FORMAT ###
+############################
+def format_par_data(par, val_fmt = '%.10G'):
+    fmt = ' '.join(['%s','%s','%s',val_fmt,val_fmt,val_fmt,'%s',val_fmt,val_fmt,'%d'])
+    rows = zip(*[par[name].tolist() for name in par_dtype.names])
+    return ''.join([fmt % row + '\n' for row in rows])
+
+
+def format_tied_data(tied):
+    return ''.join(['%s %s\n' % row for row in zip(tied['parnme'].tolist(),tied['partied'].tolist())])
+
+
+def format_obs_data(obs, val_fmt = '%.10G'):
+    fmt = '%s '+val_fmt+' %.10G %s\n'
+    rows = zip(*[obs[name].tolist() for name in obs_dtype.names])
+    return ''.join([fmt % row for row in rows])
+
+
+def format_prior_data(prior):
+    rows = zip(*[prior[name].tolist() for name in prior_dtype.names])
+    return ''.join(['%s %s = %.10G %.10G %s\n' % row for row in rows])
+
+
+############################
+#### READ A CONTROL FILE ###
+############################
+def read_pst(fname):
+    ## INPUT
+    # fname : PEST control file
+    ## OUTPUT
+    # pst : dict with one entry per section (section name in lower case, without '* '):
+    #       'parameter data'    : par_dtype array (tied parameters in 'tied parameters', tied_dtype)
+    #       'observation data'  : obs_dtype array
+    #       'prior information' : prior_dtype array
+    #       other sections      : list of lines, each a list of tokens
+    file = open(fname,'r')
+    lines = file.read().splitlines()
+    file.close()
+    if len(lines) == 0 or not lines[0].strip().lower().startswith('pcf'):
+        raise Exception(fname+' is not a PEST control file (no pcf header)')
+    sections = {}
+    name = None
+    for line in lines[1:]:
+        if line.startswith('*'):
+            name = line[1:].strip().lower()
+            sections[name] = []
+        elif name is not None and line.strip():
+            sections[name].append(line)
+
+    pst = {}
+    for name,body in sections.items():
+        if name == 'parameter data':
+            tokens = [line.split() for line in body]
+            par = [tok for tok in tokens if len(tok) >= 10]
+            tied = [tok[:2] for tok in tokens if len(tok) == 2]
+            pst[name] = _read_table(par_dtype,[tok[:10] for tok in par])
+            pst['tied parameters'] = _read_table(tied_dtype,tied)
+        elif name == 'observation data':
+            pst[name] = _read_table(obs_dtype,[line.split()[:4] for line in body])
+        elif name == 'prior information':
+            pst[name] = _read_prior(body)
+        else:
+            pst[name] = [line.split() for line in body]
+    return pst
+
+
+def _read_table(dtype, tokens):
+    # columns of string tokens converted to the dtype of each field in one call per field
+    table = np.zeros(len(tokens), dtype = dtype)
+    if len(tokens) > 0:
+        cols = np.array(tokens, dtype = object).T
+        for k,field in enumerate(dtype.names):
+            table[field] = cols[k].astype(dtype[field] if dtype[field].kind in 'fi' else str)
+    return table
+
+
+def _read_prior(body):
+    # articles may continue on lines starting with '&'
+    articles = []
+    for line in body:
+        if line.lstrip().startswith('&') and len(articles) > 0:
+            articles[-1] = articles[-1]+' '+line.lstrip()[1:]
+        else:
+            articles.append(line)
+    prior = np.zeros(len(articles), dtype = prior_dtype)
+    for i,article in enumerate(articles):
+        lhs,rhs = article.split('=')
+        tok = lhs.split()
+        pival,weight,obgnme = rhs.split()[:3]
+        prior[i] = (tok[0],' '.join(tok[1:]),float(pival),float(weight),obgnme)
+    return prior
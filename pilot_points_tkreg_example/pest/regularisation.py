@@ -0,0 +1,160 @@
+import numpy as np
+import scipy.sparse as sparse
+from scipy.spatial import cKDTree, Delaunay
+from pst_io import prior_data, prior_dtype
+
+################################################
+#### TIKHONOV REGULARISATION OF PILOT POINTS ###
+################################################
+# the prior information articles are built from the pilot point coordinates only, so the
+# pilot points do not need to lie on a regular nx x ny lattice:
+#   1) neighbour graph (neighbour_pairs): every pair of pilot points that are neighbours, from
+#      'radius' : all pairs closer than max_dist (KD-tree, default slightly more than the spacing
+#                 along x and along y -> the 4 neighbours of a regular lattice)
+#      'delaunay' : edges of the Delaunay triangulation (irregular networks)
+#   2) sparse operator of the graph (scipy.sparse, one row per prior information article)
+#      'difference' : one row per pair,   w_ij*(p_i - p_j) = 0
+#      'laplacian'  : one row per point,  sum_j w_ij*(p_i - p_j) = 0
+#      with w_ij = 1, or distance based weights (distance_weights)
+#   3) prior information table (operator_prior) written with pst_io.format_prior_data
+# neighbour searches are KD-tree / Delaunay (n log n), never all n^2 pairs.
+
+
+##########################
+#### PILOT POINT GRAPH ###
+##########################
+def neighbour_pairs(x, y, method = 'radius', max_dist = None):
+    ## INPUT
+    # x, y     : pilot point coordinates (any shape, flattened in C order like the parameter names)
+    # method   : 'radius' or 'delaunay'
+    # max_dist : 'radius' - largest distance of neighbours (None: 1.01 x the spacing along each axis
+    #                       from axis_spacing -> the 4 neighbours of a regular lattice, also if dx != dy)
+    #            'delaunay' - edges longer than max_dist are dropped (None keeps all edges)
+    ## OUTPUT
+    # pairs : (npairs,2) point indices i < j of every neighbour pair, sorted
+    # dist  : (npairs,) distance of each pair
+    xy = np.column_stack([np.asarray(x, dtype = float).ravel(),np.asarray(y, dtype = float).ravel()])
+    if method == 'radius':
+        if max_dist is None:
+            # search in coordinates scaled by the spacing along x and along y, radius 1.01
+            pairs = cKDTree(xy/axis_spacing(xy)).query_pairs(1.01,output_type = 'ndarray')
+        else:
+            pairs = cKDTree(xy).query_pairs(max_dist,output_type = 'ndarray')
+    elif method == 'delaunay':
+        tri = Delaunay(xy).simplices
+        pairs = np.concatenate([tri[:,[0,1]],tri[:,[1,2]],tri[:,[0,2]]])
+    else:
+        raise Exception('method must be radius or delaunay.')
+    pairs = np.sort(pairs.reshape(-1,2),axis = 1)
+    # unique pairs, in order of first point then second point
+    key = np.unique(pairs[:,0].astype(np.int64)*len(xy)+pairs[:,1])
+    pairs = np.column_stack([key//len(xy),key % len(xy)]).astype(int)
+    dist = np.sqrt(np.sum((xy[pairs[:,1]]-xy[pairs[:,0]])**2,axis = 1))
+    if method == 'delaunay' and max_dist is not None:
+        keep = dist <= max_dist
+        pairs,dist = pairs[keep],dist[keep]
+    return pairs, dist
+
+
+def axis_spacing(xy, k = 17):
+    ## INPUT
+    # xy : (npts,2) pilot point coordinates
+    # k  : number of nearest points searched for the neighbours of each point
+    ## OUTPUT
+    # spacing : (2,) largest nearest neighbour distance along x (|dx| >= |dy|) and along y (|dy| > |dx|)
+    #           over all points, the dx and dy of a regular lattice
+    k = min(len(xy),k)
+    dnn,inn = cKDTree(xy).query(xy,k = k)
+    dnn,inn = dnn.reshape(len(xy),k)[:,1:],inn.reshape(len(xy),k)[:,1:]
+    d = np.abs(xy[inn]-xy[:,np.newaxis,:])
+    spacing = np.zeros(2)
+    for axis,cone in enumerate([d[:,:,0] >= d[:,:,1],d[:,:,1] > d[:,:,0]]):
+        nearest = np.amin(np.where(cone,dnn,np.inf),axis = 1)
+        nearest = nearest[np.isfinite(nearest)]
+        spacing[axis] = np.amax(nearest) if len(nearest) > 0 else 0.0
+    if np.all(spacing == 0):
+        raise Exception('pilot points without neighbours, give max_dist.')
+    # no neighbours along one axis (single row or column of points): same spacing as the other axis
+    spacing[spacing == 0] = np.amax(spacing)
+    return spacing
+
+
+def distance_weights(dist, power = 1.0):
+    # inverse distance weights (median pair weighted 1): close neighbours are tied more strongly
+    return (np.median(dist)/dist)**power
+
+
+#########################
+#### SPARSE OPERATORS ###
+#########################
+def difference_operator(npts, pairs, weights = None):
+    ## INPUT
+    # npts    : number of pilot points
+    # pairs   : (npairs,2) neighbour pairs from neighbour_pairs
+    # weights : (npairs,) weight of each pair (1 if None)
+    ## OUTPUT
+    # D : (npairs,npts) sparse operator, row k = w_k*(p_i - p_j)
+    w = np.ones(len(pairs)) if weights is None else np.asarray(weights, dtype = float)
+    rows = np.repeat(np.arange(len(pairs)),2)
+    cols = pairs.ravel()
+    vals = np.column_stack([w,-w]).ravel()
+    return sparse.csr_matrix((vals,(rows,cols)),shape = (len(pairs),npts))
+
+
+def laplacian_operator(npts, pairs, weights = None):
+    ## INPUT
+    # as difference_operator
+    ## OUTPUT
+    # L : (npts,npts) sparse graph laplacian, row i = sum_j w_ij*(p_i - p_j)
+    w = np.ones(len(pairs)) if weights is None else np.asarray(weights, dtype = float)
+    W = sparse.coo_matrix((np.concatenate([w,w]),(pairs.T.ravel(),pairs[:,::-1].T.ravel())),shape = (npts,npts))
+    L = sparse.diags(np.asarray(W.sum(axis = 1)).ravel())-W
+    return sparse.csr_matrix(L)
+
+
+def regularisation_operator(x, y, operator = 'difference', method = 'radius', max_dist = None, weight_power = None):
+    # neighbour graph of the pilot points and its sparse operator (weight_power None: unit weights)
+    pairs,dist = neighbour_pairs(x,y,method,max_dist)
+    weights = None if weight_power is None else distance_weights(dist,weight_power)
+    npts = np.size(x)
+    if operator == 'difference':
+        return difference_operator(npts,pairs,weights)
+    if operator == 'laplacian':
+        return laplacian_operator(npts,pairs,weights)
+    raise Exception('operator must be difference or laplacian.')
+
+
+######################################
+#### PRIOR INFORMATION OF OPERATOR ###
+######################################
+def operator_prior(op, parnames, prefix = 'prior', pival = 0.0, weight = 1.0, obgnme = 'regul'):
+    ## INPUT
+    # op       : (nprior,npar) sparse operator, one prior information article per row
+    # parnames : (npar,) parameter names (same order as the operator columns)
+    # prefix   : prior information label prefix (labels prefix + zero padded row number)
+    # pival, weight, obgnme : right hand side, article weight and group
+    ## OUTPUT
+    # prior : prior information table (pst_io.prior_dtype)
+    op = sparse.csr_matrix(op)
+    op.eliminate_zeros()
+    op.sort_indices()
+    parnames = np.asarray(parnames).ravel()
+    nprior = op.shape[0]
+    width = len(str(max(nprior-1,0)))
+    if len(prefix)+width > 20:
+        raise Exception('prior information labels longer than 20 characters, use a shorter prefix.')
+    pilbl = np.char.add(prefix,np.char.zfill(np.arange(nprior).astype(str),width))
+    pival = np.broadcast_to(pival,(nprior,))
+    weight = np.broadcast_to(weight,(nprior,))
+    obgnme = np.broadcast_to(obgnme,(nprior,))
+    # articles with the same number of terms are built together (one group per term count)
+    nterm = np.diff(op.indptr)
+    prior = np.zeros(nprior, dtype = prior_dtype)
+    for k in np.unique(nterm):
+        if k == 0:
+            raise Exception('operator row without terms (isolated pilot point?)')
+        rows = np.where(nterm == k)[0]
+        idx = op.indptr[rows][:,np.newaxis]+np.arange(k)
+        prior[rows] = prior_data(pilbl[rows],parnames[op.indices[idx]],op.data[idx],
+                                 pival[rows],weight[rows],obgnme[rows])
+    return prior